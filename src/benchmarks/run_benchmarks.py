@@ -0,0 +1,178 @@
+import argparse
+import json
+import logging
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import scipy
+import sklearn
+from sklearn.ensemble import RandomForestRegressor
+
+from src.benchmarks.synthetic_data import default_vocabulary_sizes, SyntheticTmdbGenerator
+from src.core import parsed_column, pipeline_loading, sparse_encoding, tools
+from src.core.one_hot_encoding import OneHotEncodingColumn
+from src.core.pipeline_transforming import get_date_information, PipelineTransforming
+from src.utils import constants
+from src.utils.logger import logger
+
+# a benchmark is slower than the reference when its ratio is above this threshold
+threshold_regression = 1.10
+
+
+def clear_caches() -> None:
+    # each run starts without the simplified names of the previous runs (the parsed columns only live during a run)
+    tools.get_name_simplifier.cache_clear()
+
+
+def measure(name: str, function, repeats: int) -> dict:
+    # timing runs first, then one run with tracemalloc (which slows down the code) for the peak memory
+    wall_times, cpu_times = list(), list()
+    for _ in range(repeats):
+        clear_caches()
+        start_wall_time, start_cpu_time = time.perf_counter(), time.process_time()
+        function()
+        wall_times.append(time.perf_counter() - start_wall_time)
+        cpu_times.append(time.process_time() - start_cpu_time)
+
+    clear_caches()
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    clear_caches()
+
+    result = {'name': name, 'repeats': repeats,
+              'wall_time_min': min(wall_times), 'wall_time_median': statistics.median(wall_times),
+              'cpu_time_median': statistics.median(cpu_times), 'peak_memory_mb': peak_memory / 2 ** 20}
+    logger.info(f'{name}: {result["wall_time_median"]:.3f}s (median), {result["peak_memory_mb"]:.1f}MB (peak)')
+    return result
+
+
+def get_benchmarks(training_df: pd.DataFrame, testing_df: pd.DataFrame, nb_trees: int) -> dict:
+    def encode(col: str, encode_method: str, *arguments, id_name_col: str = 'id', prefix: str = 'p',
+               threshold_popularity: int = 0):
+        @parsed_column.cache_scope()
+        def function():
+            encoding_procedure_col = OneHotEncodingColumn(training_df[col], testing_df[col], id_name_col, prefix,
+                                                          threshold_popularity)
+            for type_dataset in ['training', 'testing']:
+                getattr(encoding_procedure_col, encode_method)(type_dataset, *arguments)
+        return function
+
+    both_series = lambda col: [training_df[col], testing_df[col]]
+    companies_names = list(tools.get_unique_values_from_series(training_df['production_companies'], 'id').values())
+
+    # the model benchmarks need the transformed dfs
+    transformed_training_df, transformed_testing_df = PipelineTransforming(training_df, testing_df).clean_dfs()
+    training_matrix = sparse_encoding.get_features_matrix(transformed_training_df.drop(['revenue'], axis=1))
+    testing_matrix = sparse_encoding.get_features_matrix(transformed_testing_df)
+    rf = RandomForestRegressor(n_estimators=nb_trees, random_state=42)
+    pipeline_loading.train_model(transformed_training_df, rf)
+
+    return {
+        'parsed_column.from_series[crew]': lambda: parsed_column.ParsedColumn.from_series(training_df['crew']),
+        'tools.get_unique_values_from_series[production_companies]':
+            lambda: tools.get_unique_values_from_series(training_df['production_companies'], 'id'),
+        'tools.simplify_names[production_companies]':
+            lambda: tools.simplify_names(companies_names, constants.useless_info_inside_title),
+        'tools.get_unique_famous_names[Keywords]':
+            lambda: tools.get_unique_famous_names(both_series('Keywords'), dict(), 25),
+        'tools.get_unique_specific_jobs[crew]':
+            lambda: tools.get_unique_specific_jobs(both_series('crew'), ['Director', 'Producer'], 5),
+        'OneHotEncodingColumn.encode_series_representing_as_dict[genres]':
+            encode('genres', 'encode_series_representing_as_dict'),
+        'OneHotEncodingColumn.encode_series_representing_as_dict[belongs_to_collection]':
+            encode('belongs_to_collection', 'encode_series_representing_as_dict'),
+        'OneHotEncodingColumn.encode_series_with_most_popular[production_companies]':
+            encode('production_companies', 'encode_series_with_most_popular', True, threshold_popularity=15),
+        'OneHotEncodingColumn.encode_series_with_most_popular[Keywords]':
+            encode('Keywords', 'encode_series_with_most_popular', False, threshold_popularity=25),
+        'OneHotEncodingColumn.encode_series_with_characters_description[crew]':
+            encode('crew', 'encode_series_with_characters_description', id_name_col=None, prefix=None),
+        'OneHotEncodingColumn.encode_series_with_hashing[production_companies]':
+            encode('production_companies', 'encode_series_with_hashing', 2 ** 9, True, True),
+        'OneHotEncodingColumn.encode_series_with_hashing[Keywords]':
+            encode('Keywords', 'encode_series_with_hashing', 2 ** 10, True),
+        'OneHotEncodingColumn.encode_series_with_hashing[crew]':
+            encode('crew', 'encode_series_with_hashing', 2 ** 10, True, False, True, id_name_col=None,
+                   prefix='crew'),
+        'OneHotEncodingColumn.encode_series_representing_as_item[original_language]':
+            encode('original_language', 'encode_series_representing_as_item', [], id_name_col=None, prefix=''),
+        'OneHotEncodingColumn.encode_series_with_target_statistics[Keywords]':
+            encode('Keywords', 'encode_series_with_target_statistics', training_df['revenue'].to_numpy(), 10),
+        'OneHotEncodingColumn.encode_series_with_target_statistics[crew]':
+            encode('crew', 'encode_series_with_target_statistics', training_df['revenue'].to_numpy(), 10,
+                   prefix='crew'),
+        'pipeline_transforming.get_date_information[release_date]':
+            lambda: get_date_information(training_df['release_date']),
+        'PipelineTransforming.clean_dfs': lambda: PipelineTransforming(training_df, testing_df).clean_dfs(),
+        'sparse_encoding.get_features_matrix[training]':
+            lambda: sparse_encoding.get_features_matrix(transformed_training_df),
+        'pipeline_loading.train_model':
+            lambda: pipeline_loading.train_model(transformed_training_df,
+                                                 RandomForestRegressor(n_estimators=nb_trees, random_state=42)),
+        'RandomForestRegressor.predict[testing]': lambda: rf.predict(testing_matrix),
+        'RandomForestRegressor.fit[matrix]':
+            lambda: RandomForestRegressor(n_estimators=nb_trees, random_state=42).fit(
+                training_matrix, transformed_training_df['revenue']),
+    }
+
+
+def compare_reports(report: dict, reference_report: dict) -> None:
+    reference_results = {result['name']: result for result in reference_report['results']}
+    for result in report['results']:
+        reference_result = reference_results.get(result['name'])
+        if reference_result is None:
+            continue
+        ratio_time = result['wall_time_median'] / max(reference_result['wall_time_median'], 1e-9)
+        ratio_memory = result['peak_memory_mb'] / max(reference_result['peak_memory_mb'], 1e-9)
+        status = 'REGRESSION' if max(ratio_time, ratio_memory) > threshold_regression else 'ok'
+        logger.info(f'{status} {result["name"]}: time x{ratio_time:.2f}, peak memory x{ratio_memory:.2f}')
+
+
+def main(arguments: [str] = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description='Benchmark of the encoding & modelling hot paths')
+    parser.add_argument('--nb-rows-training', type=int, default=3000)
+    parser.add_argument('--nb-rows-testing', type=int, default=4398)
+    parser.add_argument('--vocabulary-scale', type=float, default=1.0,
+                        help='multiply the number of distinct entities of each column')
+    parser.add_argument('--nb-trees', type=int, default=25)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--only', default='', help='only run the benchmarks whose name contains this text')
+    parser.add_argument('--output', default=constants.path_benchmark_report_file)
+    parser.add_argument('--compare', default=None, help='previous report to compare with')
+    args = parser.parse_args(arguments)
+    logger.setLevel(logging.INFO)
+
+    # generate the data
+    generator = SyntheticTmdbGenerator(
+        {col: max(1, int(size * args.vocabulary_scale)) for col, size in default_vocabulary_sizes.items()})
+    training_df = generator.generate_df(args.nb_rows_training)
+    testing_df = generator.generate_df(args.nb_rows_testing, with_label=False)
+
+    # run the benchmarks
+    results = [measure(name, function, args.repeats)
+               for name, function in get_benchmarks(training_df, testing_df, args.nb_trees).items()
+               if args.only in name]
+
+    # export the report
+    report = {'metadata': {'date': datetime.now().isoformat(), 'python': platform.python_version(),
+                           'numpy': np.__version__, 'pandas': pd.__version__, 'scipy': scipy.__version__,
+                           'scikit-learn': sklearn.__version__, 'parameters': vars(args)},
+              'results': results}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    logger.info(f'Report exported to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare_reports(report, json.load(file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from src.utils import constants
+
+# number of distinct entities of each column (close to the Kaggle training dataset)
+default_vocabulary_sizes = {'belongs_to_collection': 420, 'genres': 20, 'production_companies': 3700,
+                            'production_countries': 74, 'spoken_languages': 79, 'Keywords': 7400, 'crew': 30000,
+                            'original_language': 36}
+# min & max number of items inside one row
+nb_items_by_row = {'belongs_to_collection': (0, 1), 'genres': (1, 4), 'production_companies': (0, 6),
+                   'production_countries': (0, 3), 'spoken_languages': (0, 3), 'Keywords': (0, 15),
+                   'crew': (0, 40)}
+# key of the id inside the dicts of each column
+id_name_cols = {'production_countries': 'iso_3166_1', 'spoken_languages': 'iso_639_1'}
+crew_jobs = ['Director', 'Producer', 'Executive Producer', 'Screenplay', 'Editor', 'Original Music Composer',
+             'Director of Photography', 'Casting']
+
+
+class SyntheticTmdbGenerator:
+    # generate dfs with the schema of the Kaggle files (constants.columns_to_process & the label)
+    def __init__(self, vocabulary_sizes: dict = None, ratio_names_with_quote: float = 0.05, seed: int = 42):
+        self.vocabulary_sizes = dict(default_vocabulary_sizes, **(vocabulary_sizes or dict()))
+        self.ratio_names_with_quote = ratio_names_with_quote
+        self.random_generator = np.random.default_rng(seed)
+        self.names_dict = {col: self.__generate_names(col, size) for col, size in self.vocabulary_sizes.items()}
+
+    def __generate_names(self, col: str, size: int) -> [str]:
+        # some names contain a quote, as in the real data (their representation needs the slow parser)
+        suffixes = constants.useless_info_inside_title + ['', '', '']
+        names = list()
+        for i in range(size):
+            name = f'{col.lower()} {i} {suffixes[i % len(suffixes)]}'.strip()
+            if self.random_generator.random() < self.ratio_names_with_quote:
+                name = f"{name}'s"
+            names.append(name)
+        return names
+
+    def __sample_ids(self, col: str, nb_samples: int) -> np.ndarray:
+        # popularity of the entities follows a Zipf law, so that the thresholds of popularity are meaningful
+        size = self.vocabulary_sizes[col]
+        probabilities = 1 / np.arange(1, size + 1) ** 1.1
+        return self.random_generator.choice(size, size=nb_samples, p=probabilities / probabilities.sum())
+
+    def __generate_list_column(self, col: str, nb_rows: int) -> list:
+        min_items, max_items = nb_items_by_row[col]
+        nb_items = self.random_generator.integers(min_items, max_items + 1, size=nb_rows)
+        ids = self.__sample_ids(col, int(nb_items.sum())).tolist()
+        jobs = self.random_generator.choice(len(crew_jobs), size=len(ids)).tolist() if col == 'crew' else None
+        id_name_col = id_name_cols.get(col, 'id')
+
+        cells, position = list(), 0
+        for nb_items_row in nb_items.tolist():
+            items = list()
+            for id_item in ids[position:position + nb_items_row]:
+                item = {id_name_col: f'c{id_item}' if id_name_col != 'id' else id_item,
+                        'name': self.names_dict[col][id_item]}
+                if col == 'crew':
+                    item.update({'department': 'Crew', 'gender': id_item % 3, 'job': crew_jobs[jobs[position]],
+                                 'profile_path': None})
+                items.append(item)
+                position += 1
+            # empty rows are NaN inside the Kaggle files
+            cells.append(repr(items) if items else np.nan)
+        return cells
+
+    def generate_df(self, nb_rows: int, with_label: bool = True) -> pd.DataFrame:
+        frame = {'id': np.arange(1, nb_rows + 1)}
+        for col in constants.columns_to_process:
+            if col in nb_items_by_row:
+                frame[col] = self.__generate_list_column(col, nb_rows)
+        frame['budget'] = self.random_generator.integers(0, 2 * 10 ** 8, size=nb_rows)
+        frame['popularity'] = self.random_generator.exponential(8, size=nb_rows)
+        frame['runtime'] = np.where(self.random_generator.random(nb_rows) < 0.01, np.nan,
+                                    self.random_generator.integers(60, 180, size=nb_rows))
+        frame['original_language'] = [f'l{i}' for i in self.__sample_ids('original_language', nb_rows)]
+        # same format as the Kaggle files (e.g. 2/20/15)
+        dates = pd.to_datetime(self.random_generator.integers(0, 18000, size=nb_rows), unit='D', origin='1970-01-01')
+        frame['release_date'] = [f'{date.month}/{date.day}/{date.year % 100:02d}' for date in dates]
+        df = pd.DataFrame(frame)[constants.columns_to_process]
+
+        if with_label:
+            df.insert(0, constants.label_column, self.random_generator.lognormal(16, 2, size=nb_rows).astype(np.int64))
+        return df
@@ -0,0 +1,178 @@
+import copy
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_log_error
+from sklearn.model_selection import KFold
+
+from src.core import sparse_encoding, tools
+from src.core.inverted_index import factorize, get_jobs_inverted_index
+from src.core.one_hot_encoding import OneHotEncodingColumn
+from src.core.parsed_column import cache_scope, get_parsed_column
+from src.core.pipeline_transforming import PipelineTransforming
+from src.core.vocabulary import FittedVocabulary
+from src.utils import constants, instrumentation
+from src.utils.logger import logger
+
+
+class CountTable:
+    # number of occurrences of each value inside the training & testing series,
+    # from which the occurrences of any rows of the training series can be subtracted
+    def __init__(self, training_values: list, training_row_positions: np.ndarray, testing_values: list):
+        codes, self.unique_values = factorize(training_values + testing_values)
+        self.training_codes = codes[:len(training_values)]
+        self.training_row_positions = training_row_positions
+        self.total_counts = np.bincount(codes, minlength=len(self.unique_values))
+
+    def get_values_without_rows(self, mask_excluded_rows: np.ndarray, threshold: int = 0) -> list:
+        # values occurring more than threshold times outside of the excluded rows (in order of first appearance)
+        excluded_codes = self.training_codes[mask_excluded_rows[self.training_row_positions]]
+        counts = self.total_counts - np.bincount(excluded_codes, minlength=len(self.unique_values))
+        return [value for value, count in zip(self.unique_values, counts.tolist()) if count > threshold]
+
+
+def get_count_tables(encoding_procedure_col: OneHotEncodingColumn, training_series: pd.Series,
+                     testing_series: pd.Series) -> {str: CountTable}:
+    # count tables of the values learnt by the fit of the encoder (no table if the fit learns nothing)
+    encoding_type = encoding_procedure_col.encoding_type
+    if encoding_type == 'representing_as_dict':
+        parsed_columns = [get_parsed_column(series, encoding_procedure_col.id_name_col)
+                          for series in [training_series, testing_series]]
+        return {'keys': CountTable(parsed_columns[0].ids.tolist(), parsed_columns[0].get_row_positions(),
+                                   parsed_columns[1].ids.tolist())}
+
+    if encoding_type == 'with_most_popular':
+        parsed_columns = [get_parsed_column(series, encoding_procedure_col.id_name_col)
+                          for series in [training_series, testing_series]]
+        names_list = [parsed_column.names.tolist() for parsed_column in parsed_columns]
+        if encoding_procedure_col.need_to_simplify:
+            translation_simplified_names_dict = tools.simplify_names(set(names_list[0] + names_list[1]),
+                                                                     constants.useless_info_inside_title)
+            names_list = [[translation_simplified_names_dict[name] for name in names] for names in names_list]
+        return {'keys': CountTable(names_list[0], parsed_columns[0].get_row_positions(), names_list[1])}
+
+    if encoding_type == 'with_characters_description':
+        parsed_columns = [get_parsed_column(series, 'id') for series in [training_series, testing_series]]
+        jobs_inverted_indexes = [get_jobs_inverted_index(series) for series in [training_series, testing_series]]
+        count_tables = dict()
+        for name_job in encoding_procedure_col.names_jobs_dict:
+            items_job = [jobs_inverted_index.get_items(name_job) for jobs_inverted_index in jobs_inverted_indexes]
+            count_tables[name_job] = CountTable(parsed_columns[0].ids[items_job[0]].tolist(),
+                                                jobs_inverted_indexes[0].item_row_positions[items_job[0]],
+                                                parsed_columns[1].ids[items_job[1]].tolist())
+        return count_tables
+
+    if encoding_type == 'representing_as_item':
+        training_values, testing_values = [series.dropna().tolist() for series in [training_series, testing_series]]
+        return {'keys': CountTable(training_values, np.flatnonzero(training_series.notna().to_numpy()),
+                                   testing_values)}
+    return dict()
+
+
+def get_encoder_without_rows(encoding_procedure_col: OneHotEncodingColumn, count_tables: {str: CountTable},
+                             mask_excluded_rows: np.ndarray) -> OneHotEncodingColumn:
+    # same encoder, as if the excluded rows of the training series had not been part of its fit
+    encoder_without_rows = copy.copy(encoding_procedure_col)
+    encoding_type = encoding_procedure_col.encoding_type
+    if encoding_type == 'representing_as_dict':
+        encoder_without_rows.keys = count_tables['keys'].get_values_without_rows(mask_excluded_rows)
+    elif encoding_type == 'with_most_popular':
+        encoder_without_rows.keys = count_tables['keys'].get_values_without_rows(
+            mask_excluded_rows, encoding_procedure_col.threshold_popularity)
+    elif encoding_type == 'with_characters_description':
+        encoder_without_rows.candidates_jobs_dict = {
+            name_job: count_table.get_values_without_rows(mask_excluded_rows,
+                                                          encoding_procedure_col.threshold_experience)
+            for name_job, count_table in count_tables.items()}
+    elif encoding_type == 'representing_as_item':
+        encoder_without_rows.keys = sorted(count_tables['keys'].get_values_without_rows(mask_excluded_rows), key=str)
+    return encoder_without_rows
+
+
+def get_target_encoder_without_rows(encoding_procedure_col: OneHotEncodingColumn, training_series: pd.Series,
+                                    testing_series: pd.Series, training_labels: np.ndarray,
+                                    mask_excluded_rows: np.ndarray) -> OneHotEncodingColumn:
+    # the target statistics are learnt again without the labels of the excluded rows (the parsed columns are reused)
+    encoder_without_rows = OneHotEncodingColumn(training_series, testing_series, encoding_procedure_col.id_name_col,
+                                                encoding_procedure_col.prefix_name_columns)
+    encoder_without_rows.fit_series_with_target_statistics(training_labels, encoding_procedure_col.smoothing,
+                                                           encoding_procedure_col.nb_folds,
+                                                           encoding_procedure_col.random_state, ~mask_excluded_rows)
+    return encoder_without_rows
+
+
+def _get_fold_encoder(col: str, encoding_procedure_col: OneHotEncodingColumn, count_tables: {str: CountTable},
+                      original_training_df: pd.DataFrame, original_testing_df: pd.DataFrame,
+                      mask_excluded_rows: np.ndarray) -> OneHotEncodingColumn:
+    if encoding_procedure_col.encoding_type == 'with_target_statistics':
+        return get_target_encoder_without_rows(encoding_procedure_col, original_training_df[col],
+                                               original_testing_df[col],
+                                               original_training_df[constants.label_column].to_numpy(),
+                                               mask_excluded_rows)
+    return get_encoder_without_rows(encoding_procedure_col, count_tables, mask_excluded_rows)
+
+
+class FoldAwareCrossValidation:
+    # cross validation without leak: the vocabulary of each fold is learnt without its validation rows,
+    # the columns are parsed & counted only once and the vocabulary of each fold is deduced from the counts
+    # (the target statistics of each fold are learnt out-of-fold from its training rows only)
+    def __init__(self, original_training_df: pd.DataFrame, original_testing_df: pd.DataFrame, nb_folds: int = 5,
+                 nb_workers: int = 1, random_state: int = 42):
+        self.original_training_df = original_training_df
+        self.original_testing_df = original_testing_df
+        self.nb_folds = nb_folds
+        # the folds are evaluated in parallel by a pool of processes
+        self.nb_workers = nb_workers
+        self.random_state = random_state
+
+    @instrumentation.instrumented('FoldAwareCrossValidation.cross_validate')
+    @cache_scope()
+    def cross_validate(self, rf: RandomForestRegressor) -> [float]:
+        # fit on all the rows, only to know the encoders & the layout of the columns
+        fitted_vocabulary = PipelineTransforming(self.original_training_df, self.original_testing_df).fit()
+        count_tables_dict = {col: get_count_tables(encoding_procedure_col, self.original_training_df[col],
+                                                   self.original_testing_df[col])
+                             for col, encoding_procedure_col in fitted_vocabulary.encoders_dict.items()}
+
+        # features of each fold, encoded with the vocabulary of the fold
+        labels = self.original_training_df[constants.label_column].to_numpy()
+        folds = KFold(n_splits=self.nb_folds, shuffle=True, random_state=self.random_state).split(labels)
+        folds_data = list()
+        for training_positions, validation_positions in folds:
+            mask_excluded_rows = np.zeros(labels.size, dtype=bool)
+            mask_excluded_rows[validation_positions] = True
+            fold_vocabulary = FittedVocabulary(
+                {col: _get_fold_encoder(col, encoding_procedure_col, count_tables_dict[col], self.original_training_df,
+                                        self.original_testing_df, mask_excluded_rows)
+                 for col, encoding_procedure_col in fitted_vocabulary.encoders_dict.items()},
+                fitted_vocabulary.passthrough_columns, fitted_vocabulary.date_columns,
+                fitted_vocabulary.date_encoders_dict, fitted_vocabulary.aggregates_dict,
+                fitted_vocabulary.reference_date)
+            training_df = PipelineTransforming(None, None, fold_vocabulary).transform(self.original_training_df,
+                                                                                      is_fitted_training_df=True)
+            features_matrix = sparse_encoding.get_features_matrix(training_df.drop([constants.label_column],
+                                                                                   axis=1))
+            folds_data.append((features_matrix[training_positions], labels[training_positions],
+                               features_matrix[validation_positions], labels[validation_positions]))
+
+        # evaluate the folds
+        if self.nb_workers <= 1:
+            errors = [_evaluate_fold(rf, *fold_data) for fold_data in folds_data]
+        else:
+            with ProcessPoolExecutor(max_workers=self.nb_workers) as executor:
+                errors = list(executor.map(_evaluate_fold, [rf] * len(folds_data), *zip(*folds_data)))
+        for position_fold, error in enumerate(errors):
+            logger.info(f'fold {position_fold}: RMSLE {error}')
+        logger.info(f'RMSLE: {np.mean(errors)} (+/- {np.std(errors)})')
+        return errors
+
+
+# function executed by the workers (defined at the module level, so that it can be pickled) #
+
+def _evaluate_fold(rf: RandomForestRegressor, training_matrix, training_labels: np.ndarray, validation_matrix,
+                   validation_labels: np.ndarray) -> float:
+    fold_rf = clone(rf).fit(training_matrix, training_labels)
+    return float(np.sqrt(mean_squared_log_error(validation_labels, fold_rf.predict(validation_matrix))))
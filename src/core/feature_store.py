@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.core import sparse_encoding
+from src.core.sparse_encoding import FeaturesMatrix
+from src.core.vocabulary import FittedVocabulary
+from src.utils import constants
+
+# to increment each time the transformation produces different features for the same inputs
+FEATURE_STORE_VERSION = 4
+
+
+class FeatureStore:
+    # transformed training & testing dfs saved as arrays (.npy), one directory per key: the features matrix (the one
+    # given to the model) with the labels, so that load_matrix is zero-copy (memory-mapped), whereas the dfs built by
+    # load own copies of the values
+    def __init__(self, path_directory: str):
+        self.path_directory = path_directory
+
+    @staticmethod
+    def get_key(paths_input_files: [str], configuration: dict) -> str:
+        hash_key = hashlib.sha256(str(FEATURE_STORE_VERSION).encode())
+        hash_key.update(json.dumps(configuration, sort_keys=True, default=str).encode())
+        for path_file in paths_input_files:
+            with open(path_file, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    hash_key.update(block)
+        return hash_key.hexdigest()
+
+    def contains(self, key: str) -> bool:
+        return os.path.isfile(os.path.join(self.path_directory, key, 'metadata.json'))
+
+    def save(self, key: str, training_df: pd.DataFrame, testing_df: pd.DataFrame,
+             fitted_vocabulary: FittedVocabulary) -> None:
+        # written in a temporary directory first, so that a key is never partially saved
+        path_key_directory = os.path.join(self.path_directory, key)
+        path_tmp_directory = f'{path_key_directory}.tmp'
+        shutil.rmtree(path_tmp_directory, ignore_errors=True)
+        os.makedirs(path_tmp_directory)
+
+        metadata = dict()
+        for name, main_df in [('training', training_df), ('testing', testing_df)]:
+            metadata[name] = self.__save_df(path_tmp_directory, name, main_df)
+        fitted_vocabulary.save(os.path.join(path_tmp_directory, 'vocabulary.pkl.gz'))
+        with open(os.path.join(path_tmp_directory, 'metadata.json'), 'w') as file:
+            json.dump(metadata, file)
+
+        shutil.rmtree(path_key_directory, ignore_errors=True)
+        os.replace(path_tmp_directory, path_key_directory)
+
+    def load(self, key: str) -> (pd.DataFrame, pd.DataFrame, FittedVocabulary):
+        metadata = self.__load_metadata(key)
+        training_df = self.__load_df(key, 'training', metadata['training'])
+        testing_df = self.__load_df(key, 'testing', metadata['testing'])
+        return training_df, testing_df, self.load_vocabulary(key)
+
+    def load_matrix(self, key: str, name: str) -> FeaturesMatrix:
+        # features matrix of the training or of the testing dataset, its arrays are memory-mapped (read-only)
+        return self.__load_matrix(key, name, self.__load_metadata(key)[name])
+
+    def load_vocabulary(self, key: str) -> FittedVocabulary:
+        return FittedVocabulary.load(os.path.join(self.path_directory, key, 'vocabulary.pkl.gz'))
+
+    def __load_metadata(self, key: str) -> dict:
+        with open(os.path.join(self.path_directory, key, 'metadata.json')) as file:
+            return json.load(file)
+
+    @staticmethod
+    def __save_df(path_directory: str, name: str, main_df: pd.DataFrame) -> dict:
+        # the features keep the dtype of their column in the metadata (e.g. the ids must stay integers)
+        features = FeaturesMatrix.from_df(main_df)
+        for array_name in ['data', 'indices', 'indptr']:
+            np.save(os.path.join(path_directory, f'{name}_features_{array_name}.npy'),
+                    getattr(features.matrix, array_name))
+        if features.labels is not None:
+            np.save(os.path.join(path_directory, f'{name}_labels.npy'), features.labels)
+        np.save(os.path.join(path_directory, f'{name}_index.npy'), main_df.index.to_numpy())
+
+        # columns are handled by position, as several of them may have the same name
+        is_label_columns = [str(col) == constants.label_column for col in main_df.columns]
+        features_dtypes = [dtype for dtype, is_label in zip(main_df.dtypes, is_label_columns) if not is_label]
+        return {'feature_columns': features.columns,
+                'dtypes': features.dtypes,
+                'sparse_positions': [position for position, dtype in enumerate(features_dtypes)
+                                     if isinstance(dtype, pd.SparseDtype)],
+                'label_position': is_label_columns.index(True) if any(is_label_columns) else None,
+                'nb_rows': main_df.shape[0]}
+
+    def __load_matrix(self, key: str, name: str, metadata_df: dict) -> FeaturesMatrix:
+        def load_array(file_name: str) -> np.ndarray:
+            return np.load(os.path.join(self.path_directory, key, file_name), mmap_mode='r')
+
+        matrix = sparse.csr_matrix((load_array(f'{name}_features_data.npy'), load_array(f'{name}_features_indices.npy'),
+                                    load_array(f'{name}_features_indptr.npy')),
+                                   shape=(metadata_df['nb_rows'], len(metadata_df['feature_columns'])), copy=False)
+        labels = load_array(f'{name}_labels.npy') if metadata_df['label_position'] is not None else None
+        return FeaturesMatrix(matrix, metadata_df['feature_columns'], metadata_df['dtypes'], labels)
+
+    def __load_df(self, key: str, name: str, metadata_df: dict) -> pd.DataFrame:
+        features = self.__load_matrix(key, name, metadata_df)
+        index = pd.Index(np.load(os.path.join(self.path_directory, key, f'{name}_index.npy')))
+        matrix = features.matrix.tocsc()
+        sparse_positions = metadata_df['sparse_positions']
+        dense_positions = sorted(set(range(len(features.columns))) - set(sparse_positions))
+
+        # dense columns get back their own dtype
+        dense_values = matrix[:, dense_positions].toarray()
+        dense_df = pd.DataFrame({position: dense_values[:, i].astype(features.dtypes[position])
+                                 for i, position in enumerate(dense_positions)}, index=index)
+        sparse_df = sparse_encoding.to_sparse_df(matrix[:, sparse_positions], sparse_positions, index)
+        # restore the dtype of the sparse columns (e.g. int32 for the one hot encoded columns)
+        sparse_df = sparse_df.astype({position: pd.SparseDtype(features.dtypes[position], 0) for position in
+                                      sparse_positions if features.dtypes[position] != str(matrix.dtype)})
+
+        # restore the original order & names of the columns
+        main_df = pd.concat([dense_df, sparse_df], axis=1)[list(range(len(features.columns)))]
+        main_df.columns = features.columns
+        if features.labels is not None:
+            main_df.insert(metadata_df['label_position'], constants.label_column, np.array(features.labels))
+        return main_df
@@ -0,0 +1,415 @@
+import os
+import pickle
+import sqlite3
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.core import parsed_column, sparse_encoding, tools
+from src.core.feature_store import FeatureStore
+from src.core.inverted_index import get_jobs_inverted_index
+from src.core.one_hot_encoding import OneHotEncodingColumn
+from src.core.parsed_column import get_parsed_column
+from src.core.pipeline_transforming import get_reference_date, PipelineTransforming
+from src.core.vocabulary import FittedVocabulary
+from src.utils import constants, instrumentation
+from src.utils.logger import logger
+
+# to increment each time the content of the state or of the segments changes
+INCREMENTAL_FEATURE_STORE_VERSION = 2
+types_datasets = ['training', 'testing']
+# maximum number of values inside an IN clause of sqlite
+nb_values_by_query = 500
+# a segment is rewritten with its patches once they have this ratio of its number of values
+ratio_compaction = 1.0
+
+
+class IncrementalFeatureStore:
+    # transformed training & testing dfs which grow with the new rows: each append only encodes the new rows (saved
+    # as a new segment) & patches the previous rows for the columns promoted by the new frequencies
+    # the frequencies & the rows of the rare values are kept inside an indexed sqlite database, so that an append only
+    # reads & writes the values of its batch, and the patches of a segment are merged into it once they outweigh it
+    def __init__(self, path_directory: str):
+        self.path_directory = path_directory
+        self.path_database_file = os.path.join(path_directory, 'state.sqlite')
+        self.state = None
+        self.connection = None
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path_database_file)
+
+    @instrumentation.instrumented('IncrementalFeatureStore.initialize')
+    def initialize(self, original_training_df: pd.DataFrame, original_testing_df: pd.DataFrame,
+                   paths_original_files: [str] = None) -> None:
+        if PipelineTransforming.crew_aggregates_jobs:
+            # the aggregates of a character would change the features of all its previous movies at each append
+            raise ValueError('the aggregate features of the crew are not supported by the incremental feature store')
+        if PipelineTransforming.columns_encoded_with_target_statistics:
+            # the statistics of a key would change the features of all its previous movies at each append
+            raise ValueError('the target statistics are not supported by the incremental feature store')
+        # the encoders of PipelineTransforming start with an empty vocabulary, the original rows are the first append
+        fitted_vocabulary = PipelineTransforming(original_training_df.iloc[:0], original_testing_df.iloc[:0]).fit()
+        # the age of all the rows is computed at the latest release date of the original rows
+        fitted_vocabulary.reference_date = get_reference_date(original_training_df['release_date'])
+        all_encoders_dict = dict(fitted_vocabulary.encoders_dict, **fitted_vocabulary.date_encoders_dict)
+        # small part of the state, saved entirely at each append (its size only depends on the number of columns)
+        self.state = {'version': INCREMENTAL_FEATURE_STORE_VERSION,
+                      'configuration': PipelineTransforming.get_configuration(),
+                      'fitted_vocabulary': fitted_vocabulary,
+                      # sparse columns: the position of a column never changes, the new columns are added at the end
+                      'columns': list(),
+                      'columns_positions': {col: dict() for col in all_encoders_dict},
+                      'nb_rows': {type_dataset: 0 for type_dataset in types_datasets},
+                      'segments': {type_dataset: list() for type_dataset in types_datasets},
+                      'nb_patches': 0,
+                      # files already part of the store (including the original ones, if their paths are given)
+                      'appended_keys': {FeatureStore.get_key([path_file], dict())
+                                        for path_file in paths_original_files or list()}}
+        for col, encoding_procedure_col in all_encoders_dict.items():
+            self.__add_new_columns(col, encoding_procedure_col)
+
+        os.makedirs(self.path_directory, exist_ok=True)
+        if self.exists():
+            os.remove(self.path_database_file)
+        self.connection = sqlite3.connect(self.path_database_file)
+        self.connection.executescript("""
+            CREATE TABLE state (name TEXT PRIMARY KEY, value BLOB);
+            -- number of occurrences of each value (e.g. name, id of a director)
+            CREATE TABLE frequencies (col TEXT, name_table TEXT, value BLOB, frequency INTEGER,
+                                      PRIMARY KEY (col, name_table, value)) WITHOUT ROWID;
+            -- rows of the values without column, to patch them once their column is created
+            CREATE TABLE rare_values_rows (col TEXT, name_table TEXT, value BLOB, is_training INTEGER, row INTEGER,
+                                           count INTEGER);
+            CREATE INDEX rare_values_rows_index ON rare_values_rows (col, name_table, value);
+            -- number of characters without column of each row (for the presence columns *_other)
+            CREATE TABLE other_counts (col TEXT, name_table TEXT, is_training INTEGER, row INTEGER, count INTEGER,
+                                       PRIMARY KEY (col, name_table, is_training, row)) WITHOUT ROWID;
+        """)
+        self.append(original_training_df, original_testing_df)
+
+    def __load_state(self) -> None:
+        if self.state is not None:
+            return
+        self.connection = sqlite3.connect(self.path_database_file)
+        (state,), = self.connection.execute("SELECT value FROM state WHERE name = 'state'").fetchall()
+        self.state = pickle.loads(state)
+        if self.state.get('version') != INCREMENTAL_FEATURE_STORE_VERSION:
+            raise ValueError(f'{self.path_directory} has been produced with the version {self.state.get("version")} '
+                             f'of the store, the version {INCREMENTAL_FEATURE_STORE_VERSION} is expected')
+        if self.state['configuration'] != PipelineTransforming.get_configuration():
+            raise ValueError(f'{self.path_directory} has been produced with another configuration of the '
+                             f'transformation, it must be initialized again')
+
+    def __save_state(self) -> None:
+        # the tables & the state are committed together: an interrupted append leaves the previous state
+        self.connection.execute('INSERT OR REPLACE INTO state VALUES (?, ?)',
+                                ('state', pickle.dumps(self.state, protocol=pickle.HIGHEST_PROTOCOL)))
+        self.connection.commit()
+
+    @instrumentation.instrumented('IncrementalFeatureStore.append_files')
+    def append_files(self, path_training_file: str = None, path_testing_file: str = None) -> None:
+        # a file is appended only once, even if it is given again
+        self.__load_state()
+        batches_dict = dict()
+        for type_dataset, path_file in zip(types_datasets, [path_training_file, path_testing_file]):
+            if path_file is None:
+                continue
+            key_file = FeatureStore.get_key([path_file], dict())
+            if key_file in self.state['appended_keys']:
+                logger.info(f'{path_file} has already been appended')
+                continue
+            self.state['appended_keys'].add(key_file)
+            batches_dict[type_dataset] = tools.get_df_from_csv(path_file)
+        if batches_dict:
+            self.append(batches_dict.get('training'), batches_dict.get('testing'))
+
+    @instrumentation.instrumented('IncrementalFeatureStore.append')
+    @parsed_column.cache_scope()
+    def append(self, training_batch_df: pd.DataFrame = None, testing_batch_df: pd.DataFrame = None) -> None:
+        self.__load_state()
+        batches_dict = {type_dataset: batch_df for type_dataset, batch_df
+                        in zip(types_datasets, [training_batch_df, testing_batch_df]) if batch_df is not None}
+        if not batches_dict:
+            return
+
+        # update the frequencies, the values crossing their threshold get a column & the previous rows are patched
+        patches = list()
+        for col, encoding_procedure_col in self.state['fitted_vocabulary'].encoders_dict.items():
+            items_dict = {type_dataset: self.__get_items(encoding_procedure_col, batch_df[col])
+                          for type_dataset, batch_df in batches_dict.items()}
+            for name_table in items_dict[next(iter(items_dict))]:
+                patches += self.__update_frequency_table(col, encoding_procedure_col, name_table,
+                                                         {type_dataset: items[name_table] for type_dataset, items
+                                                          in items_dict.items()})
+
+        # the patches only concern the previous rows, the new rows are encoded with the updated vocabulary
+        obsolete_files = self.__save_patches(patches)
+        for type_dataset, batch_df in batches_dict.items():
+            self.__save_segment(type_dataset, batch_df)
+        self.__save_state()
+        # the files of the compacted segments are only removed once the new state is committed
+        for file_name in obsolete_files:
+            os.remove(os.path.join(self.path_directory, file_name))
+        for type_dataset, batch_df in batches_dict.items():
+            logger.info(f'{batch_df.shape[0]} {type_dataset} rows appended')
+        logger.info(f'{len(self.state["columns"])} sparse columns, {len(patches)} values of the previous rows patched')
+
+    @staticmethod
+    def __get_items(encoding_procedure_col: OneHotEncodingColumn, series: pd.Series) -> {str: (list, np.ndarray)}:
+        # values counted by the fit of the encoder & their row, by frequency table
+        encoding_type = encoding_procedure_col.encoding_type
+        if encoding_type == 'representing_as_dict':
+            parsed_series = get_parsed_column(series, encoding_procedure_col.id_name_col)
+            return {'keys': (parsed_series.ids.tolist(), parsed_series.get_row_positions())}
+        if encoding_type == 'with_most_popular':
+            parsed_series = get_parsed_column(series, encoding_procedure_col.id_name_col)
+            names = parsed_series.names.tolist()
+            if encoding_procedure_col.need_to_simplify:
+                translation_simplified_names_dict = tools.simplify_names(set(names),
+                                                                         constants.useless_info_inside_title)
+                names = [translation_simplified_names_dict[name] for name in names]
+            return {'keys': (names, parsed_series.get_row_positions())}
+        if encoding_type == 'with_characters_description':
+            parsed_series = get_parsed_column(series, 'id')
+            jobs_inverted_index = get_jobs_inverted_index(series)
+            return {name_job: (parsed_series.ids[jobs_inverted_index.get_items(name_job)].tolist(),
+                               jobs_inverted_index.item_row_positions[jobs_inverted_index.get_items(name_job)])
+                    for name_job in encoding_procedure_col.names_jobs_dict}
+        if encoding_type == 'representing_as_item':
+            mask_known_values = series.notna().to_numpy()
+            return {'keys': (series[mask_known_values].tolist(), np.flatnonzero(mask_known_values))}
+        return dict()
+
+    def __select(self, query: str, parameters: tuple, values: list) -> list:
+        # query ending with an IN clause on the given values, split to respect the limit of sqlite
+        results = list()
+        for start in range(0, len(values), nb_values_by_query):
+            values_chunk = values[start:start + nb_values_by_query]
+            results += self.connection.execute(f'{query} IN ({", ".join("?" * len(values_chunk))})',
+                                               parameters + tuple(values_chunk)).fetchall()
+        return results
+
+    def __update_frequency_table(self, col: str, encoding_procedure_col: OneHotEncodingColumn, name_table: str,
+                                 items_dict: {str: (list, np.ndarray)}) -> [tuple]:
+        threshold = {'with_most_popular': encoding_procedure_col.threshold_popularity,
+                     'with_characters_description': encoding_procedure_col.threshold_experience}.get(
+            encoding_procedure_col.encoding_type, 0)
+        need_other_counts = encoding_procedure_col.encoding_type == 'with_characters_description'
+
+        # rows of each value inside the batch: (is training, row, number of occurrences)
+        batch_values_rows = defaultdict(list)
+        for type_dataset, (values, row_positions) in items_dict.items():
+            first_row = self.state['nb_rows'][type_dataset]
+            for (value, row), count in Counter(zip(values, row_positions.tolist())).items():
+                batch_values_rows[value].append((type_dataset == 'training', first_row + row, count))
+        # the values are stored pickled, so that the names & the ids share the same table
+        keys_values = {pickle.dumps(value, protocol=4): value for value in batch_values_rows}
+        frequency_table = dict(self.__select('SELECT value, frequency FROM frequencies '
+                                             'WHERE col = ? AND name_table = ? AND value', (col, name_table),
+                                             list(keys_values)))
+
+        new_frequencies, new_rare_values_rows, new_other_counts, promoted_keys = list(), list(), list(), list()
+        for key, value in keys_values.items():
+            value_rows = batch_values_rows[value]
+            has_column = frequency_table.get(key, 0) > threshold
+            frequency = frequency_table.get(key, 0) + sum(count for _, _, count in value_rows)
+            new_frequencies.append((col, name_table, key, frequency))
+            if has_column:
+                continue
+            if frequency > threshold:
+                # promoted: the rows of the batch are directly encoded with its column, the previous rows are patched
+                promoted_keys.append(key)
+            else:
+                new_rare_values_rows += [(col, name_table, key, is_training, row, count)
+                                         for is_training, row, count in value_rows]
+                if need_other_counts:
+                    new_other_counts += [(col, name_table, is_training, row, count)
+                                         for is_training, row, count in value_rows]
+        self.connection.executemany('INSERT OR REPLACE INTO frequencies VALUES (?, ?, ?, ?)', new_frequencies)
+        self.connection.executemany('INSERT INTO rare_values_rows VALUES (?, ?, ?, ?, ?, ?)', new_rare_values_rows)
+        self.connection.executemany('INSERT INTO other_counts VALUES (?, ?, ?, ?, ?) ON CONFLICT DO UPDATE '
+                                    'SET count = count + excluded.count', new_other_counts)
+        if not promoted_keys:
+            return list()
+
+        # previous rows of the promoted values, which are removed from the rare values
+        promoted_values_rows = defaultdict(list)
+        for key, is_training, row, count in self.__select('SELECT value, is_training, row, count FROM '
+                                                          'rare_values_rows WHERE col = ? AND name_table = ? AND value',
+                                                          (col, name_table), promoted_keys):
+            promoted_values_rows[key].append(('training' if is_training else 'testing', row, count))
+        self.__select('DELETE FROM rare_values_rows WHERE col = ? AND name_table = ? AND value', (col, name_table),
+                      promoted_keys)
+        other_counts = dict()
+        if need_other_counts:
+            rows = list({(type_dataset == 'training', row) for value_rows in promoted_values_rows.values()
+                         for type_dataset, row, _ in value_rows})
+            for is_training in [True, False]:
+                other_counts.update({('training' if is_training else 'testing', row): count for row, count in
+                                     self.__select('SELECT row, count FROM other_counts WHERE col = ? AND '
+                                                   'name_table = ? AND is_training = ? AND row',
+                                                   (col, name_table, is_training),
+                                                   [row for is_training_row, row in rows
+                                                    if is_training_row == is_training])})
+
+        patches = list()
+        for key in promoted_keys:
+            patches += self.__promote(col, encoding_procedure_col, name_table, keys_values[key],
+                                      promoted_values_rows[key], other_counts)
+        if need_other_counts:
+            self.connection.executemany('INSERT OR REPLACE INTO other_counts VALUES (?, ?, ?, ?, ?)',
+                                        [(col, name_table, type_dataset == 'training', row, count)
+                                         for (type_dataset, row), count in other_counts.items() if count > 0])
+            self.connection.executemany('DELETE FROM other_counts WHERE col = ? AND name_table = ? AND '
+                                        'is_training = ? AND row = ?',
+                                        [(col, name_table, type_dataset == 'training', row)
+                                         for (type_dataset, row), count in other_counts.items() if count <= 0])
+        return patches
+
+    def __promote(self, col: str, encoding_procedure_col: OneHotEncodingColumn, name_table: str, value,
+                  value_rows: [tuple], other_counts: {tuple: int}) -> [tuple]:
+        if encoding_procedure_col.encoding_type == 'with_characters_description':
+            encoding_procedure_col.candidates_jobs_dict[name_table].append(value)
+            name_column, name_other_column = [encoding_procedure_col.get_column_name(key, name_table)
+                                              for key in [value, 'other']]
+        else:
+            encoding_procedure_col.keys.append(value)
+            name_column, name_other_column = [encoding_procedure_col.get_column_name(key) for key in [value, 'other']]
+        columns_positions = self.__add_new_columns(col, encoding_procedure_col)
+
+        # (type of dataset, row, column, value to add)
+        patches = list()
+        for type_dataset, row, count in value_rows:
+            if encoding_procedure_col.encoding_type == 'with_most_popular':
+                # the occurrences move from the column other to the new column
+                patches += [(type_dataset, row, columns_positions[name_column], count),
+                            (type_dataset, row, columns_positions[name_other_column], -count)]
+            elif encoding_procedure_col.encoding_type == 'with_characters_description':
+                # presence columns: the column other is removed when no other character remains
+                patches.append((type_dataset, row, columns_positions[name_column], 1))
+                other_counts[(type_dataset, row)] -= count
+                if other_counts[(type_dataset, row)] == 0:
+                    patches.append((type_dataset, row, columns_positions[name_other_column], -1))
+            else:
+                patches.append((type_dataset, row, columns_positions[name_column], 1))
+        return patches
+
+    def __add_new_columns(self, col: str, encoding_procedure_col: OneHotEncodingColumn) -> {str: int}:
+        columns_positions = self.state['columns_positions'][col]
+        for name_column in encoding_procedure_col.get_columns_names():
+            if name_column not in columns_positions:
+                columns_positions[name_column] = len(self.state['columns'])
+                self.state['columns'].append(name_column)
+        return columns_positions
+
+    def __save_segment(self, type_dataset: str, batch_df: pd.DataFrame) -> None:
+        fitted_vocabulary = self.state['fitted_vocabulary']
+        main_df = PipelineTransforming(None, None, fitted_vocabulary).transform(batch_df)
+
+        # dense columns first, then the sparse blocks of the encoders (in the order of the vocabulary)
+        nb_dense_columns = sum(not isinstance(dtype, pd.SparseDtype) for dtype in main_df.dtypes)
+        columns_positions = np.array([self.state['columns_positions'][col][name_column]
+                                      for col, encoding_procedure_col in
+                                      list(fitted_vocabulary.encoders_dict.items()) +
+                                      list(fitted_vocabulary.date_encoders_dict.items())
+                                      for name_column in encoding_procedure_col.get_columns_names()], dtype=np.int64)
+        matrix = sparse_encoding.get_features_matrix(main_df.iloc[:, nb_dense_columns:])
+        matrix = sparse.csr_matrix((matrix.data, columns_positions[matrix.indices], matrix.indptr),
+                                   shape=(matrix.shape[0], len(self.state['columns'])))
+        matrix.sort_indices()
+
+        name_segment = f'{type_dataset}_{len(self.state["segments"][type_dataset])}'
+        self.__save_sparse_matrix(name_segment, matrix)
+        dense_columns = [str(col) for col in main_df.columns[:nb_dense_columns]]
+        for position, col in enumerate(dense_columns):
+            np.save(os.path.join(self.path_directory, f'{name_segment}_dense_{position}.npy'),
+                    main_df.iloc[:, position].to_numpy())
+        # the sparse part of a segment is renamed when its patches are merged into it
+        self.state['segments'][type_dataset].append({'name': name_segment, 'name_sparse': name_segment,
+                                                     'nb_rows': main_df.shape[0], 'dense_columns': dense_columns,
+                                                     'nb_values': matrix.nnz, 'patches': list(),
+                                                     'nb_patched_values': 0})
+        self.state['nb_rows'][type_dataset] += main_df.shape[0]
+
+    def __save_sparse_matrix(self, name_sparse: str, matrix: sparse.csr_matrix) -> None:
+        for array_name in ['data', 'indices', 'indptr']:
+            np.save(os.path.join(self.path_directory, f'{name_sparse}_sparse_{array_name}.npy'),
+                    getattr(matrix, array_name))
+
+    def __save_patches(self, patches: [tuple]) -> [str]:
+        # the patches are saved by segment, with the rows inside the segment; a segment is rewritten with its patches
+        # once they are large enough, so that load reads a bounded number of patches & the rewrites are amortized
+        if not patches:
+            return list()
+        types_datasets_patches, rows, columns, values = [np.array(array) for array in zip(*patches)]
+        obsolete_files = list()
+        for type_dataset in types_datasets:
+            segments = self.state['segments'][type_dataset]
+            first_rows = np.cumsum([0] + [segment['nb_rows'] for segment in segments])
+            mask_dataset = types_datasets_patches == type_dataset
+            positions_segments = np.searchsorted(first_rows, rows[mask_dataset], side='right') - 1
+            for position_segment in np.unique(positions_segments):
+                segment = segments[position_segment]
+                mask_segment = positions_segments == position_segment
+                name_patch = f'{segment["name"]}_patch_{self.state["nb_patches"]}.npz'
+                np.savez(os.path.join(self.path_directory, name_patch),
+                         rows=rows[mask_dataset][mask_segment] - first_rows[position_segment],
+                         columns=columns[mask_dataset][mask_segment].astype(np.int64),
+                         values=values[mask_dataset][mask_segment].astype(np.float64))
+                self.state['nb_patches'] += 1
+                segment['patches'].append(name_patch)
+                segment['nb_patched_values'] += int(mask_segment.sum())
+                if segment['nb_patched_values'] >= ratio_compaction * segment['nb_values']:
+                    obsolete_files += self.__compact_segment(segment)
+        return obsolete_files
+
+    def __compact_segment(self, segment: dict) -> [str]:
+        obsolete_files = [f'{segment["name_sparse"]}_sparse_{array_name}.npy'
+                          for array_name in ['data', 'indices', 'indptr']] + segment['patches']
+        matrix = self.__load_segment_matrix(segment)
+        segment['name_sparse'] = f'{segment["name"]}_compacted_{self.state["nb_patches"]}'
+        self.__save_sparse_matrix(segment['name_sparse'], matrix)
+        segment.update({'nb_values': matrix.nnz, 'patches': list(), 'nb_patched_values': 0})
+        return obsolete_files
+
+    def __load_segment_matrix(self, segment: dict) -> sparse.csr_matrix:
+        # the segments of the previous appends have less columns, which are the first ones
+        nb_columns = len(self.state['columns'])
+        matrix = sparse.csr_matrix(tuple(np.load(os.path.join(self.path_directory,
+                                                              f'{segment["name_sparse"]}_sparse_{array_name}.npy'),
+                                                 mmap_mode='r') for array_name in ['data', 'indices', 'indptr']),
+                                   shape=(segment['nb_rows'], nb_columns))
+        if segment['patches']:
+            # the values of the promoted columns inside the rows of the segment, added at once
+            patches = [np.load(os.path.join(self.path_directory, name_patch)) for name_patch in segment['patches']]
+            matrix = matrix + sparse.csr_matrix((np.concatenate([patch['values'] for patch in patches]),
+                                                 (np.concatenate([patch['rows'] for patch in patches]),
+                                                  np.concatenate([patch['columns'] for patch in patches]))),
+                                                shape=(segment['nb_rows'], nb_columns))
+            matrix.eliminate_zeros()
+            matrix.sort_indices()
+        return matrix
+
+    @instrumentation.instrumented('IncrementalFeatureStore.load')
+    def load(self) -> (pd.DataFrame, pd.DataFrame, FittedVocabulary):
+        self.__load_state()
+        training_df, testing_df = [self.__load_df(type_dataset) for type_dataset in types_datasets]
+        return training_df, testing_df, self.state['fitted_vocabulary']
+
+    def __load_df(self, type_dataset: str) -> pd.DataFrame:
+        nb_rows, nb_columns = self.state['nb_rows'][type_dataset], len(self.state['columns'])
+        segments = self.state['segments'][type_dataset]
+        matrices = [self.__load_segment_matrix(segment) for segment in segments]
+        matrix = sparse.vstack(matrices, format='csr') if matrices else sparse.csr_matrix((0, nb_columns))
+
+        index = pd.RangeIndex(nb_rows)
+        dense_columns = segments[0]['dense_columns'] if segments else list()
+        dense_df = pd.DataFrame({col: np.concatenate([np.load(os.path.join(self.path_directory,
+                                                                           f'{segment["name"]}_dense_{position}.npy'),
+                                                              mmap_mode='r')
+                                                      for segment in segments])
+                                 for position, col in enumerate(dense_columns)}, index=index)
+        return pd.concat([dense_df, sparse_encoding.to_sparse_df(matrix.tocsc(), self.state['columns'], index)],
+                         axis=1)
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.core import sparse_encoding
+from src.core.parsed_column import get_parsed_column, ParsedColumn
+
+
+def factorize(values) -> (np.ndarray, list):
+    # same semantic as the keys of a dict (e.g. None is a value), the codes follow the order of first appearance
+    codes, unique_values = pd.factorize(values if isinstance(values, np.ndarray) else
+                                        np.asarray(values, dtype=object))
+    if codes.size == 0 or codes.min() >= 0:
+        return codes.astype(np.int64), unique_values.tolist()
+    # slow path: pandas ignores the missing values
+    codes_dict = dict()
+    codes = np.fromiter((codes_dict.setdefault(value, len(codes_dict)) for value in values), dtype=np.int64,
+                        count=len(values))
+    return codes, list(codes_dict.keys())
+
+
+class InvertedIndex:
+    # entities (e.g. ids of keywords) of a column: the entity & the row of each item, with the number of occurrences
+    # of each entity (the encoders aggregate the items by entity or by row with bincount, no postings lists needed)
+    def __init__(self, values, item_row_positions: np.ndarray, nb_rows: int):
+        # code of the entity of each item (entities in order of first appearance)
+        self.codes, self.entities = factorize(values)
+        self.item_row_positions = item_row_positions
+        self.nb_rows = nb_rows
+        # number of occurrences of each entity
+        self.counts = np.bincount(self.codes, minlength=len(self.entities))
+
+    def get_item_positions(self, keys: list) -> np.ndarray:
+        # position of the entity of each item inside keys (-1 if not a key), each entity is only looked up once
+        return pd.Index(keys).get_indexer(self.entities)[self.codes] if self.codes.size else self.codes
+
+
+class JobsInvertedIndex:
+    # inverted indexes of the ids of the characters (e.g. crew), one by job: the items are sorted by job once,
+    # the index of a job is built from its contiguous items the first time it is needed
+    def __init__(self, parsed_column: ParsedColumn):
+        self.parsed_column = parsed_column
+        self.item_row_positions = parsed_column.get_row_positions()
+        job_codes, self.jobs = factorize(parsed_column.jobs)
+        self.items_order = np.argsort(job_codes, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(job_codes, minlength=len(self.jobs)))])
+        self.indexes_dict = dict()
+
+    def get_items(self, name_job: str) -> np.ndarray:
+        # positions of the items having the job (in their order inside the parsed column)
+        if name_job not in self.jobs:
+            return np.empty(0, dtype=np.int64)
+        position = self.jobs.index(name_job)
+        return self.items_order[self.offsets[position]:self.offsets[position + 1]]
+
+    def get_index(self, name_job: str) -> InvertedIndex:
+        if name_job not in self.indexes_dict:
+            items_job = self.get_items(name_job)
+            self.indexes_dict[name_job] = InvertedIndex(self.parsed_column.ids[items_job],
+                                                        self.item_row_positions[items_job],
+                                                        self.parsed_column.nb_rows)
+        return self.indexes_dict[name_job]
+
+
+# the indexes are built once by parsed column (and cleared with the cache of the parsed columns) #
+
+def get_inverted_index(series: pd.Series, id_name_col: str = 'id') -> InvertedIndex:
+    parsed_column = get_parsed_column(series, id_name_col)
+    if parsed_column.inverted_index is None:
+        parsed_column.inverted_index = InvertedIndex(parsed_column.ids, parsed_column.get_row_positions(),
+                                                     parsed_column.nb_rows)
+    return parsed_column.inverted_index
+
+
+def get_jobs_inverted_index(series: pd.Series) -> JobsInvertedIndex:
+    parsed_column = get_parsed_column(series, 'id')
+    if parsed_column.jobs_inverted_index is None:
+        parsed_column.jobs_inverted_index = JobsInvertedIndex(parsed_column)
+    return parsed_column.jobs_inverted_index
+
+
+class CharactersAggregates:
+    # aggregate features of the characters having a job (e.g. directors), learnt from the movies of the fitted
+    # series: number of movies of the character & mean of a column over these movies (e.g. budget)
+    def __init__(self, name_job: str, prefix_name_columns: str, value_col: str = 'budget'):
+        self.name_job = name_job
+        self.prefix_name_columns = prefix_name_columns
+        self.value_col = value_col
+        # fitted state: ids of the characters, their number of movies & the sum of the column over their movies
+        self.ids = list()
+        self.nb_movies = np.empty(0)
+        self.sums_values = np.empty(0)
+
+    def get_columns_names(self) -> [str]:
+        return [f'{self.prefix_name_columns}_nb_movies', f'{self.prefix_name_columns}_mean_{self.value_col}']
+
+    def fit(self, multiple_series: [pd.Series], multiple_values_series: [pd.Series]) -> None:
+        ids, nb_movies, sums_values = list(), list(), list()
+        for series, values_series in zip(multiple_series, multiple_values_series):
+            index = get_jobs_inverted_index(series).get_index(self.name_job)
+            codes, row_positions = _get_distinct_credits(index.codes, index.item_row_positions)
+            values = values_series.fillna(0).to_numpy(dtype=np.float64)
+            ids += index.entities
+            nb_movies.append(np.bincount(codes, minlength=len(index.entities)))
+            sums_values.append(np.bincount(codes, weights=values[row_positions], minlength=len(index.entities)))
+        # the statistics of a character appearing in several series are summed
+        codes, self.ids = factorize(ids)
+        self.nb_movies = np.bincount(codes, weights=np.concatenate(nb_movies), minlength=len(self.ids))
+        self.sums_values = np.bincount(codes, weights=np.concatenate(sums_values), minlength=len(self.ids))
+
+    def transform_series(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        # most experienced character of each movie & mean of the column over all the movies of its characters
+        index = get_jobs_inverted_index(series).get_index(self.name_job)
+        positions, row_positions = _get_distinct_credits(index.get_item_positions(self.ids), index.item_row_positions)
+        mask_known_characters = positions >= 0
+        positions, row_positions = positions[mask_known_characters], row_positions[mask_known_characters]
+        nb_movies = np.zeros(series.size)
+        np.maximum.at(nb_movies, row_positions, self.nb_movies[positions])
+        sums_nb_movies = np.bincount(row_positions, weights=self.nb_movies[positions], minlength=series.size)
+        sums_values = np.bincount(row_positions, weights=self.sums_values[positions], minlength=series.size)
+        mean_values = np.divide(sums_values, sums_nb_movies, out=np.zeros(series.size), where=sums_nb_movies > 0)
+        return sparse_encoding.FeatureBlock(sparse.csc_matrix(np.column_stack([nb_movies, mean_values])),
+                                            self.get_columns_names())
+
+
+def _get_distinct_credits(codes: np.ndarray, row_positions: np.ndarray) -> (np.ndarray, np.ndarray):
+    # a character counts once by movie, even with several credits for the same job
+    if codes.size == 0:
+        return codes, row_positions
+    pairs = np.unique(np.stack([codes, row_positions]), axis=1)
+    return pairs[0], pairs[1]
@@ -1,41 +1,305 @@
-from sklearn.ensemble import RandomForestRegressor
+import argparse
+import time
 
-from src.core import pipeline_loading, tools
-from src.core.pipeline_transforming import PipelineTransforming
-from src.utils import constants
+from src.utils import constants, instrumentation
 from src.utils.logger import logger
 
-# parameters
+# start of the command line (the heavy modules are imported by each command, when it needs them)
+start_time = time.perf_counter()
+
+# parameters (default values of the command line)
 mode = 'produce_submission_result'
 parameters_rf = {'n_estimators': 25, 'random_state': 42}
 # parameters_rf = {'n_estimators': 1000, 'min_samples_split': 10, 'min_samples_leaf': 1, 'max_features': 'auto',
 #                  'max_depth': 80, 'bootstrap': False}
 # parameters_rf = dict()
+# number of workers encoding the columns in parallel
+nb_workers_transforming = 1
+# reuse the transformed dfs of a previous run when the inputs have not changed
+use_feature_store = True
+# maintain the transformed dfs by appending the rows of new files, instead of transforming everything again
+use_incremental_feature_store = False
+path_new_training_file = None
+path_new_testing_file = None
+# reuse the model trained by a previous run when the training data & the parameters have not changed
+use_model_registry = True
+# parameters of the mode produce_submission_result_by_chunks (scoring of a file with the saved vocabulary & model)
+path_input_file = constants.path_testing_file
+chunk_size = 10000
+nb_processes = 1
+# number of processes evaluating the folds of the mode cross_validate_model_without_leak
+nb_workers_cross_validation = 1
+# export the timing & memory of each stage to constants.path_trace_file
+export_trace = False
 
+# command line of each mode (used when main is run without command)
+commands_by_mode = {'cross_validate_model': ['cv'],
+                    'cross_validate_model_without_leak': ['cv', '--without-leak'],
+                    'tune_hyperparameters_grid_search_cv': ['tune', '--method', 'grid_search_cv'],
+                    'tune_hyperparameters_randomized_search_cv': ['tune', '--method', 'randomized_search_cv'],
+                    'tune_hyperparameters_successive_halving': ['tune', '--method', 'successive_halving'],
+                    'produce_submission_result': ['predict'],
+                    'train_and_save_model': ['predict', '--train-only'],
+                    'produce_submission_result_by_chunks': ['predict', '--by-chunks']}
 
-if __name__ == '__main__':
-    # EXTRACTING
-    label_column = 'revenue'
-    original_training_df = tools.get_df_from_csv(constants.path_training_file)[[
-                                                                                   constants.label_column] + constants.columns_to_process]
-    original_testing_df = tools.get_df_from_csv(constants.path_testing_file)[constants.columns_to_process]
 
-    # TRANSFORMING
-    pipeline_transforming = PipelineTransforming(original_training_df, original_testing_df)
-    training_df, testing_df = pipeline_transforming.clean_dfs()
+def log_startup_time(command: str) -> None:
+    # time between the start of the command line & the start of the work of the command (imports included)
+    logger.info(f'{command}: startup time {(time.perf_counter() - start_time) * 1000:.0f}ms')
+
+
+def extract_dfs(args: argparse.Namespace) -> ['pd.DataFrame']:
+    from src.core import tools
+
+    with instrumentation.stage('extract') as record:
+        original_training_df = tools.get_df_from_csv(args.training_file)[
+            [constants.label_column] + constants.columns_to_process]
+        original_testing_df = tools.get_df_from_csv(args.testing_file)[constants.columns_to_process]
+        record['output_shapes'] = instrumentation.get_shapes(original_training_df, original_testing_df)
+    return original_training_df, original_testing_df
+
+
+def get_transformed_dfs(args: argparse.Namespace) -> ('pd.DataFrame', 'pd.DataFrame', 'FittedVocabulary'):
+    from src.core.feature_store import FeatureStore
+    from src.core.incremental_feature_store import IncrementalFeatureStore
+    from src.core.pipeline_transforming import PipelineTransforming
+
+    feature_store = FeatureStore(args.feature_store)
+    key_feature_store = FeatureStore.get_key([args.training_file, args.testing_file],
+                                             PipelineTransforming.get_configuration())
+    if args.incremental:
+        # the columns of the incremental feature store are in their order of creation
+        incremental_feature_store = IncrementalFeatureStore(args.incremental_feature_store)
+        if not incremental_feature_store.exists():
+            incremental_feature_store.initialize(*extract_dfs(args), [args.training_file, args.testing_file])
+        incremental_feature_store.append_files(args.new_training_file, args.new_testing_file)
+        training_df, testing_df, fitted_vocabulary = incremental_feature_store.load()
+    elif args.use_feature_store and feature_store.contains(key_feature_store):
+        # inputs & transformation unchanged since the previous run
+        logger.debug(f'Transformed dfs loaded from the feature store ({key_feature_store})')
+        with instrumentation.stage('load feature store') as record:
+            training_df, testing_df, fitted_vocabulary = feature_store.load(key_feature_store)
+            record['output_shapes'] = instrumentation.get_shapes(training_df, testing_df)
+    else:
+        # EXTRACTING
+        original_training_df, original_testing_df = extract_dfs(args)
+
+        # TRANSFORMING
+        pipeline_transforming = PipelineTransforming(original_training_df, original_testing_df,
+                                                     nb_workers=args.nb_workers_transforming)
+        training_df, testing_df = pipeline_transforming.clean_dfs()
+        fitted_vocabulary = pipeline_transforming.fitted_vocabulary
+        # save the fitted vocabulary, to be able to transform new data without the training dataset
+        fitted_vocabulary.save(args.vocabulary)
+        if args.use_feature_store:
+            with instrumentation.stage('save feature store', training_df, testing_df):
+                feature_store.save(key_feature_store, training_df, testing_df, fitted_vocabulary)
 
     logger.debug(f'Training shape: {training_df.shape}')
     logger.debug(f'Testing shape: {testing_df.shape}')
     logger.debug(f'Training columns: {training_df.columns}')
+    return training_df, testing_df, fitted_vocabulary
+
+
+def get_features(args: argparse.Namespace) -> ('FeaturesMatrix', 'FeaturesMatrix', 'FittedVocabulary'):
+    # features matrices of the model: memory-mapped from the feature store when it contains them, without any df
+    from src.core.feature_store import FeatureStore
+    from src.core.pipeline_transforming import PipelineTransforming
+    from src.core.sparse_encoding import FeaturesMatrix
+
+    feature_store = FeatureStore(args.feature_store)
+    key_feature_store = FeatureStore.get_key([args.training_file, args.testing_file],
+                                             PipelineTransforming.get_configuration())
+    if not args.incremental and args.use_feature_store and feature_store.contains(key_feature_store):
+        logger.debug(f'Features matrices loaded from the feature store ({key_feature_store})')
+        with instrumentation.stage('load feature store matrices') as record:
+            training_features = feature_store.load_matrix(key_feature_store, 'training')
+            testing_features = feature_store.load_matrix(key_feature_store, 'testing')
+            record['output_shapes'] = instrumentation.get_shapes(training_features, testing_features)
+        return training_features, testing_features, feature_store.load_vocabulary(key_feature_store)
+
+    training_df, testing_df, fitted_vocabulary = get_transformed_dfs(args)
+    return FeaturesMatrix.from_df(training_df), FeaturesMatrix.from_df(testing_df), fitted_vocabulary
+
+
+# commands #
+
+def run_transform(args: argparse.Namespace) -> None:
+    log_startup_time('transform')
+    get_transformed_dfs(args)
+
+
+def run_cv(args: argparse.Namespace) -> None:
+    from sklearn.ensemble import RandomForestRegressor
+
+    from src.core import pipeline_loading
+    from src.core.cross_validation import FoldAwareCrossValidation
+
+    log_startup_time('cv')
+    rf = RandomForestRegressor(**parameters_rf) # model
+    if args.without_leak:
+        # the vocabulary of each fold is learnt without its validation rows
+        FoldAwareCrossValidation(*extract_dfs(args), nb_workers=args.nb_workers_cross_validation).cross_validate(rf)
+    else:
+        training_features, _, _ = get_features(args)
+        pipeline_loading.cross_validate_model(training_features, rf)
+
+
+def run_tune(args: argparse.Namespace) -> None:
+    from sklearn.ensemble import RandomForestRegressor
+
+    from src.core import pipeline_loading
+
+    log_startup_time('tune')
+    training_features, _, _ = get_features(args)
+    rf = RandomForestRegressor(**parameters_rf) # model
+    if args.method == 'grid_search_cv':
+        pipeline_loading.tune_hyperparameters_by_grid_search_cv(training_features, rf)
+    elif args.method == 'randomized_search_cv':
+        pipeline_loading.tune_hyperparameters_by_randomized_search_cv(training_features, rf)
+    else:
+        pipeline_loading.tune_hyperparameters_by_successive_halving(
+            training_features, rf, path_checkpoint_directory=args.tuning_checkpoint)
 
-    # TRANSFORMING AND LOADING
-    if mode == 'cross_validate_model':
-        rf = RandomForestRegressor(**parameters_rf) # model
-        pipeline_loading.cross_validate_model(training_df, rf)
-    elif mode == 'tune_hyperparameters_grid_search_cv':
-        pipeline_loading.tune_hyperparameters_by_grid_search_cv(training_df)
-    elif mode == 'tune_hyperparameters_randomized_search_cv':
-        pipeline_loading.tune_hyperparameters_by_randomized_search_cv(training_df)
-    elif mode == 'produce_submission_result':
-        rf = RandomForestRegressor(**parameters_rf) # model
-        pipeline_loading.produce_submission_result(training_df, testing_df, rf)
+
+def run_predict(args: argparse.Namespace) -> None:
+    from src.core import pipeline_loading
+    from src.core.model_registry import ModelRegistry
+
+    log_startup_time('predict')
+    if (args.by_chunks or args.train_only) and args.incremental:
+        # the model of --train-only is served with the vocabulary saved at --vocabulary
+        raise ValueError(f'{"--by-chunks" if args.by_chunks else "--train-only"} needs the layout of '
+                         f'PipelineTransforming, it cannot be used with --incremental')
+    if args.by_chunks:
+        run_predict_by_chunks(args)
+        return
+
+    from sklearn.ensemble import RandomForestRegressor
+
+    training_features, testing_features, fitted_vocabulary = get_features(args)
+    model_registry = (ModelRegistry(args.model_registry)
+                      if args.use_model_registry or args.train_only else None)
+    rf = RandomForestRegressor(**parameters_rf) # model
+    if args.train_only:
+        # model used by the prediction server & by --by-chunks (latest model of the registry),
+        # with the vocabulary saved at --vocabulary (also when the features come from the feature store)
+        pipeline_loading.train_or_load_model(training_features, rf, model_registry)
+        fitted_vocabulary.save(args.vocabulary)
+    else:
+        pipeline_loading.produce_submission_result(training_features, testing_features, rf, model_registry,
+                                                   args.result_file)
+
+
+def run_predict_by_chunks(args: argparse.Namespace) -> None:
+    # scoring only: the vocabulary & the model saved by a previous `predict --train-only`, the input file is streamed
+    # (neither the csv files of the training nor the feature store are read, the memory is bounded by --chunk-size)
+    from src.core import pipeline_loading
+    from src.core.model_registry import ModelRegistry
+    from src.core.vocabulary import FittedVocabulary
+
+    if not args.use_model_registry:
+        raise ValueError('--by-chunks predicts with a model of the model registry, it cannot be used with '
+                         '--no-model-registry')
+    model_registry = ModelRegistry(args.model_registry)
+    model = model_registry.load(args.model_key or model_registry.get_latest_key())
+    pipeline_loading.produce_submission_result_by_chunks(args.input_file, args.result_file,
+                                                         FittedVocabulary.load(args.vocabulary), model,
+                                                         args.chunk_size, args.nb_processes)
+
+
+def run_serve(arguments: [str], prog: str) -> None:
+    # the server only imports what it needs to encode records & predict with the memory-mapped trees
+    from src.core import prediction_server
+
+    log_startup_time('serve')
+    prediction_server.main(arguments, prog=f'{prog} serve')
+
+
+def run_bench(arguments: [str], prog: str) -> None:
+    from src.benchmarks import run_benchmarks
+
+    log_startup_time('bench')
+    run_benchmarks.main(arguments, prog=f'{prog} bench')
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Prediction of the revenue of movies')
+    subparsers = parser.add_subparsers(dest='command')
+
+    # options shared by the commands using the csv files & the transformed dfs
+    paths_parser = argparse.ArgumentParser(add_help=False)
+    paths_parser.add_argument('--training-file', default=constants.path_training_file)
+    paths_parser.add_argument('--testing-file', default=constants.path_testing_file)
+    paths_parser.add_argument('--vocabulary', default=constants.path_vocabulary_file)
+    paths_parser.add_argument('--feature-store', default=constants.path_feature_store_directory)
+    paths_parser.add_argument('--incremental-feature-store', default=constants.path_incremental_feature_store_directory)
+    paths_parser.add_argument('--trace', default=constants.path_trace_file if export_trace else None,
+                              help='export the timing & memory of each stage to this file')
+    transforming_parser = argparse.ArgumentParser(add_help=False, parents=[paths_parser])
+    transforming_parser.add_argument('--nb-workers-transforming', type=int, default=nb_workers_transforming)
+    transforming_parser.add_argument('--no-feature-store', dest='use_feature_store', action='store_false',
+                                     default=use_feature_store)
+    transforming_parser.add_argument('--incremental', action='store_true', default=use_incremental_feature_store,
+                                     help='append the rows of the new files to the incremental feature store')
+    transforming_parser.add_argument('--new-training-file', default=path_new_training_file)
+    transforming_parser.add_argument('--new-testing-file', default=path_new_testing_file)
+
+    subparsers.add_parser('transform', parents=[transforming_parser],
+                          help='transform the csv files (or load them from the feature store)')
+    cv_parser = subparsers.add_parser('cv', parents=[transforming_parser], help='cross validate the model')
+    cv_parser.add_argument('--without-leak', action='store_true',
+                           help='learn the vocabulary of each fold without its validation rows')
+    cv_parser.add_argument('--nb-workers-cross-validation', type=int, default=nb_workers_cross_validation)
+    tune_parser = subparsers.add_parser('tune', parents=[transforming_parser], help='tune the hyperparameters')
+    tune_parser.add_argument('--method', choices=['grid_search_cv', 'randomized_search_cv', 'successive_halving'],
+                             default='successive_halving')
+    tune_parser.add_argument('--tuning-checkpoint', default=constants.path_tuning_checkpoint_directory)
+    predict_parser = subparsers.add_parser('predict', parents=[transforming_parser],
+                                           help='train (or load) the model & predict the testing file')
+    predict_parser.add_argument('--result-file', default=constants.path_result_file)
+    predict_parser.add_argument('--model-registry', default=constants.path_model_registry_directory)
+    predict_parser.add_argument('--no-model-registry', dest='use_model_registry', action='store_false',
+                                default=use_model_registry)
+    predict_parser.add_argument('--train-only', action='store_true',
+                                help='only train the model & save it in the model registry (for the server)')
+    predict_parser.add_argument('--by-chunks', action='store_true',
+                                help='transform & predict the input file chunk by chunk, with the saved vocabulary '
+                                     'and model (of --train-only)')
+    predict_parser.add_argument('--input-file', default=path_input_file)
+    predict_parser.add_argument('--model-key', default=None,
+                                help='key of the model of --by-chunks (default: the latest saved model)')
+    predict_parser.add_argument('--chunk-size', type=int, default=chunk_size)
+    predict_parser.add_argument('--nb-processes', type=int, default=nb_processes)
+    # the options of these commands are the ones of the prediction server & of the benchmarks (whose parsers are
+    # named after the command, e.g. for their usage)
+    subparsers.add_parser('serve', add_help=False, help='serve the predictions of the latest model')
+    subparsers.add_parser('bench', add_help=False, help='benchmark the hot paths')
+    return parser
+
+
+def main(arguments: [str] = None) -> None:
+    parser = get_parser()
+    args, other_arguments = parser.parse_known_args(arguments)
+    if args.command is None:
+        # the options only exist inside the commands
+        if other_arguments:
+            parser.error(f'unrecognized arguments: {" ".join(other_arguments)}')
+        args, other_arguments = parser.parse_known_args(commands_by_mode[mode])
+    if args.command == 'serve':
+        run_serve(other_arguments, parser.prog)
+        return
+    if args.command == 'bench':
+        run_bench(other_arguments, parser.prog)
+        return
+    if other_arguments:
+        parser.error(f'unrecognized arguments: {" ".join(other_arguments)}')
+
+    if args.trace:
+        instrumentation.enable_trace(args.trace)
+    {'transform': run_transform, 'cv': run_cv, 'tune': run_tune, 'predict': run_predict}[args.command](args)
+    instrumentation.export_trace()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import numpy as np
+from scipy import sparse
+
+if TYPE_CHECKING:
+    # sklearn & joblib are only imported to save a model or load its estimator: loading the memory-mapped trees
+    # (e.g. by the prediction server) does not need them
+    from sklearn.ensemble import RandomForestRegressor
+
+# to increment each time the content of a saved model changes
+MODEL_REGISTRY_VERSION = 2
+# parameters of the model which do not change the trained model
+parameters_without_effect = ['n_jobs', 'verbose']
+
+
+def check_feature_columns(feature_columns: [str], expected_feature_columns: [str]) -> None:
+    # the features are given to the models by position: they must follow the layout of the training of the model
+    feature_columns = [str(col) for col in feature_columns]
+    expected_feature_columns = [str(col) for col in expected_feature_columns]
+    if feature_columns != expected_feature_columns:
+        differences = [(col, expected_col) for col, expected_col in zip(feature_columns, expected_feature_columns)
+                       if col != expected_col]
+        raise ValueError(f'the features do not follow the layout of the model: {len(feature_columns)} columns '
+                         f'instead of {len(expected_feature_columns)}, first difference {differences[:1]}')
+
+
+class MemoryMappedForest:
+    # trained random forest whose trees are stored as flat arrays (one row by node of all the trees), which are
+    # memory-mapped: the processes of the host loading the same model share the same copy of the trees
+    # (contrary to the trees of sklearn, which copy their nodes when unpickled, even with joblib's mmap_mode)
+    def __init__(self, path_directory: str):
+        self.path_directory = path_directory
+        self.__load()
+
+    def __load(self):
+        with open(os.path.join(self.path_directory, 'metadata.json')) as file:
+            metadata = json.load(file)
+        if metadata.get('version') != MODEL_REGISTRY_VERSION:
+            raise ValueError(f'{self.path_directory} has been saved with the version {metadata.get("version")} of '
+                             f'the registry, the version {MODEL_REGISTRY_VERSION} is expected')
+        self.feature_columns = metadata['feature_columns']
+        self.n_features_in_ = metadata['nb_features']
+        self.roots = np.array(metadata['roots'], dtype=np.int64)
+        for array_name in ['children_left', 'children_right', 'feature', 'threshold', 'missing_go_to_left', 'value']:
+            # (ndarray views of the memory-mapped files, much faster to index than np.memmap)
+            setattr(self, array_name, np.asarray(np.load(os.path.join(self.path_directory, f'{array_name}.npy'),
+                                                         mmap_mode='r')))
+
+    def __getstate__(self) -> dict:
+        # only the path is sent to other processes, which map the same files
+        return {'path_directory': self.path_directory}
+
+    def __setstate__(self, state: dict):
+        self.path_directory = state['path_directory']
+        self.__load()
+
+    def predict(self, features_matrix, nb_rows_by_batch: int = 1024) -> np.ndarray:
+        # same computation as sklearn: the features are float32, a row goes to the left child if value <= threshold,
+        # or if the value is missing (NaN) & the missing values of the node go to the left (sklearn >= 1.4)
+        is_sparse = sparse.issparse(features_matrix)
+        features_matrix = (sparse.csr_matrix(features_matrix, dtype=np.float32) if is_sparse else
+                           np.asarray(features_matrix, dtype=np.float32))
+        predictions = np.empty(features_matrix.shape[0])
+        for start in range(0, features_matrix.shape[0], nb_rows_by_batch):
+            batch = features_matrix[start:start + nb_rows_by_batch]
+            batch = batch.toarray() if is_sparse else batch
+            # current node of each (tree, row), all the trees go down together
+            nodes = np.repeat(self.roots[:, np.newaxis], batch.shape[0], axis=1)
+            rows = np.broadcast_to(np.arange(batch.shape[0]), nodes.shape)
+            positions_active = np.flatnonzero(self.children_left[nodes] != -1)
+            while positions_active.size:
+                active_nodes = nodes.flat[positions_active]
+                values = batch[rows.flat[positions_active], self.feature[active_nodes]]
+                go_left = (values <= self.threshold[active_nodes]) | (np.isnan(values) &
+                                                                     self.missing_go_to_left[active_nodes])
+                nodes.flat[positions_active] = np.where(go_left, self.children_left[active_nodes],
+                                                        self.children_right[active_nodes])
+                positions_active = positions_active[self.children_left[nodes.flat[positions_active]] != -1]
+            predictions[start:start + batch.shape[0]] = self.value[nodes].sum(axis=0) / self.roots.size
+        return predictions
+
+
+class ModelRegistry:
+    # trained models, one directory per key (hash of the training data, of the layout & of the parameters)
+    def __init__(self, path_directory: str):
+        self.path_directory = path_directory
+
+    @staticmethod
+    def get_key(features_matrix: sparse.csr_matrix, labels: np.ndarray, feature_columns: [str],
+                rf: 'RandomForestRegressor') -> str:
+        hash_key = hashlib.sha256(str(MODEL_REGISTRY_VERSION).encode())
+        parameters = {name: value for name, value in rf.get_params().items() if name not in parameters_without_effect}
+        hash_key.update(json.dumps([type(rf).__name__, parameters, feature_columns], sort_keys=True,
+                                   default=str).encode())
+        features_matrix = sparse.csr_matrix(features_matrix)
+        hash_key.update(str(features_matrix.shape).encode())
+        for array in [features_matrix.data, features_matrix.indices, features_matrix.indptr, labels]:
+            hash_key.update(np.ascontiguousarray(array).tobytes())
+        return hash_key.hexdigest()
+
+    def contains(self, key: str) -> bool:
+        return os.path.isfile(os.path.join(self.path_directory, key, 'metadata.json'))
+
+    def save(self, key: str, rf: 'RandomForestRegressor', feature_columns: [str]) -> None:
+        import joblib
+
+        # written in a temporary directory first, so that a key is never partially saved
+        path_key_directory = os.path.join(self.path_directory, key)
+        path_tmp_directory = f'{path_key_directory}.tmp'
+        shutil.rmtree(path_tmp_directory, ignore_errors=True)
+        os.makedirs(path_tmp_directory)
+
+        # nodes of all the trees, the children of the nodes are positions inside the flat arrays
+        trees = [estimator.tree_ for estimator in rf.estimators_]
+        roots = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+        arrays_dict = {
+            'children_left': np.concatenate([np.where(tree.children_left != -1, tree.children_left + root, -1)
+                                             for tree, root in zip(trees, roots)]),
+            'children_right': np.concatenate([np.where(tree.children_right != -1, tree.children_right + root, -1)
+                                              for tree, root in zip(trees, roots)]),
+            'feature': np.concatenate([np.maximum(tree.feature, 0) for tree in trees]),
+            'threshold': np.concatenate([tree.threshold for tree in trees]),
+            # (the trees of sklearn < 1.4 do not support the missing values)
+            'missing_go_to_left': np.concatenate([getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count))
+                                                  for tree in trees]).astype(bool),
+            'value': np.concatenate([tree.value[:, 0, 0] for tree in trees])}
+        for array_name, array in arrays_dict.items():
+            np.save(os.path.join(path_tmp_directory, f'{array_name}.npy'), array)
+        # the estimator itself, e.g. for its feature importances
+        joblib.dump(rf, os.path.join(path_tmp_directory, 'model.joblib'))
+        with open(os.path.join(path_tmp_directory, 'metadata.json'), 'w') as file:
+            json.dump({'version': MODEL_REGISTRY_VERSION, 'feature_columns': [str(col) for col in feature_columns],
+                       'nb_features': rf.n_features_in_, 'roots': roots.tolist(), 'parameters': rf.get_params(),
+                       'date': datetime.now().isoformat()}, file, default=str)
+
+        shutil.rmtree(path_key_directory, ignore_errors=True)
+        os.replace(path_tmp_directory, path_key_directory)
+        with open(os.path.join(self.path_directory, 'latest'), 'w') as file:
+            file.write(key)
+
+    def get_latest_key(self) -> str:
+        with open(os.path.join(self.path_directory, 'latest')) as file:
+            return file.read().strip()
+
+    def load(self, key: str) -> MemoryMappedForest:
+        return MemoryMappedForest(os.path.join(self.path_directory, key))
+
+    def load_estimator(self, key: str) -> 'RandomForestRegressor':
+        import joblib
+        return joblib.load(os.path.join(self.path_directory, key, 'model.joblib'))
@@ -1,10 +1,18 @@
-import ast
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
-from src.core import tools
+from src.core import sparse_encoding, tools
+from src.core.inverted_index import factorize, get_inverted_index, get_jobs_inverted_index, InvertedIndex
+from src.core.parsed_column import get_parsed_column, get_series_key
 from src.utils import constants
 
 
+# dense features of the encoding with target statistics (by row: mean, max & min of the statistics of its keys,
+# number of keys & best frequency rank of its keys)
+target_statistics_names = ['target_mean', 'target_max', 'target_min', 'nb_entities', 'frequency_rank']
+
+
 class OneHotEncodingColumn:
     def __init__(self, training_series: pd.Series, testing_series: pd.Series, id_name_col: str,
                  prefix_name_columns: str, threshold_popularity: int = 0):
@@ -15,143 +23,356 @@ class OneHotEncodingColumn:
         self.id_name_col = id_name_col
         self.prefix_name_columns = prefix_name_columns
         self.threshold_popularity = threshold_popularity
+        # fitted state (i.e. everything needed to encode new series)
+        self.encoding_type = None
+        self.keys = list()
+        self.need_to_simplify = False
+        self.names_jobs_dict = {'Director': 'director', 'Producer': 'producer'}
+        # minimum number of movies (excluded) of a character to have a column
+        self.threshold_experience = 5
+        self.candidates_jobs_dict = dict()
+        self.nb_buckets = 0
+        self.signed_hashing = True
+        self.hashing_by_job = False
+        # statistics of the log of the labels of the movies of each key & frequency rank of each key
+        self.smoothing = 0
+        self.nb_folds = 0
+        self.random_state = None
+        self.prior = 0
+        self.target_means = np.empty(0)
+        self.frequency_ranks = np.empty(0)
+        # encoding of the training series of the fit, computed out-of-fold
+        self.out_of_fold_block = None
+
+    def __getstate__(self) -> dict:
+        # the original series and the translation are only needed during the fit, the out-of-fold encoding only
+        # for the training series of the fit
+        state = self.__dict__.copy()
+        state.update({'original_training_series': None, 'original_testing_series': None,
+                      'translation_dict': dict(), 'set_unique_values': set(), 'out_of_fold_block': None})
+        return state
+
+    def __get_original_series(self, type_dataset: str) -> pd.Series:
+        return self.original_training_series if type_dataset == 'training' else self.original_testing_series
+
+    def __get_fitted_series(self) -> [pd.Series]:
+        return [series for series in [self.original_training_series, self.original_testing_series]
+                if series is not None]
 
     def __set_unique_values_as_dict(self):
-        for series in [self.original_training_series, self.original_testing_series]:
+        for series in self.__get_fitted_series():
             self.translation_dict.update(tools.get_unique_values_from_series(series, self.id_name_col))
 
     def __set_unique_values_as_set(self):
-        for series in [self.original_training_series, self.original_testing_series]:
+        for series in self.__get_fitted_series():
             self.set_unique_values = self.set_unique_values.union(set(series.value_counts().index))
 
-    def encode_series_representing_as_dict(self, type_dataset: str) -> pd.DataFrame:
-        # initialise variables
-        original_series = self.original_training_series if type_dataset == 'training' else self.original_testing_series
-        encoded_df = None
-        if not self.translation_dict:
-            self.__set_unique_values_as_dict()
+    def get_column_name(self, key, name_job: str = None) -> str:
+        if name_job is not None:
+            return f'{self.names_jobs_dict[name_job]}_{key}'
+        return f'{self.prefix_name_columns}_{key}'
 
-        # create the df which will be one hot encoded
-        for key in self.translation_dict.keys():
-            if encoded_df is None:
-                frame = {'original_col': original_series,
-                         f'{self.prefix_name_columns}_{key}': [0] * original_series.size}
-                encoded_df = pd.DataFrame.from_dict(frame)
-            else:
-                encoded_df[f'{self.prefix_name_columns}_{key}'] = 0
+    def get_columns_names(self) -> [str]:
+        if self.encoding_type == 'with_target_statistics':
+            return [self.get_column_name(key) for key in target_statistics_names]
+        if self.encoding_type == 'with_hashing':
+            return [self.get_column_name(f'hash_{bucket}') for bucket in range(self.nb_buckets)]
+        if self.encoding_type == 'with_most_popular':
+            return [self.get_column_name(key) for key in ['other'] + self.keys]
+        if self.encoding_type == 'with_characters_description':
+            columns = [self.get_column_name('other', name_job) for name_job in self.names_jobs_dict]
+            for name_job in self.names_jobs_dict:
+                columns += [self.get_column_name(key, name_job) for key in self.candidates_jobs_dict[name_job]]
+            return columns
+        return [self.get_column_name(key) for key in self.keys]
 
-        # assign values (=1) for those new columns
-        for index, row_collection in original_series.iteritems():
-            if isinstance(row_collection, str):
-                # if float, row = Nan
-                for item in ast.literal_eval(row_collection):
-                    id_collection = item[self.id_name_col]
-                    encoded_df.loc[index, f'{self.prefix_name_columns}_{id_collection}'] = 1
+    # fit: learn the vocabulary from the training & testing series #
 
-        # delete the original column
-        return encoded_df.drop(['original_col'], axis=1)
+    def fit_series_representing_as_dict(self) -> None:
+        if not self.translation_dict:
+            self.__set_unique_values_as_dict()
+        self.encoding_type = 'representing_as_dict'
+        self.keys = list(self.translation_dict.keys())
 
-    def encode_series_with_most_popular(self, type_dataset: str, need_to_simplify: bool = False) -> pd.DataFrame:
-        # initialise variables
-        original_series = self.original_training_series if type_dataset == 'training' else self.original_testing_series
+    def fit_series_with_most_popular(self, need_to_simplify: bool = False) -> None:
         if not self.translation_dict:
             self.__set_unique_values_as_dict()
         # get simplified (if necessary) & famous names
         translation_simplified_names_dict = (tools.simplify_names(self.translation_dict.values(),
                                                                   constants.useless_info_inside_title)
                                              if need_to_simplify else dict())
-        famous_names_list = tools.get_unique_famous_names(
-            [self.original_training_series, self.original_testing_series],
-            translation_simplified_names_dict, self.threshold_popularity)
+        self.encoding_type = 'with_most_popular'
+        self.need_to_simplify = need_to_simplify
+        self.keys = tools.get_unique_famous_names(self.__get_fitted_series(), translation_simplified_names_dict,
+                                                  self.threshold_popularity, self.id_name_col)
 
-        # create the df which will be one hot encoded
-        frame = {'original_col': original_series,
-                 f'{self.prefix_name_columns}_other': [0] * original_series.size}
-        encoded_df = pd.DataFrame.from_dict(frame)
-        for key in famous_names_list:
-            encoded_df[f'{self.prefix_name_columns}_{key}'] = 0
+    def fit_series_with_characters_description(self) -> None:
+        self.encoding_type = 'with_characters_description'
+        self.candidates_jobs_dict = tools.get_unique_specific_jobs(self.__get_fitted_series(),
+                                                                   self.names_jobs_dict.keys(),
+                                                                   self.threshold_experience)
 
-        # assign values (=1) for those new columns
-        for index, row_collection in original_series.iteritems():
-            if isinstance(row_collection, str):
-                # if float, row = Nan
-                for item in ast.literal_eval(row_collection):
-                    # determine names
-                    original_name = item['name']
-                    simplified_name = translation_simplified_names_dict[
-                        original_name] if translation_simplified_names_dict else original_name
-
-                    # determine previous frequency
-                    name_of_column_for_df = f'{self.prefix_name_columns}_{simplified_name}' if simplified_name in famous_names_list else f'{self.prefix_name_columns}_other'
-                    frequency_for_name = encoded_df.loc[index, name_of_column_for_df]
-                    encoded_df.loc[index, name_of_column_for_df] = 1 + frequency_for_name
-
-        # delete the original column
-        return encoded_df.drop(['original_col'], axis=1)
+    def fit_series_with_hashing(self, nb_buckets: int, signed_hashing: bool = True, need_to_simplify: bool = False,
+                                hashing_by_job: bool = False) -> None:
+        # nothing to learn: the width of the block only depends on the number of buckets
+        self.encoding_type = 'with_hashing'
+        self.nb_buckets = nb_buckets
+        self.signed_hashing = signed_hashing
+        self.need_to_simplify = need_to_simplify
+        self.hashing_by_job = hashing_by_job
 
-    def encode_series_with_characters_description(self, type_dataset: str) -> pd.DataFrame:
-        # initialise variables
-        original_series = self.original_training_series if type_dataset == 'training' else self.original_testing_series
-        names_jobs_dict = {'Director': 'director', 'Producer': 'producer'}
-        candidates_jobs_dict = tools.get_unique_specific_jobs(
-            [self.original_training_series, self.original_testing_series], names_jobs_dict.keys(), 5)
-
-        # create the df which will be one hot encoded
-        frame = {'original_col': original_series,
-                 'director_other': [0] * original_series.size,
-                 'producer_other': [0] * original_series.size}
-        encoded_df = pd.DataFrame.from_dict(frame)
-        for name_job, nickname_name_job in names_jobs_dict.items():
-            for key in candidates_jobs_dict[name_job]:
-                encoded_df[f'{nickname_name_job}_{key}'] = 0
+    def fit_series_with_target_statistics(self, training_labels: np.ndarray, smoothing: float = 10,
+                                          nb_folds: int = 5, random_state: int = 42,
+                                          mask_training_rows: np.ndarray = None) -> None:
+        # mean of the log of the labels of the movies of each key (e.g. id of a genre), smoothed towards the mean of
+        # all the movies (prior), & frequency rank of each key inside the training & testing series (1: most frequent)
+        # only the labels of the rows of mask_training_rows are learnt (default: all the training rows)
+        self.encoding_type = 'with_target_statistics'
+        self.smoothing = smoothing
+        self.nb_folds = nb_folds
+        self.random_state = random_state
+        indexes = [self.__get_entities_index(series) for series in self.__get_fitted_series()]
+        codes, self.keys = factorize([entity for index in indexes for entity in index.entities])
+        frequencies = np.zeros(len(self.keys))
+        first_position = 0
+        for index in indexes:
+            frequencies[codes[first_position:first_position + len(index.entities)]] += index.counts
+            first_position += len(index.entities)
+        self.frequency_ranks = np.empty(len(self.keys))
+        self.frequency_ranks[np.argsort(-frequencies, kind='stable')] = np.arange(1, len(self.keys) + 1)
 
-        # assign values (=1) for those new columns
-        for index, row_collection in original_series.iteritems():
-            if isinstance(row_collection, str):
-                # if float, row = Nan
-                try:
-                    list_characters = ast.literal_eval(row_collection)
-                    for character in list_characters:
-                        character_job = character['job']
-                        for name_job, nickname_name_job in names_jobs_dict.items():
-                            if character_job == name_job:
-                                id_candidate = character['id']
-                                name_of_column_for_df = f'{nickname_name_job}_{id_candidate}' if id_candidate in \
-                                                                                                 candidates_jobs_dict[
-                                                                                                     name_job] else f'{nickname_name_job}_other'
-                                encoded_df.loc[index, name_of_column_for_df] = 1
-                except ValueError:
-                    pass
-
-        # delete the original column
-        return encoded_df.drop(['original_col'], axis=1)
+        # sum & number of the labels of each key, over the exploded (key, row) pairs of the training series
+        item_keys = codes[:len(indexes[0].entities)][indexes[0].codes]
+        item_row_positions = indexes[0].item_row_positions
+        log_labels = np.log1p(np.asarray(training_labels, dtype=np.float64))
+        if mask_training_rows is None:
+            mask_training_rows = np.ones(log_labels.size, dtype=bool)
+        self.prior = float(log_labels[mask_training_rows].mean()) if mask_training_rows.any() else 0
+        sums, counts = _get_sums_and_counts(item_keys, item_row_positions, log_labels, mask_training_rows,
+                                            len(self.keys))
+        self.target_means = (sums + smoothing * self.prior) / (counts + smoothing)
 
-    def encode_series_representing_as_item(self, type_dataset: str, list_unique_values: list) -> pd.DataFrame:
-        # initialise variables
-        original_series = self.original_training_series if type_dataset == 'training' else self.original_testing_series
-        encoded_df = None
+        # out-of-fold encoding of the training series: the rows of a fold are encoded with the statistics of the
+        # other folds (the label of a row is never part of its own features), the rows not learnt with all of them
+        # (imported here, so that the prediction server, which only transforms, does not load sklearn)
+        from sklearn.model_selection import KFold
+        item_values = self.target_means[item_keys]
+        training_positions = np.flatnonzero(mask_training_rows)
+        if training_positions.size >= 2:
+            k_fold = KFold(min(nb_folds, training_positions.size), shuffle=True, random_state=random_state)
+            for _, fold_positions in k_fold.split(training_positions):
+                mask_fold_rows = np.zeros(log_labels.size, dtype=bool)
+                mask_fold_rows[training_positions[fold_positions]] = True
+                fold_sums, fold_counts = _get_sums_and_counts(item_keys, item_row_positions, log_labels,
+                                                              mask_fold_rows, len(self.keys))
+                prior = log_labels[mask_training_rows & ~mask_fold_rows].mean()
+                mask_fold_items = mask_fold_rows[item_row_positions]
+                item_values[mask_fold_items] = ((sums - fold_sums + smoothing * prior) /
+                                                (counts - fold_counts + smoothing))[item_keys[mask_fold_items]]
+        self.out_of_fold_block = sparse_encoding.FeatureBlock(
+            _aggregate_target_statistics(item_values, self.frequency_ranks[item_keys], item_row_positions,
+                                         log_labels.size), self.get_columns_names())
+
+    def fit_series_representing_as_item(self, list_unique_values: list) -> None:
         if list_unique_values:
             # the list is provided as a parameter of the function
             self.set_unique_values = list_unique_values
-        elif not self.set_unique_values:
-            # no list provided as a parameter of the function & no idea of what are the unique values of dataset
-            self.__set_unique_values_as_set()
-
-        # create df which will be one hot encoded
-        for key in self.set_unique_values:
-            if encoded_df is None:
-                frame = {'original_col': original_series,
-                         f'{self.prefix_name_columns}_{key}': [0] * original_series.size}
-                encoded_df = pd.DataFrame.from_dict(frame)
-            else:
-                encoded_df[f'{self.prefix_name_columns}_{key}'] = 0
+            self.keys = list(list_unique_values)
+        else:
+            if not self.set_unique_values:
+                # no list provided as a parameter of the function & no idea of what are the unique values of dataset
+                self.__set_unique_values_as_set()
+            # sorted, so that the order of the columns does not depend on the hash of the values
+            self.keys = sorted(self.set_unique_values, key=str)
+        self.encoding_type = 'representing_as_item'
+
+    # transform: encode any series with the fitted vocabulary #
+
+    def transform_series(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        if self.encoding_type == 'representing_as_dict':
+            return self.transform_series_representing_as_dict(series)
+        if self.encoding_type == 'with_most_popular':
+            return self.transform_series_with_most_popular(series)
+        if self.encoding_type == 'with_characters_description':
+            return self.transform_series_with_characters_description(series)
+        if self.encoding_type == 'representing_as_item':
+            return self.transform_series_representing_as_item(series)
+        if self.encoding_type == 'with_hashing':
+            return self.transform_series_with_hashing(series)
+        if self.encoding_type == 'with_target_statistics':
+            return self.transform_series_with_target_statistics(series)
+        raise ValueError(f'The encoding of {self.prefix_name_columns} has not been fitted')
+
+    def transform_series_representing_as_dict(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        # determine the column of each item
+        parsed_column = get_parsed_column(series, self.id_name_col)
+        column_positions = pd.Index(self.keys).get_indexer(parsed_column.ids)
+
+        # assign values (=1) for those new columns
+        matrix = sparse_encoding.encode_positions(parsed_column.get_row_positions(), column_positions,
+                                                  series.size, len(self.keys))
+        return sparse_encoding.FeatureBlock(matrix, self.get_columns_names())
+
+    def transform_series_with_most_popular(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        # get simplified (if necessary) names
+        parsed_column = get_parsed_column(series, self.id_name_col)
+        names = parsed_column.names.tolist()
+        if self.need_to_simplify:
+            translation_simplified_names_dict = tools.simplify_names(set(names), constants.useless_info_inside_title)
+            names = [translation_simplified_names_dict[original_name] for original_name in names]
+
+        # determine the column of each item (the first column gathers the names which are not famous)
+        column_positions = pd.Index(self.keys).get_indexer(names) + 1
+
+        # assign values (=frequency) for those new columns
+        matrix = sparse_encoding.encode_positions(parsed_column.get_row_positions(), column_positions,
+                                                  series.size, len(self.keys) + 1, count_occurrences=True)
+        return sparse_encoding.FeatureBlock(matrix, self.get_columns_names())
+
+    def transform_series_with_characters_description(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        # determine the column of each character having one of the jobs
+        # (the first columns gather the candidates who are not experienced enough)
+        jobs_inverted_index = get_jobs_inverted_index(series)
+        row_positions, column_positions = list(), list()
+        first_position_job = len(self.names_jobs_dict)
+        for position_other, name_job in enumerate(self.names_jobs_dict.keys()):
+            index = jobs_inverted_index.get_index(name_job)
+            positions_job = index.get_item_positions(self.candidates_jobs_dict[name_job])
+            row_positions.append(index.item_row_positions)
+            column_positions.append(np.where(positions_job >= 0, positions_job + first_position_job, position_other))
+            first_position_job += len(self.candidates_jobs_dict[name_job])
+
+        # assign values (=1) for those new columns
+        matrix = sparse_encoding.encode_positions(np.concatenate(row_positions), np.concatenate(column_positions),
+                                                  series.size, first_position_job)
+        return sparse_encoding.FeatureBlock(matrix, self.get_columns_names())
+
+    def transform_series_representing_as_item(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        # determine the column of each row
+        column_positions = pd.Index(self.keys).get_indexer(series.to_numpy())
 
         # assign values (=1) for those new columns
-        for index, row in original_series.iteritems():
-            if row in self.set_unique_values:
-                encoded_df.loc[index, f'{self.prefix_name_columns}_{row}'] = 1
+        matrix = sparse_encoding.encode_positions(np.arange(series.size), column_positions, series.size,
+                                                  len(self.keys))
+        return sparse_encoding.FeatureBlock(matrix, self.get_columns_names())
+
+    def transform_series_with_hashing(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        if self.hashing_by_job:
+            # the hashed values are the ids of the characters having one of the jobs (e.g. director_12)
+            parsed_column = get_parsed_column(series, 'id')
+            mask_jobs = np.isin(parsed_column.jobs, list(self.names_jobs_dict.keys()))
+            row_positions = parsed_column.get_row_positions()[mask_jobs]
+            tokens = [f'{self.names_jobs_dict[name_job]}_{id_character}' for name_job, id_character in
+                      zip(parsed_column.jobs[mask_jobs].tolist(), parsed_column.ids[mask_jobs].tolist())]
+        else:
+            # the hashed values are the (simplified if necessary) names
+            parsed_column = get_parsed_column(series, self.id_name_col)
+            row_positions = parsed_column.get_row_positions()
+            tokens = parsed_column.names.tolist()
+            if self.need_to_simplify:
+                translation_simplified_names_dict = tools.simplify_names(set(tokens),
+                                                                         constants.useless_info_inside_title)
+                tokens = [translation_simplified_names_dict[original_name] for original_name in tokens]
+
+        # assign values (=sum of the signs of the values falling into the bucket) for those new columns
+        column_positions, signs = sparse_encoding.hash_tokens(tokens, self.nb_buckets, self.signed_hashing)
+        matrix = sparse_encoding.encode_positions(row_positions, column_positions, series.size, self.nb_buckets,
+                                                  count_occurrences=True, values=signs)
+        return sparse_encoding.FeatureBlock(matrix, self.get_columns_names())
+
+    def transform_series_with_target_statistics(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        # the keys unknown by the fit have the prior as mean & the worst frequency rank
+        index = self.__get_entities_index(series)
+        positions = index.get_item_positions(self.keys)
+        item_values = np.append(self.target_means, self.prior)[positions]
+        item_frequency_ranks = np.append(self.frequency_ranks, len(self.keys) + 1)[positions]
+        return sparse_encoding.FeatureBlock(
+            _aggregate_target_statistics(item_values, item_frequency_ranks, index.item_row_positions, series.size),
+            self.get_columns_names())
+
+    def transform_training_series(self, series: pd.Series) -> sparse_encoding.FeatureBlock:
+        # the training series of the fit (same values & index), whose statistics are the out-of-fold ones
+        if self.encoding_type != 'with_target_statistics':
+            return self.transform_series(series)
+        if self.out_of_fold_block is None or self.original_training_series is None:
+            raise ValueError(f'the out-of-fold encoding of {self.prefix_name_columns} is only available before '
+                             f'the encoder is pickled')
+        if (get_series_key(series) != get_series_key(self.original_training_series) or
+                not series.index.equals(self.original_training_series.index)):
+            raise ValueError(f'{series.name} is not the training series of the fit of {self.prefix_name_columns}')
+        return self.out_of_fold_block
+
+    def __get_entities_index(self, series: pd.Series) -> InvertedIndex:
+        # keys of the rows: ids of the items of the cells (e.g. genres) or values of the cells (e.g. languages)
+        if self.id_name_col is not None:
+            return get_inverted_index(series, self.id_name_col)
+        mask_known_values = series.notna().to_numpy()
+        return InvertedIndex(series.to_numpy()[mask_known_values], np.flatnonzero(mask_known_values), series.size)
+
+    # encode: fit & transform the original series #
+
+    def encode_series_representing_as_dict(self, type_dataset: str) -> pd.DataFrame:
+        if self.encoding_type is None:
+            self.fit_series_representing_as_dict()
+        original_series = self.__get_original_series(type_dataset)
+        return self.transform_series_representing_as_dict(original_series).to_df(original_series.index)
+
+    def encode_series_with_most_popular(self, type_dataset: str, need_to_simplify: bool = False) -> pd.DataFrame:
+        if self.encoding_type is None:
+            self.fit_series_with_most_popular(need_to_simplify)
+        original_series = self.__get_original_series(type_dataset)
+        return self.transform_series_with_most_popular(original_series).to_df(original_series.index)
+
+    def encode_series_with_characters_description(self, type_dataset: str) -> pd.DataFrame:
+        if self.encoding_type is None:
+            self.fit_series_with_characters_description()
+        original_series = self.__get_original_series(type_dataset)
+        return self.transform_series_with_characters_description(original_series).to_df(original_series.index)
+
+    def encode_series_with_hashing(self, type_dataset: str, nb_buckets: int, signed_hashing: bool = True,
+                                   need_to_simplify: bool = False, hashing_by_job: bool = False) -> pd.DataFrame:
+        if self.encoding_type is None:
+            self.fit_series_with_hashing(nb_buckets, signed_hashing, need_to_simplify, hashing_by_job)
+        original_series = self.__get_original_series(type_dataset)
+        return self.transform_series_with_hashing(original_series).to_df(original_series.index)
+
+    def encode_series_with_target_statistics(self, type_dataset: str, training_labels: np.ndarray,
+                                             smoothing: float = 10, nb_folds: int = 5) -> pd.DataFrame:
+        if self.encoding_type is None:
+            self.fit_series_with_target_statistics(training_labels, smoothing, nb_folds)
+        original_series = self.__get_original_series(type_dataset)
+        block = (self.transform_training_series(original_series) if type_dataset == 'training' else
+                 self.transform_series_with_target_statistics(original_series))
+        return block.to_df(original_series.index)
+
+    def encode_series_representing_as_item(self, type_dataset: str, list_unique_values: list) -> pd.DataFrame:
+        if self.encoding_type is None or list_unique_values:
+            self.fit_series_representing_as_item(list_unique_values)
+        original_series = self.__get_original_series(type_dataset)
+        return self.transform_series_representing_as_item(original_series).to_df(original_series.index)
+
 
-        # delete the original column
-        return encoded_df.drop(['original_col'], axis=1)
+def _get_sums_and_counts(item_keys: np.ndarray, item_row_positions: np.ndarray, log_labels: np.ndarray,
+                         mask_rows: np.ndarray, nb_keys: int) -> (np.ndarray, np.ndarray):
+    mask_items = mask_rows[item_row_positions]
+    sums = np.bincount(item_keys[mask_items], weights=log_labels[item_row_positions[mask_items]], minlength=nb_keys)
+    counts = np.bincount(item_keys[mask_items], minlength=nb_keys)
+    return sums, counts
 
 
+def _aggregate_target_statistics(item_values: np.ndarray, item_frequency_ranks: np.ndarray,
+                                 item_row_positions: np.ndarray, nb_rows: int) -> sparse.csc_matrix:
+    # group-by row of the (key, row) pairs, the rows without any key are 0
+    nb_entities = np.bincount(item_row_positions, minlength=nb_rows)
+    mask_empty_rows = nb_entities == 0
+    sums = np.bincount(item_row_positions, weights=item_values, minlength=nb_rows)
+    means = np.divide(sums, nb_entities, out=np.zeros(nb_rows), where=~mask_empty_rows)
+    maxs = np.full(nb_rows, -np.inf)
+    np.maximum.at(maxs, item_row_positions, item_values)
+    mins = np.full(nb_rows, np.inf)
+    np.minimum.at(mins, item_row_positions, item_values)
+    frequency_ranks = np.full(nb_rows, np.inf)
+    np.minimum.at(frequency_ranks, item_row_positions, item_frequency_ranks)
+    statistics = np.column_stack([means, maxs, mins, nb_entities, frequency_ranks])
+    statistics[mask_empty_rows] = 0
+    return sparse.csc_matrix(statistics)
@@ -0,0 +1,125 @@
+import ast
+import contextlib
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    # optional dependency, much faster than the json module of the standard library
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+class ParsedColumn:
+    # flat representation of a column whose cells are stringified lists of dicts:
+    # the items of the row i are stored between offsets[i] and offsets[i + 1] inside ids, names and jobs
+
+    def __init__(self, offsets: np.ndarray, ids: np.ndarray, names: np.ndarray, jobs: np.ndarray):
+        self.offsets = offsets
+        self.ids = ids
+        self.names = names
+        self.jobs = jobs
+        # built on demand by the module inverted_index
+        self.inverted_index = None
+        self.jobs_inverted_index = None
+
+    @property
+    def nb_rows(self) -> int:
+        return self.offsets.size - 1
+
+    def get_row_positions(self) -> np.ndarray:
+        # position of the row (0..nb_rows-1) of each item
+        return np.repeat(np.arange(self.nb_rows), np.diff(self.offsets))
+
+    @classmethod
+    def from_series(cls, series: pd.Series, id_name_col: str = 'id') -> 'ParsedColumn':
+        offsets = np.zeros(series.size + 1, dtype=np.int64)
+        ids, names, jobs = list(), list(), list()
+
+        for position, cell in enumerate(series):
+            # if float, cell = Nan
+            if isinstance(cell, str):
+                for item in parse_cell(cell):
+                    ids.append(item.get(id_name_col))
+                    names.append(item.get('name'))
+                    jobs.append(item.get('job'))
+            offsets[position + 1] = len(ids)
+
+        return cls(offsets, _to_array(ids), _to_array(names, dtype=object), _to_array(jobs, dtype=object))
+
+
+def _to_array(values: list, dtype=None) -> np.ndarray:
+    if not values:
+        return np.empty(0, dtype=object)
+    if dtype is None and any(value is None for value in values):
+        dtype = object
+    return np.array(values, dtype=dtype)
+
+
+def parse_cell(cell: str) -> list:
+    # fast path: without double quotes nor backslashes, each single quote delimits a python string
+    if '"' not in cell and '\\' not in cell:
+        parts = cell.split("'")
+        # python constants only appear outside the strings (even parts)
+        parts[0::2] = [part.replace('None', 'null').replace('True', 'true').replace('False', 'false')
+                       for part in parts[0::2]]
+        try:
+            return _json_loads('"'.join(parts))
+        except ValueError:
+            pass
+
+    # slow path
+    try:
+        return ast.literal_eval(cell)
+    except (ValueError, SyntaxError):
+        return list()
+
+
+# shared cache: each column is only parsed once per id_name_col during a run of the pipeline (fit, transform...) #
+# the cache only exists inside cache_scope: a column modified between two runs is parsed again
+
+_parsed_columns_cache = dict()
+_nb_active_scopes = 0
+_scopes_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def cache_scope():
+    # the scopes can be nested (e.g. a transform inside a cross validation), the cache is emptied by the outermost one
+    global _nb_active_scopes
+    with _scopes_lock:
+        if _nb_active_scopes == 0:
+            _parsed_columns_cache.clear()
+        _nb_active_scopes += 1
+    try:
+        yield
+    finally:
+        with _scopes_lock:
+            _nb_active_scopes -= 1
+            if _nb_active_scopes == 0:
+                _parsed_columns_cache.clear()
+
+
+def get_series_key(series: pd.Series) -> tuple:
+    # same key for all the series sharing the values of a column (only valid while the values are alive)
+    values = series.values
+    if isinstance(values, np.ndarray):
+        # df[col] may return a new series each time, but all of them share the memory of the column
+        return values.__array_interface__['data'][0], values.shape, values.strides
+    # extension array (e.g. strings stored by pyarrow): df[col] returns the same array each time,
+    # whereas converting it to numpy would copy it at each call
+    return id(values), len(values)
+
+
+def get_parsed_column(series: pd.Series, id_name_col: str = 'id') -> ParsedColumn:
+    if not _nb_active_scopes:
+        return ParsedColumn.from_series(series, id_name_col)
+    key = get_series_key(series) + (id_name_col,)
+    if key not in _parsed_columns_cache:
+        # the values are kept inside the cache so that their memory (or their id) cannot be reused by another column
+        _parsed_columns_cache[key] = (series.values, ParsedColumn.from_series(series, id_name_col))
+    return _parsed_columns_cache[key][1]
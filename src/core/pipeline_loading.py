@@ -1,20 +1,36 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
 import numpy as np
 import pandas as pd
+from sklearn.base import clone
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import cross_val_score, GridSearchCV, RandomizedSearchCV
+from sklearn.metrics import mean_squared_log_error
+from sklearn.model_selection import cross_val_score, GridSearchCV, KFold, ParameterSampler, RandomizedSearchCV
 
-from src.core import tools
+from src.core import sparse_encoding, tools
+from src.core.model_registry import check_feature_columns, MemoryMappedForest, ModelRegistry
+from src.core.pipeline_transforming import PipelineTransforming
+from src.core.sparse_encoding import FeaturesMatrix
+from src.core.vocabulary import FittedVocabulary
+from src.utils import constants, instrumentation
 from src.utils.logger import logger
 
 
-def cross_validate_model(training_df: pd.DataFrame, rf: RandomForestRegressor) -> None:
+@instrumentation.instrumented()
+def cross_validate_model(training_data: pd.DataFrame or FeaturesMatrix, rf: RandomForestRegressor) -> None:
     # cross validation
-    scores = cross_val_score(rf, training_df.drop(['revenue'], axis=1), training_df['revenue'], cv=5,
+    training_features = sparse_encoding.get_features(training_data)
+    scores = cross_val_score(rf, training_features.matrix, training_features.labels, cv=5,
                              scoring='neg_mean_squared_log_error')
     logger.info(scores)
 
 
-def tune_hyperparameters_by_grid_search_cv(training_df: pd.DataFrame) -> None:
+@instrumentation.instrumented()
+def tune_hyperparameters_by_grid_search_cv(training_data: pd.DataFrame or FeaturesMatrix,
+                                           rf: RandomForestRegressor) -> None:
     # build grid search CV model
     param_grid = {
         'bootstrap': [True],
@@ -29,14 +45,17 @@ def tune_hyperparameters_by_grid_search_cv(training_df: pd.DataFrame) -> None:
                                cv=3, n_jobs=-1, verbose=2)
 
     # fit
-    grid_search.fit(training_df.drop(['revenue'], axis=1), training_df['revenue'])
+    training_features = sparse_encoding.get_features(training_data)
+    grid_search.fit(training_features.matrix, training_features.labels)
     logger.info(grid_search.best_params_)
 
 
-def tune_hyperparameters_by_randomized_search_cv(training_df: pd.DataFrame) -> None:
+@instrumentation.instrumented()
+def tune_hyperparameters_by_randomized_search_cv(training_data: pd.DataFrame or FeaturesMatrix,
+                                                 rf: RandomForestRegressor) -> None:
     # build randomized search cv model
     n_estimators = [int(x) for x in np.linspace(start=200, stop=2000, num=10)] # number of trees in random forest
-    max_features = ['auto', 'sqrt'] # number of features to consider at every split
+    max_features = [1.0, 'sqrt'] # number of features to consider at every split
     max_depth = [int(x) for x in np.linspace(10, 110, num=11)]
     max_depth.append(None) # maximum number of levels in tree
     min_samples_split = [2, 5, 10] # minimum number of samples required to split a node
@@ -56,17 +75,209 @@ def tune_hyperparameters_by_randomized_search_cv(training_df: pd.DataFrame) -> N
                                    random_state=42, n_jobs=-1, scoring='neg_mean_squared_log_error')
 
     # fit
-    rf_random.fit(training_df.drop(['revenue'], axis=1), training_df['revenue'])
+    training_features = sparse_encoding.get_features(training_data)
+    rf_random.fit(training_features.matrix, training_features.labels)
     logger.info(rf_random.best_params_)
 
 
-def produce_submission_result(training_df: pd.DataFrame, testing_df: pd.DataFrame, rf: RandomForestRegressor) -> None:
-    # train model
-    rf.fit(training_df.drop(['revenue'], axis=1), training_df['revenue'])
+@instrumentation.instrumented()
+def tune_hyperparameters_by_successive_halving(training_data: pd.DataFrame or FeaturesMatrix, rf: RandomForestRegressor,
+                                               nb_candidates: int = 27, min_nb_trees: int = 25,
+                                               max_nb_trees: int = 675, factor: int = 3, nb_folds: int = 3,
+                                               path_checkpoint_directory: str =
+                                               constants.path_tuning_checkpoint_directory) -> dict:
+    # the budget of each round is the number of trees: the forests of the best candidates (1/factor) are grown with
+    # warm start for the next round, instead of being refit from scratch
+    param_distributions = {'max_features': [1.0, 'sqrt'],
+                           'max_depth': [int(x) for x in np.linspace(10, 110, num=11)] + [None],
+                           'min_samples_split': [2, 5, 10],
+                           'min_samples_leaf': [1, 2, 4],
+                           'bootstrap': [True, False]}
+    candidates = list(ParameterSampler(param_distributions, n_iter=nb_candidates, random_state=42))
+    budgets = [min_nb_trees]
+    while budgets[-1] * factor <= max_nb_trees:
+        budgets.append(budgets[-1] * factor)
+
+    # the matrix is built (or loaded) only once, each fold selects its rows
+    training_features = sparse_encoding.get_features(training_data)
+    features_matrix, labels = training_features.matrix, training_features.labels
+
+    # resume the previous search (if any) when its configuration is the same, including the training data, its layout
+    # & the parameters of the estimator (same key as the model registry)
+    configuration = {'candidates': candidates, 'budgets': budgets, 'nb_folds': nb_folds,
+                     'key_training': ModelRegistry.get_key(features_matrix, labels, training_features.columns, rf)}
+    state = _load_tuning_state(path_checkpoint_directory, configuration)
+
+    folds = list(KFold(n_splits=nb_folds, shuffle=True, random_state=42).split(features_matrix))
+
+    for position_round in range(state['position_round'], len(budgets)):
+        scores = state['scores'].setdefault(position_round, dict())
+        for id_candidate in state['ids_candidates']:
+            if id_candidate in scores:
+                # already evaluated before the interruption
+                continue
+            path_forests_file = os.path.join(path_checkpoint_directory, f'candidate_{id_candidate}.joblib')
+            forests = (joblib.load(path_forests_file) if os.path.exists(path_forests_file) else
+                       [clone(rf).set_params(warm_start=True, **candidates[id_candidate]) for _ in folds])
+            errors = list()
+            for forest, (training_positions, validation_positions) in zip(forests, folds):
+                # only the missing trees are grown
+                forest.set_params(n_estimators=budgets[position_round])
+                forest.fit(features_matrix[training_positions], labels[training_positions])
+                errors.append(np.sqrt(mean_squared_log_error(labels[validation_positions],
+                                                             forest.predict(features_matrix[validation_positions]))))
+            scores[id_candidate] = float(np.mean(errors))
+            logger.debug(f'candidate {id_candidate} ({budgets[position_round]} trees): RMSLE {scores[id_candidate]}')
+            joblib.dump(forests, path_forests_file)
+            _save_tuning_state(path_checkpoint_directory, state)
+
+        # keep the best candidates for the next round
+        ids_candidates_ranked = sorted(state['ids_candidates'], key=scores.get)
+        if position_round < len(budgets) - 1:
+            state['ids_candidates'] = ids_candidates_ranked[:max(1, len(ids_candidates_ranked) // factor)]
+        state['position_round'] = position_round + 1
+        _save_tuning_state(path_checkpoint_directory, state)
+        # the forests of the eliminated candidates will never be grown again
+        for id_candidate in set(ids_candidates_ranked) - set(state['ids_candidates']):
+            os.remove(os.path.join(path_checkpoint_directory, f'candidate_{id_candidate}.joblib'))
+        logger.info(f'round {position_round} ({budgets[position_round]} trees): best RMSLE '
+                    f'{scores[ids_candidates_ranked[0]]} with {candidates[ids_candidates_ranked[0]]}')
+
+    last_scores = state['scores'][len(budgets) - 1]
+    id_best_candidate = min(last_scores, key=last_scores.get)
+    best_params = dict(candidates[id_best_candidate], n_estimators=budgets[-1])
+    logger.info(best_params)
+    return best_params
+
+
+def _load_tuning_state(path_checkpoint_directory: str, configuration: dict) -> dict:
+    path_state_file = os.path.join(path_checkpoint_directory, 'state.joblib')
+    if os.path.exists(path_state_file):
+        state = joblib.load(path_state_file)
+        if state['configuration'] == configuration:
+            logger.info(f'Search resumed from {path_checkpoint_directory} (round {state["position_round"]})')
+            return state
+        logger.warning(f'{path_checkpoint_directory} contains another search, which is discarded')
+        for name_file in os.listdir(path_checkpoint_directory):
+            os.remove(os.path.join(path_checkpoint_directory, name_file))
+
+    os.makedirs(path_checkpoint_directory, exist_ok=True)
+    return {'configuration': configuration, 'position_round': 0,
+            'ids_candidates': list(range(len(configuration['candidates']))), 'scores': dict()}
+
+
+def _save_tuning_state(path_checkpoint_directory: str, state: dict) -> None:
+    # the previous state is replaced only once the new one is entirely written
+    path_state_file = os.path.join(path_checkpoint_directory, 'state.joblib')
+    joblib.dump(state, f'{path_state_file}.tmp')
+    os.replace(f'{path_state_file}.tmp', path_state_file)
+
+
+@instrumentation.instrumented()
+def train_model(training_data: pd.DataFrame or FeaturesMatrix, rf: RandomForestRegressor) -> RandomForestRegressor:
+    training_features = sparse_encoding.get_features(training_data)
+    return rf.fit(training_features.matrix, training_features.labels)
+
+
+@instrumentation.instrumented()
+def train_or_load_model(training_data: pd.DataFrame or FeaturesMatrix, rf: RandomForestRegressor,
+                        model_registry: ModelRegistry = None) -> RandomForestRegressor or MemoryMappedForest:
+    # without registry, the model is trained at each run
+    if model_registry is None:
+        return train_model(training_data, rf)
+    # the model is trained only if the training data, its layout or the parameters have changed since the last run
+    training_features = sparse_encoding.get_features(training_data)
+    key = ModelRegistry.get_key(training_features.matrix, training_features.labels, training_features.columns, rf)
+    if model_registry.contains(key):
+        logger.debug(f'Model loaded from the model registry ({key})')
+    else:
+        rf.fit(training_features.matrix, training_features.labels)
+        model_registry.save(key, rf, training_features.columns)
+    return model_registry.load(key)
+
+
+@instrumentation.instrumented()
+def produce_submission_result(training_data: pd.DataFrame or FeaturesMatrix,
+                              testing_data: pd.DataFrame or FeaturesMatrix, rf: RandomForestRegressor,
+                              model_registry: ModelRegistry = None,
+                              path_result_file: str = constants.path_result_file) -> None:
+    training_features = sparse_encoding.get_features(training_data)
+    testing_features = sparse_encoding.get_features(testing_data)
+    # train model (or load it from the model registry)
+    model = train_or_load_model(training_features, rf, model_registry)
+    check_feature_columns(testing_features.columns, getattr(model, 'feature_columns', training_features.columns))
     # produce result (i.e. revenues for testing dataset)
-    labels = rf.predict(testing_df)
-    frame = {'id': testing_df['id'],
+    with instrumentation.stage('predict', testing_features) as record:
+        labels = model.predict(testing_features.matrix)
+        record['output_shapes'] = instrumentation.get_shapes(labels)
+    frame = {'id': testing_features.get_column('id'),
              'revenue': labels}
     result = pd.DataFrame.from_dict(frame)
     # export result
-    tools.export_df_to_csv(result, 'data/result.csv')
+    tools.export_df_to_csv(result, path_result_file)
+
+
+# streaming prediction (the input file is never entirely loaded) #
+
+_chunk_worker_dict = dict()
+
+
+def _init_chunk_worker(fitted_vocabulary: FittedVocabulary,
+                       rf: RandomForestRegressor or MemoryMappedForest) -> None:
+    _chunk_worker_dict['pipeline_transforming'] = PipelineTransforming(None, None, fitted_vocabulary)
+    _chunk_worker_dict['rf'] = rf
+    # layout of the training of the model (the one of the vocabulary for a model which is not in the registry)
+    _chunk_worker_dict['feature_columns'] = getattr(rf, 'feature_columns', fitted_vocabulary.feature_columns)
+
+
+def _predict_chunk(chunk_df: pd.DataFrame) -> (pd.DataFrame, dict):
+    # returns the result & the record of its stage
+    with instrumentation.stage('predict chunk', chunk_df) as record:
+        testing_df = _chunk_worker_dict['pipeline_transforming'].transform(chunk_df)
+        check_feature_columns(testing_df.columns, _chunk_worker_dict['feature_columns'])
+        labels = _chunk_worker_dict['rf'].predict(sparse_encoding.get_features_matrix(testing_df))
+        frame = {'id': testing_df['id'],
+                 'revenue': labels}
+        result = pd.DataFrame.from_dict(frame)
+        record['output_shapes'] = instrumentation.get_shapes(result)
+    return result, record
+
+
+@instrumentation.instrumented()
+def produce_submission_result_by_chunks(path_input_file: str, path_output_file: str,
+                                        fitted_vocabulary: FittedVocabulary,
+                                        rf: RandomForestRegressor or MemoryMappedForest, chunk_size: int = 10000,
+                                        nb_processes: int = 1) -> None:
+    # the model must already be trained & the peak memory is bounded by chunk_size * (2 * nb_processes)
+    # (the processes share the trees of a MemoryMappedForest, whereas each process copies a RandomForestRegressor)
+    chunks = pd.read_csv(path_input_file, chunksize=chunk_size)
+    with open(path_output_file, 'w', newline='') as output_file:
+        if nb_processes <= 1:
+            _init_chunk_worker(fitted_vocabulary, rf)
+            results = (_predict_chunk(chunk_df) for chunk_df in chunks)
+            for position, (result, _) in enumerate(results):
+                # the record is already part of the trace
+                _export_chunk_result(result, None, output_file, position)
+            return
+
+        with ProcessPoolExecutor(max_workers=nb_processes, initializer=_init_chunk_worker,
+                                 initargs=(fitted_vocabulary, rf)) as executor:
+            # only a few chunks are read in advance, the results are exported in the order of the input
+            pending_futures = deque()
+            position = 0
+            for chunk_df in chunks:
+                pending_futures.append(executor.submit(_predict_chunk, chunk_df))
+                if len(pending_futures) >= 2 * nb_processes:
+                    _export_chunk_result(*pending_futures.popleft().result(), output_file, position)
+                    position += 1
+            while pending_futures:
+                _export_chunk_result(*pending_futures.popleft().result(), output_file, position)
+                position += 1
+
+
+def _export_chunk_result(result: pd.DataFrame, record: dict, output_file, position: int) -> None:
+    if record is not None:
+        # the records of the other processes are not part of the trace yet
+        instrumentation.add_records([record])
+    logger.debug(f'chunk {position} has been predicted ({result.shape[0]} rows)')
+    result.to_csv(output_file, header=position == 0, index=False)
@@ -1,131 +1,357 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+from src.core import parsed_column, sparse_encoding
+from src.core.inverted_index import CharactersAggregates
 from src.core.one_hot_encoding import OneHotEncodingColumn
+from src.core.vocabulary import FittedVocabulary, VOCABULARY_FORMAT_VERSION
+from src.utils import constants, instrumentation
 from src.utils.logger import logger
 
 
 class PipelineTransforming:
-    def __init__(self, original_training_df: pd.DataFrame, original_testing_df: pd.DataFrame):
+    # one hot encoding columns whose representation is a dict
+    columns_encoded_as_dict = {'belongs_to_collection': ['id', 'collection'],
+                               'genres': ['id', 'genre'],
+                               'production_countries': ['iso_3166_1', 'prod_count'],
+                               'spoken_languages': ['iso_639_1', 'spoken_lang']}
+    # special one hot encoding columns for multitude of names inside the column
+    columns_encoded_with_most_popular = {'production_companies': ['id', 'prod_comp', True, 15],
+                                         'Keywords': ['id', 'k', False, 25]}
+    # hashing trick instead of the special one hot encoding (fixed number of columns & no vocabulary to fit)
+    # e.g. {'Keywords': [2 ** 10, True], 'production_companies': [2 ** 9, True], 'crew': [2 ** 10, True]}
+    columns_encoded_with_hashing = dict()
+    # dense target statistics instead of the one hot encoding (smoothing of the statistics of each column), learnt
+    # out-of-fold on the training df, e.g. {'genres': 10, 'Keywords': 10, 'production_companies': 10, 'crew': 10,
+    # 'belongs_to_collection': 10, 'original_language': 10}
+    columns_encoded_with_target_statistics = dict()
+    nb_folds_target_statistics = 5
+    # aggregate features of the characters of the crew having these jobs, learnt from the training & testing movies
+    # e.g. {'Director': 'director'} (director_nb_movies & director_mean_budget)
+    crew_aggregates_jobs = dict()
+    # dense date information
+    date_columns = ['year', 'quarter', 'weekofyear', 'is_summer_season', 'is_holiday_season', 'age']
+    # categories of the one hot encoded date information (consecutive integers, dayofweek: 0 is monday)
+    date_categories_dict = {'month': list(range(1, 13)),
+                            'dayofweek': list(range(7))}
+
+    def __init__(self, original_training_df: pd.DataFrame, original_testing_df: pd.DataFrame,
+                 fitted_vocabulary: FittedVocabulary = None, nb_workers: int = 1, executor_type: str = 'process'):
         self.original_training_df = original_training_df
         self.original_testing_df = original_testing_df
+        self.fitted_vocabulary = fitted_vocabulary
+        # the columns are encoded in parallel by a pool of processes ('process') or threads ('thread')
+        self.nb_workers = nb_workers
+        self.executor_type = executor_type
+
+    @classmethod
+    def from_vocabulary_file(cls, path_file: str) -> 'PipelineTransforming':
+        # only able to transform new data, with the vocabulary fitted during a previous run
+        return cls(None, None, FittedVocabulary.load(path_file))
+
+    @classmethod
+    def get_configuration(cls) -> dict:
+        # everything which changes the result of the transformation
+        return {'vocabulary_format_version': VOCABULARY_FORMAT_VERSION,
+                'columns_encoded_as_dict': cls.columns_encoded_as_dict,
+                'columns_encoded_with_most_popular': cls.columns_encoded_with_most_popular,
+                'columns_encoded_with_hashing': cls.columns_encoded_with_hashing,
+                'columns_encoded_with_target_statistics': cls.columns_encoded_with_target_statistics,
+                'nb_folds_target_statistics': cls.nb_folds_target_statistics,
+                'crew_aggregates_jobs': cls.crew_aggregates_jobs,
+                'date_columns': cls.date_columns,
+                'date_categories_dict': cls.date_categories_dict,
+                'release_date_format': constants.release_date_format,
+                'useless_info_inside_title': constants.useless_info_inside_title}
 
+    @instrumentation.instrumented('PipelineTransforming.clean_dfs')
+    @parsed_column.cache_scope()
     def clean_dfs(self) -> [pd.DataFrame]:
-        training_df = self.original_training_df
-        testing_df = self.original_testing_df
+        # each column is fitted & transformed (for both datasets) by the same worker
+        encoders_dict, training_blocks, testing_blocks = dict(), list(), list()
+        unfitted_encoders_dict = self.__get_unfitted_encoders()
+        results = self.__map(_fit_and_transform_column, unfitted_encoders_dict, unfitted_encoders_dict.values(),
+                             [self.original_training_df[col] for col in unfitted_encoders_dict],
+                             [self.original_testing_df[col] for col in unfitted_encoders_dict])
+        for col, (encoding_procedure_col, training_block, testing_block) in zip(unfitted_encoders_dict, results):
+            encoders_dict[col] = encoding_procedure_col
+            training_blocks.append(training_block)
+            testing_blocks.append(testing_block)
+        self.fitted_vocabulary = self.__build_fitted_vocabulary(encoders_dict)
+
+        training_df = self.__assemble(self.original_training_df, training_blocks)
+        testing_df = self.__assemble(self.original_testing_df, testing_blocks)
+        return training_df, testing_df
+
+    @instrumentation.instrumented('PipelineTransforming.fit')
+    @parsed_column.cache_scope()
+    def fit(self) -> FittedVocabulary:
+        unfitted_encoders_dict = self.__get_unfitted_encoders()
+        results = self.__map(_fit_column, unfitted_encoders_dict, unfitted_encoders_dict.values(),
+                             [self.original_training_df[col] for col in unfitted_encoders_dict],
+                             [self.original_testing_df[col] for col in unfitted_encoders_dict])
+        encoders_dict = dict()
+        for col, (encoding_procedure_col, out_of_fold_block) in zip(unfitted_encoders_dict, results):
+            # the encoders coming back from the processes are pickled without their out-of-fold encoding, which is
+            # kept by this process for the transform of the training df of the fit
+            encoding_procedure_col.original_training_series = self.original_training_df[col]
+            encoding_procedure_col.out_of_fold_block = out_of_fold_block
+            encoders_dict[col] = encoding_procedure_col
+        self.fitted_vocabulary = self.__build_fitted_vocabulary(encoders_dict)
+        return self.fitted_vocabulary
+
+    @instrumentation.instrumented('PipelineTransforming.transform')
+    @parsed_column.cache_scope()
+    def transform(self, main_df: pd.DataFrame, is_fitted_training_df: bool = False) -> pd.DataFrame:
+        # the training df of the fit gets the out-of-fold target statistics
+        encoders_dict = self.fitted_vocabulary.encoders_dict
+        for col, encoding_procedure_col in encoders_dict.items():
+            logger.debug(f'{col} will be one hot encoded ({encoding_procedure_col.encoding_type})')
+        # the out-of-fold encodings are only kept by the encoders of this process (not by their pickled copies)
+        in_process_cols = [col for col, encoding_procedure_col in encoders_dict.items()
+                           if is_fitted_training_df and encoding_procedure_col.encoding_type == 'with_target_statistics']
+        mapped_encoders_dict = {col: encoding_procedure_col for col, encoding_procedure_col in encoders_dict.items()
+                                if col not in in_process_cols}
+        blocks_dict = dict(zip(mapped_encoders_dict,
+                               self.__map(_transform_column, mapped_encoders_dict, mapped_encoders_dict.values(),
+                                          [main_df[col] for col in mapped_encoders_dict],
+                                          [is_fitted_training_df] * len(mapped_encoders_dict))))
+        blocks_dict.update({col: encoders_dict[col].transform_training_series(main_df[col])
+                            for col in in_process_cols})
+        return self.__assemble(main_df, [blocks_dict[col] for col in encoders_dict])
+
+    def __get_unfitted_encoders(self) -> {str: (OneHotEncodingColumn, str, list)}:
+        # encoder of each column, with the name & the arguments of its fit method
+        unfitted_encoders_dict = dict()
 
         # one hot encoding columns whose representation is a dict
-        columns_one_hot_encoding_dict = {'belongs_to_collection': ['id', 'collection'],
-                                         'genres': ['id', 'genre'],
-                                         'production_countries': ['iso_3166_1', 'prod_count'],
-                                         'spoken_languages': ['iso_639_1', 'spoken_lang']}
-        for col, list_specific_col in columns_one_hot_encoding_dict.items():
+        for col, list_specific_col in self.columns_encoded_as_dict.items():
+            if col in self.columns_encoded_with_target_statistics:
+                unfitted_encoders_dict[col] = self.__get_unfitted_target_encoder(col, list_specific_col[0],
+                                                                                 list_specific_col[1])
+                continue
             logger.debug(f'{col} will be one hot encoded as dict')
-            training_df, testing_df = self.__one_hot_encode_representing_as_dict(training_df, testing_df, col,
-                                                                                 list_specific_col)
+            unfitted_encoders_dict[col] = (OneHotEncodingColumn(None, None, *list_specific_col),
+                                           'fit_series_representing_as_dict', [])
 
         # special one hot encoding columns for multitude of names inside the column
-        columns_one_hot_encoding_dict = {'production_companies': ['id', 'prod_comp', True, 15],
-                                         'Keywords': ['id', 'k', False, 25]}
-        for col, list_specific_col in columns_one_hot_encoding_dict.items():
+        for col, list_specific_col in self.columns_encoded_with_most_popular.items():
+            id_name, prefix_name_columns, need_to_simplify_names, threshold_popularity = list_specific_col
+            if col in self.columns_encoded_with_target_statistics:
+                unfitted_encoders_dict[col] = self.__get_unfitted_target_encoder(col, id_name, prefix_name_columns)
+                continue
+            if col in self.columns_encoded_with_hashing:
+                logger.debug(f'{col} will be hashed')
+                nb_buckets, signed_hashing = self.columns_encoded_with_hashing[col]
+                unfitted_encoders_dict[col] = (OneHotEncodingColumn(None, None, id_name, prefix_name_columns),
+                                               'fit_series_with_hashing',
+                                               [nb_buckets, signed_hashing, need_to_simplify_names])
+                continue
             logger.debug(f'{col} will be one hot encoded')
-            training_df, testing_df = self.__one_hot_encode_famous_names(training_df, testing_df, col, list_specific_col)
+            unfitted_encoders_dict[col] = (OneHotEncodingColumn(None, None, id_name, prefix_name_columns,
+                                                                threshold_popularity),
+                                           'fit_series_with_most_popular', [need_to_simplify_names])
 
         # one hot encoding columns for information about characters of the movies
-        logger.debug(f'crew will be one hot encoded as item')
-        training_df, testing_df = self.__one_hot_encode_characters(training_df, testing_df, 'crew')
+        if 'crew' in self.columns_encoded_with_target_statistics:
+            unfitted_encoders_dict['crew'] = self.__get_unfitted_target_encoder('crew', 'id', 'crew')
+        elif 'crew' in self.columns_encoded_with_hashing:
+            logger.debug(f'crew will be hashed')
+            nb_buckets, signed_hashing = self.columns_encoded_with_hashing['crew']
+            unfitted_encoders_dict['crew'] = (OneHotEncodingColumn(None, None, None, 'crew'),
+                                              'fit_series_with_hashing', [nb_buckets, signed_hashing, False, True])
+        else:
+            logger.debug(f'crew will be one hot encoded as item')
+            unfitted_encoders_dict['crew'] = (OneHotEncodingColumn(None, None, None, None),
+                                              'fit_series_with_characters_description', [])
 
         # one hot encoding columns whose one row contains only one value
-        logger.debug(f'original_language will be one hot encoded as item')
-        training_df, testing_df = self.__one_hot_encode_representing_as_item(training_df, testing_df,
-                                                                             'original_language')
+        if 'original_language' in self.columns_encoded_with_target_statistics:
+            unfitted_encoders_dict['original_language'] = self.__get_unfitted_target_encoder(
+                'original_language', None, 'original_language')
+        else:
+            logger.debug(f'original_language will be one hot encoded as item')
+            unfitted_encoders_dict['original_language'] = (OneHotEncodingColumn(None, None, None, ''),
+                                                           'fit_series_representing_as_item', [[]])
+        return unfitted_encoders_dict
+
+    def __get_unfitted_target_encoder(self, col: str, id_name_col: str or None,
+                                      prefix_name_columns: str) -> (OneHotEncodingColumn, str, list):
+        logger.debug(f'{col} will be encoded with target statistics')
+        return (OneHotEncodingColumn(None, None, id_name_col, prefix_name_columns),
+                'fit_series_with_target_statistics',
+                [self.original_training_df[constants.label_column].to_numpy(),
+                 self.columns_encoded_with_target_statistics[col], self.nb_folds_target_statistics])
+
+    def __build_fitted_vocabulary(self, encoders_dict: {str: OneHotEncodingColumn}) -> FittedVocabulary:
+        # layout of the columns which are not encoded & of the date information
+        passthrough_columns = [col for col in self.original_training_df.columns
+                               if col not in encoders_dict and col not in ['release_date', constants.label_column]]
+        date_encoders_dict = dict()
+        for col, categories in self.date_categories_dict.items():
+            date_encoders_dict[col] = OneHotEncodingColumn(None, None, None, col)
+            date_encoders_dict[col].fit_series_representing_as_item(categories)
+        aggregates_dict = dict()
+        for name_job, prefix_name_columns in self.crew_aggregates_jobs.items():
+            logger.debug(f'aggregates of the {name_job} will be learnt')
+            aggregates_dict[name_job] = CharactersAggregates(name_job, prefix_name_columns)
+            aggregates_dict[name_job].fit([self.original_training_df['crew'], self.original_testing_df['crew']],
+                                          [self.original_training_df[aggregates_dict[name_job].value_col],
+                                           self.original_testing_df[aggregates_dict[name_job].value_col]])
+        return FittedVocabulary(encoders_dict, passthrough_columns, list(self.date_columns), date_encoders_dict,
+                                aggregates_dict, get_reference_date(self.original_training_df['release_date']))
+
+    def __map(self, function, *iterables) -> list:
+        # the workers return their result & the record of their stage
+        if self.nb_workers <= 1:
+            outputs = list(map(function, *iterables))
+        else:
+            executor_class = ProcessPoolExecutor if self.executor_type == 'process' else ThreadPoolExecutor
+            with executor_class(max_workers=self.nb_workers) as executor:
+                outputs = list(executor.map(function, *iterables))
+            if self.executor_type == 'process':
+                # the records of the other processes are not part of the trace yet
+                instrumentation.add_records([record for _, record in outputs])
+        return [result for result, _ in outputs]
 
-        # extract date information
+    def __assemble(self, main_df: pd.DataFrame, blocks: [sparse_encoding.FeatureBlock]) -> pd.DataFrame:
+        # dense columns: columns which are not encoded (and the label, if any) & date information, in the order of
+        # the vocabulary whatever the order of main_df (KeyError if a column is missing)
+        dense_df = main_df[self.fitted_vocabulary.passthrough_columns +
+                           ([constants.label_column] if constants.label_column in main_df.columns else [])]
         logger.debug(f'extract date information will be')
-        training_df, testing_df = self.__extract_date_information(training_df, 'training'), self.__extract_date_information(testing_df, 'testing')
-
-        return training_df.fillna(0), testing_df.fillna(0)
-
-    @staticmethod
-    def __one_hot_encode_representing_as_item(training_df: pd.DataFrame, testing_df: pd.DataFrame,
-                                              col: str) -> [pd.DataFrame]:
-        # initialise variables
-        encoding_procedure_col = OneHotEncodingColumn(training_df[col], testing_df[col], None, '')
-
-        # encode training_df
-        training_df = pd.concat(
-            [training_df, encoding_procedure_col.encode_series_representing_as_item('training', [])], axis=1)
-        testing_df = pd.concat([testing_df, encoding_procedure_col.encode_series_representing_as_item('testing', [])],
-                               axis=1)
-        return training_df.drop([col], axis=1), testing_df.drop([col], axis=1)
-
-    @staticmethod
-    def __one_hot_encode_representing_as_dict(training_df: pd.DataFrame, testing_df: pd.DataFrame, col: str,
-                                              list_ids_for_col: list) -> [pd.DataFrame]:
-        # initialise variables
-        id_name = list_ids_for_col[0]
-        prefix_name_columns = list_ids_for_col[1]
-        encoding_procedure_col = OneHotEncodingColumn(training_df[col], testing_df[col], id_name, prefix_name_columns)
-
-        # encode training_df
-        training_df = pd.concat([training_df, encoding_procedure_col.encode_series_representing_as_dict('training')],
-                                axis=1)
-        testing_df = pd.concat([testing_df, encoding_procedure_col.encode_series_representing_as_dict('testing')],
-                               axis=1)
-        return training_df.drop([col], axis=1), testing_df.drop([col], axis=1)
-
-    @staticmethod
-    def __one_hot_encode_characters(training_df: pd.DataFrame, testing_df: pd.DataFrame, col: str) -> [pd.DataFrame]:
-        # initialise variables
-        encoding_procedure_col = OneHotEncodingColumn(training_df[col], testing_df[col], None, None)
-
-        # encode training_df
-        training_df = pd.concat([training_df, encoding_procedure_col.encode_series_with_characters_description('training')],
-                                axis=1)
-        testing_df = pd.concat([testing_df, encoding_procedure_col.encode_series_with_characters_description('testing')],
-                               axis=1)
-        return training_df.drop([col], axis=1), testing_df.drop([col], axis=1)
-
-    @staticmethod
-    def __one_hot_encode_famous_names(training_df: pd.DataFrame, testing_df: pd.DataFrame, col: str,
-                                      list_ids_for_col: list) -> [pd.DataFrame]:
-        # initialise variables
-        id_name = list_ids_for_col[0]
-        prefix_name_columns = list_ids_for_col[1]
-        need_to_simplify_names = list_ids_for_col[2]
-        threshold_popularity = list_ids_for_col[3]
-        encoding_procedure_col = OneHotEncodingColumn(training_df[col], testing_df[col], id_name, prefix_name_columns,
-                                                      threshold_popularity)
-
-        # encode training_df
-        training_df = pd.concat([training_df, encoding_procedure_col.encode_series_with_most_popular('training',
-                                                                                                     need_to_simplify_names)], axis=1)
-        testing_df = pd.concat(
-            [testing_df, encoding_procedure_col.encode_series_with_most_popular('testing', need_to_simplify_names)],
-            axis=1)
-        return training_df.drop([col], axis=1), testing_df.drop([col], axis=1)
-
-    @staticmethod
-    def __extract_date_information(main_df: pd.DataFrame, type_dataset: str) -> pd.DataFrame:
-        # convert date to datetime
-        main_df['release_date'] = pd.to_datetime(main_df['release_date'])
-        # add columns year and month
-        main_df['year'] = main_df['release_date'].map(lambda date: date.year)
-        main_df['month'] = main_df['release_date'].map(lambda date: date.month)
-        main_df['dayofweek'] = main_df['release_date'].map(lambda date: date.dayofweek)
+        with instrumentation.stage('extract date information', main_df['release_date']) as record:
+            date_df, date_blocks = self.__extract_date_information(main_df['release_date'])
+            record['output_shapes'] = instrumentation.get_shapes(date_df, date_blocks)
+        dense_df = pd.concat([dense_df, date_df], axis=1).fillna(0)
+        aggregates_blocks = list()
+        if self.fitted_vocabulary.aggregates_dict:
+            with instrumentation.stage('aggregate crew', main_df['crew']) as record:
+                aggregates_blocks = [characters_aggregates.transform_series(main_df['crew'])
+                                     for characters_aggregates in self.fitted_vocabulary.aggregates_dict.values()]
+                record['output_shapes'] = instrumentation.get_shapes(aggregates_blocks)
+
+        # sparse columns: the blocks are materialized only once
+        with instrumentation.stage('assemble blocks', dense_df, blocks, date_blocks, aggregates_blocks) as record:
+            df = sparse_encoding.assemble_blocks(dense_df, blocks + date_blocks + aggregates_blocks)
+            record['output_shapes'] = instrumentation.get_shapes(df)
+        return df
+
+    def __extract_date_information(self, release_date_series: pd.Series) -> (pd.DataFrame,
+                                                                           [sparse_encoding.FeatureBlock]):
+        dense_date_information_dict, date_information_dict = get_date_information(
+            release_date_series, self.fitted_vocabulary.reference_date)
+        date_df = pd.DataFrame({col: dense_date_information_dict[col] for col in self.fitted_vocabulary.date_columns})
 
         # one-hot-encoding of month and dayofweek
-        for col, list_unique_values in [('month', [str(i) for i in range(1, 13)]),
-                                        ('dayofweek', [str(i) for i in range(1, 7)])]:
-            # determine type of each df
-            training_series = main_df[col] if type_dataset == 'training' else None
-            testing_series = main_df[col] if type_dataset == 'testing' else None
-
-            # encode df
-            encoding_procedure_col = OneHotEncodingColumn(training_series, testing_series, None, '')
-            main_df = pd.concat([main_df,
-                                 encoding_procedure_col.encode_series_representing_as_item(type_dataset,
-                                                                                           list_unique_values)], axis=1)
-            main_df = main_df.drop([col], axis=1)
-
-        # delete useless columns
-        return main_df.drop(['release_date'], axis=1)
+        date_blocks = [_encode_date_information(date_information_dict[col], encoding_procedure_col)
+                       for col, encoding_procedure_col in self.fitted_vocabulary.date_encoders_dict.items()]
+        return date_df, date_blocks
+
+
+def parse_release_dates(release_date_series: pd.Series) -> pd.Series:
+    # all the dates at once with the format of the csv files: the years have only 2 digits, the dates after the
+    # current date belong to the previous century (e.g. 4/28/27 is 1927, 3/15/21 is 2021)
+    release_dates = pd.to_datetime(release_date_series, format=constants.release_date_format, errors='coerce')
+    current_date = pd.Timestamp.now().normalize()
+    release_dates = release_dates.mask(release_dates > current_date, release_dates - pd.DateOffset(years=100))
+
+    # other formats, whose year has 4 digits (e.g. 2015-02-20, sent by a client of the prediction server)
+    mask_other_formats = (release_dates.isna() & release_date_series.notna()).to_numpy()
+    if mask_other_formats.any():
+        release_dates[mask_other_formats] = [_parse_release_date(date)
+                                             for date in release_date_series[mask_other_formats]]
+        mask_invalid_dates = (release_dates.isna() & release_date_series.notna()).to_numpy()
+        if mask_invalid_dates.any():
+            logger.warning(f'{mask_invalid_dates.sum()} invalid release dates (e.g. '
+                           f'{release_date_series[mask_invalid_dates].iloc[0]!r}), their date information is 0')
+    return release_dates
+
+
+def _parse_release_date(date) -> pd.Timestamp:
+    # format inferred from the date itself (NaT if it is not a date)
+    if not isinstance(date, str):
+        return pd.NaT
+    date = pd.to_datetime(date, errors='coerce')
+    return date.tz_convert(None) if date is not pd.NaT and date.tzinfo is not None else date
+
+
+def get_reference_date(training_release_date_series: pd.Series) -> pd.Timestamp:
+    # the age of the movies is computed at the latest release date of the training df (the same date for the
+    # training & for the new movies, whatever the day of the transformation), or at the current date without dates
+    reference_date = parse_release_dates(training_release_date_series).max()
+    return reference_date if not pd.isna(reference_date) else pd.Timestamp.now().normalize()
+
+
+def get_date_information(release_date_series: pd.Series,
+                         reference_date: pd.Timestamp = None) -> ({str: pd.Series}, {str: pd.Series}):
+    # dense date information & date information to one hot encode (NaN for the missing & invalid dates)
+    if not pd.api.types.is_datetime64_any_dtype(release_date_series):
+        release_date_series = parse_release_dates(release_date_series)
+    # the age is computed at the reference date of the vocabulary (by default, the current date)
+    reference_date = reference_date if reference_date is not None else pd.Timestamp.now().normalize()
+    month_series = release_date_series.dt.month
+    dense_date_information_dict = {
+        'year': release_date_series.dt.year,
+        'quarter': release_date_series.dt.quarter,
+        # week of the year, starting on the 1st of january (same definition for all the years)
+        'weekofyear': (release_date_series.dt.dayofyear - 1) // 7 + 1,
+        # summer blockbusters & end-of-year holidays
+        'is_summer_season': month_series.isin([5, 6, 7]).astype(int),
+        'is_holiday_season': month_series.isin([11, 12]).astype(int),
+        # age (in years) at the reference date (negative for the movies released after it)
+        'age': (reference_date - release_date_series).dt.days / 365.25}
+    date_information_dict = {'month': month_series,
+                             'dayofweek': release_date_series.dt.dayofweek}
+    return dense_date_information_dict, date_information_dict
+
+
+def _encode_date_information(series: pd.Series,
+                             encoding_procedure_col: OneHotEncodingColumn) -> sparse_encoding.FeatureBlock:
+    # the categories are consecutive integers: the column of each row is its value minus the first category
+    # (no column for the missing values)
+    values = series.astype(float).to_numpy()
+    column_positions = np.where(np.isnan(values), -1, values - encoding_procedure_col.keys[0]).astype(np.int64)
+    matrix = sparse_encoding.encode_positions(np.arange(values.size), column_positions, values.size,
+                                              len(encoding_procedure_col.keys))
+    return sparse_encoding.FeatureBlock(matrix, encoding_procedure_col.get_columns_names())
+
+
+# functions executed by the workers (defined at the module level, so that they can be pickled) #
+# each one returns its result & the record of its stage (& has its own scope of parsed columns inside a process)
+
+@parsed_column.cache_scope()
+def _fit_column(col: str, unfitted_encoder: (OneHotEncodingColumn, str, list), training_series: pd.Series,
+                testing_series: pd.Series) -> ((OneHotEncodingColumn, sparse_encoding.FeatureBlock or None), dict):
+    with instrumentation.stage(f'fit {col}', training_series, testing_series) as record:
+        encoding_procedure_col, name_fit_method, fit_arguments = unfitted_encoder
+        encoding_procedure_col.original_training_series = training_series
+        encoding_procedure_col.original_testing_series = testing_series
+        getattr(encoding_procedure_col, name_fit_method)(*fit_arguments)
+        record['output_shapes'] = [[len(encoding_procedure_col.get_columns_names())]]
+    # the out-of-fold encoding (if any) is returned beside the encoder, which is pickled without it
+    return (encoding_procedure_col, encoding_procedure_col.out_of_fold_block), record
+
+
+@parsed_column.cache_scope()
+def _transform_column(col: str, encoding_procedure_col: OneHotEncodingColumn, series: pd.Series,
+                      is_fitted_training_series: bool = False) -> (sparse_encoding.FeatureBlock, dict):
+    with instrumentation.stage(f'transform {col}', series) as record:
+        block = (encoding_procedure_col.transform_training_series(series) if is_fitted_training_series else
+                 encoding_procedure_col.transform_series(series))
+        record['output_shapes'] = instrumentation.get_shapes(block)
+    return block, record
+
+
+@parsed_column.cache_scope()
+def _fit_and_transform_column(col: str, unfitted_encoder: (OneHotEncodingColumn, str, list),
+                              training_series: pd.Series, testing_series: pd.Series) -> (
+        (OneHotEncodingColumn, sparse_encoding.FeatureBlock, sparse_encoding.FeatureBlock), dict):
+    with instrumentation.stage(f'fit & transform {col}', training_series, testing_series) as record:
+        (encoding_procedure_col, _), _ = _fit_column(col, unfitted_encoder, training_series, testing_series)
+        training_block = encoding_procedure_col.transform_training_series(training_series)
+        testing_block = encoding_procedure_col.transform_series(testing_series)
+        record['output_shapes'] = instrumentation.get_shapes(training_block, testing_block)
+    return (encoding_procedure_col, training_block, testing_block), record
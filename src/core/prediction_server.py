@@ -0,0 +1,202 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+
+import numpy as np
+from scipy import sparse
+
+from src.core.model_registry import check_feature_columns, MemoryMappedForest, ModelRegistry
+from src.core.row_encoder import RowEncoder
+from src.core.vocabulary import FittedVocabulary
+from src.utils import constants
+from src.utils.logger import logger
+
+if TYPE_CHECKING:
+    # the server only predicts with the memory-mapped trees, it does not need to import sklearn
+    from sklearn.ensemble import RandomForestRegressor
+
+
+class MicroBatcher:
+    # the records of the concurrent requests are predicted together, by a single call of predict
+    def __init__(self, row_encoder: RowEncoder, rf: 'RandomForestRegressor' or MemoryMappedForest,
+                 max_batch_size: int = 256, max_waiting_time: float = 0.002):
+        self.row_encoder = row_encoder
+        self.rf = rf
+        self.max_batch_size = max_batch_size
+        # time (in seconds) waited for other requests, once a first request has arrived
+        self.max_waiting_time = max_waiting_time
+        self.requests_queue = queue.Queue()
+        self.batch_sizes = deque(maxlen=10000)
+        threading.Thread(target=self.__run, name='micro_batcher', daemon=True).start()
+
+    def predict(self, records: [dict]) -> [float]:
+        request = {'records': records, 'predictions': None, 'error': None, 'event': threading.Event()}
+        self.requests_queue.put(request)
+        request['event'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['predictions']
+
+    def __run(self) -> None:
+        while True:
+            requests = self.__get_requests()
+            # a request with an invalid record does not prevent the others from being predicted
+            valid_requests, matrices = list(), list()
+            for request in requests:
+                try:
+                    matrices.append(self.row_encoder.encode_records(request['records']))
+                    valid_requests.append(request)
+                except Exception as error:
+                    request['error'] = ValueError(f'invalid record: {error}')
+            try:
+                if valid_requests:
+                    predictions = self.rf.predict(sparse.vstack(matrices, format='csr')).tolist()
+                    self.batch_sizes.append(len(predictions))
+                    position = 0
+                    for request in valid_requests:
+                        request['predictions'] = predictions[position:position + len(request['records'])]
+                        position += len(request['records'])
+            except Exception as error:
+                logger.exception('prediction failed')
+                for request in valid_requests:
+                    request['error'] = error
+            for request in requests:
+                request['event'].set()
+
+    def __get_requests(self) -> [dict]:
+        # wait for a first request, then gather the following ones until the batch is full or the time is over
+        requests = [self.requests_queue.get()]
+        nb_records = len(requests[0]['records'])
+        deadline = time.perf_counter() + self.max_waiting_time
+        while nb_records < self.max_batch_size:
+            remaining_time = deadline - time.perf_counter()
+            if remaining_time <= 0:
+                break
+            try:
+                requests.append(self.requests_queue.get(timeout=remaining_time))
+            except queue.Empty:
+                break
+            nb_records += len(requests[-1]['records'])
+        return requests
+
+
+class LatencyRecorder:
+    # latencies of the last requests, to compute the percentiles
+    def __init__(self, max_nb_latencies: int = 10000):
+        self.latencies = deque(maxlen=max_nb_latencies)
+        self.nb_requests = 0
+        self.lock = threading.Lock()
+
+    def add(self, latency: float) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+            self.nb_requests += 1
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            latencies = np.array(self.latencies)
+            nb_requests = self.nb_requests
+        if latencies.size == 0:
+            return {'nb_requests': nb_requests}
+        return {'nb_requests': nb_requests,
+                'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+                'p99_ms': float(np.percentile(latencies, 99)) * 1000,
+                'max_ms': float(latencies.max()) * 1000}
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    # POST /predict with one record or a list of records, GET /metrics, GET /health
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.__send_json(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            metrics = self.server.latency_recorder.get_metrics()
+            batch_sizes = list(self.server.micro_batcher.batch_sizes)
+            metrics['mean_batch_size'] = float(np.mean(batch_sizes)) if batch_sizes else 0
+            self.__send_json(200, metrics)
+        else:
+            self.__send_json(404, {'error': f'unknown path {self.path}'})
+
+    def do_POST(self):
+        start_time = time.perf_counter()
+        if self.path != '/predict':
+            self.__send_json(404, {'error': f'unknown path {self.path}'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            records = body if isinstance(body, list) else [body]
+            if not all(isinstance(record, dict) for record in records):
+                raise ValueError('the records must be json objects')
+            predictions = self.server.micro_batcher.predict(records) if records else list()
+        except ValueError as error:
+            self.__send_json(400, {'error': str(error)})
+            return
+        except Exception as error:
+            # e.g. the prediction failed: the client always gets a response
+            logger.exception('request failed')
+            self.__send_json(500, {'error': f'{type(error).__name__}: {error}'})
+            return
+        latency = time.perf_counter() - start_time
+        self.server.latency_recorder.add(latency)
+        self.__send_json(200, {'predictions': predictions, 'latency_ms': latency * 1000})
+
+    def __send_json(self, status: int, content: dict) -> None:
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} - {format % args}')
+
+
+def create_server(host: str, port: int, fitted_vocabulary: FittedVocabulary,
+                  rf: 'RandomForestRegressor' or MemoryMappedForest, max_batch_size: int = 256,
+                  max_waiting_time: float = 0.002) -> ThreadingHTTPServer:
+    row_encoder = RowEncoder(fitted_vocabulary)
+    if rf.n_features_in_ != row_encoder.nb_features:
+        raise ValueError(f'the model expects {rf.n_features_in_} features, the vocabulary produces '
+                         f'{row_encoder.nb_features} features')
+    # the models of the registry know their layout, which must be the one of the vocabulary
+    feature_columns = getattr(rf, 'feature_columns', None)
+    if feature_columns is not None:
+        check_feature_columns(fitted_vocabulary.feature_columns, feature_columns)
+    server = ThreadingHTTPServer((host, port), PredictionRequestHandler)
+    server.micro_batcher = MicroBatcher(row_encoder, rf, max_batch_size, max_waiting_time)
+    server.latency_recorder = LatencyRecorder()
+    return server
+
+
+def main(arguments: [str] = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description='Server predicting the revenue of movies')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--model-registry', default=constants.path_model_registry_directory)
+    parser.add_argument('--model-key', default=None, help='key of the model (default: the latest saved model)')
+    parser.add_argument('--vocabulary', default=constants.path_vocabulary_file)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-waiting-time-ms', type=float, default=2)
+    args = parser.parse_args(arguments)
+
+    # everything is loaded once, before the first request (the memory-mapped trees are shared by the servers)
+    model_registry = ModelRegistry(args.model_registry)
+    model = model_registry.load(args.model_key or model_registry.get_latest_key())
+    server = create_server(args.host, args.port, FittedVocabulary.load(args.vocabulary), model,
+                           args.max_batch_size, args.max_waiting_time_ms / 1000)
+    logger.info(f'Prediction server listening on {args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import math
+import numbers
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.core import sparse_encoding, tools
+from src.core.one_hot_encoding import OneHotEncodingColumn
+from src.core.parsed_column import parse_cell
+from src.core.pipeline_transforming import get_date_information, parse_release_dates
+from src.core.vocabulary import FittedVocabulary
+from src.utils import constants
+
+
+class RowEncoder:
+    # encode a few records (dicts with the columns of the csv files) directly into the rows of the features matrix,
+    # with the same layout as PipelineTransforming.transform (without building any df)
+    def __init__(self, fitted_vocabulary: FittedVocabulary):
+        self.fitted_vocabulary = fitted_vocabulary
+        self.nb_features = len(fitted_vocabulary.feature_columns)
+        # position of the first column of each encoder
+        self.first_positions_dict = dict()
+        position = len(fitted_vocabulary.passthrough_columns) + len(fitted_vocabulary.date_columns)
+        for col, encoding_procedure_col in (list(fitted_vocabulary.encoders_dict.items()) +
+                                            list(fitted_vocabulary.date_encoders_dict.items())):
+            self.first_positions_dict[col] = position
+            position += len(encoding_procedure_col.get_columns_names())
+        # position of the first column of each aggregates & position of each character
+        for name_job, characters_aggregates in fitted_vocabulary.aggregates_dict.items():
+            self.first_positions_dict[name_job] = position
+            position += len(characters_aggregates.get_columns_names())
+        self.characters_positions_dict = {name_job: {id: i for i, id in enumerate(characters_aggregates.ids)}
+                                          for name_job, characters_aggregates in
+                                          fitted_vocabulary.aggregates_dict.items()}
+        # position of the column of each value
+        self.positions_dict = {col: self.__get_positions(encoding_procedure_col, self.first_positions_dict[col])
+                               for col, encoding_procedure_col in (list(fitted_vocabulary.encoders_dict.items()) +
+                                                                   list(fitted_vocabulary.date_encoders_dict.items()))}
+        # the simplified names are cached by tools (bounded memory for a long-running process)
+        self.simplify_name = tools.get_name_simplifier(tuple(constants.useless_info_inside_title))
+
+    @staticmethod
+    def __get_positions(encoding_procedure_col: OneHotEncodingColumn, first_position: int) -> dict:
+        # same order of the columns as OneHotEncodingColumn.get_columns_names
+        if encoding_procedure_col.encoding_type == 'with_most_popular':
+            return {key: first_position + 1 + i for i, key in enumerate(encoding_procedure_col.keys)}
+        if encoding_procedure_col.encoding_type == 'with_characters_description':
+            positions_dict = dict()
+            position = first_position + len(encoding_procedure_col.names_jobs_dict)
+            for name_job in encoding_procedure_col.names_jobs_dict:
+                positions_dict[name_job] = {key: position + i for i, key in
+                                            enumerate(encoding_procedure_col.candidates_jobs_dict[name_job])}
+                position += len(encoding_procedure_col.candidates_jobs_dict[name_job])
+            return positions_dict
+        if encoding_procedure_col.encoding_type == 'with_hashing':
+            return dict()
+        if encoding_procedure_col.encoding_type == 'with_target_statistics':
+            # position of each key inside the fitted statistics
+            return {key: i for i, key in enumerate(encoding_procedure_col.keys)}
+        return {key: first_position + i for i, key in enumerate(encoding_procedure_col.keys)}
+
+    def encode_records(self, records: [dict]) -> sparse.csr_matrix:
+        row_positions, column_positions, values = list(), list(), list()
+        date_information = self.__get_date_information(records)
+        for row, record in enumerate(records):
+            features_dict = self.__encode_record(record, {name: information[row] for name, information in
+                                                          date_information.items()})
+            row_positions += [row] * len(features_dict)
+            column_positions += features_dict.keys()
+            values += features_dict.values()
+        return sparse.csr_matrix((np.array(values, dtype=np.float64), (row_positions, column_positions)),
+                                 shape=(len(records), self.nb_features))
+
+    def __get_date_information(self, records: [dict]) -> {str: list}:
+        # the dates of all the records are converted at once, a given date must be valid (csv or ISO format)
+        release_dates = [record.get('release_date') for record in records]
+        for release_date in release_dates:
+            if not (release_date is None or isinstance(release_date, str) or
+                    (isinstance(release_date, float) and math.isnan(release_date))):
+                raise ValueError(f'release_date must be a date, not {release_date!r}')
+        release_date_series = parse_release_dates(pd.Series(release_dates, dtype=object))
+        for release_date, parsed_release_date in zip(release_dates, release_date_series):
+            if isinstance(release_date, str) and pd.isna(parsed_release_date):
+                raise ValueError(f'release_date must be a date (e.g. 2/20/15 or 2015-02-20), not {release_date!r}')
+        dense_date_information_dict, date_information_dict = get_date_information(
+            release_date_series, self.fitted_vocabulary.reference_date)
+        date_information = {col: series.fillna(0).tolist() for col, series in dense_date_information_dict.items()}
+        date_information.update({col: series.tolist() for col, series in date_information_dict.items()})
+        return date_information
+
+    def __encode_record(self, record: dict, date_information: dict) -> {int: float}:
+        # value of each non-zero feature
+        features_dict = dict()
+        dense_values = ([(col, record.get(col)) for col in self.fitted_vocabulary.passthrough_columns] +
+                        [(col, date_information[col]) for col in self.fitted_vocabulary.date_columns])
+        for position, (col, value) in enumerate(dense_values):
+            value = _to_float(value, col)
+            if value != 0:
+                features_dict[position] = value
+
+        for col, encoding_procedure_col in self.fitted_vocabulary.encoders_dict.items():
+            self.__encode_value(col, record.get(col), encoding_procedure_col, self.positions_dict[col],
+                                self.first_positions_dict[col], features_dict)
+        for col, encoding_procedure_col in self.fitted_vocabulary.date_encoders_dict.items():
+            self.__encode_value(col, date_information[col], encoding_procedure_col, self.positions_dict[col],
+                                self.first_positions_dict[col], features_dict)
+        if self.fitted_vocabulary.aggregates_dict:
+            self.__encode_aggregates(record.get('crew'), features_dict)
+        return features_dict
+
+    def __encode_aggregates(self, value, features_dict: {int: float}) -> None:
+        # same computation as CharactersAggregates.transform_series
+        items = _get_items(value, 'crew')
+        for name_job, characters_aggregates in self.fitted_vocabulary.aggregates_dict.items():
+            characters_positions = {self.characters_positions_dict[name_job].get(item.get('id')) for item in items
+                                    if item.get('job') == name_job} - {None}
+            if not characters_positions:
+                continue
+            characters_positions = list(characters_positions)
+            nb_movies = characters_aggregates.nb_movies[characters_positions]
+            first_position = self.first_positions_dict[name_job]
+            features_dict[first_position] = float(nb_movies.max())
+            mean_value = characters_aggregates.sums_values[characters_positions].sum() / nb_movies.sum()
+            if mean_value != 0:
+                features_dict[first_position + 1] = float(mean_value)
+
+    def __encode_value(self, col: str, value, encoding_procedure_col: OneHotEncodingColumn, positions_dict: dict,
+                       first_position: int, features_dict: {int: float}) -> None:
+        encoding_type = encoding_procedure_col.encoding_type
+        # columns whose one row contains only one value (e.g. original_language)
+        is_single_value = encoding_type == 'representing_as_item' or (
+            encoding_type == 'with_target_statistics' and encoding_procedure_col.id_name_col is None)
+        if is_single_value and isinstance(value, (list, dict)):
+            raise ValueError(f'{col} must be a single value')
+        if encoding_type == 'representing_as_item':
+            if value in positions_dict:
+                features_dict[positions_dict[value]] = 1
+            return
+        if is_single_value:
+            self.__encode_target_statistics([] if value is None or value != value else [value],
+                                            encoding_procedure_col, positions_dict, first_position, features_dict)
+            return
+
+        items = _get_items(value, col)
+        if encoding_type == 'representing_as_dict':
+            for item in items:
+                position = positions_dict.get(item.get(encoding_procedure_col.id_name_col))
+                if position is not None:
+                    features_dict[position] = 1
+        elif encoding_type == 'with_most_popular':
+            # frequency of each famous name, the first column counts the names which are not famous
+            for name in self.__get_names(items, encoding_procedure_col.need_to_simplify):
+                position = positions_dict.get(name, first_position)
+                features_dict[position] = features_dict.get(position, 0) + 1
+        elif encoding_type == 'with_characters_description':
+            # the first columns indicate the candidates who are not experienced enough
+            for item in items:
+                name_job = item.get('job')
+                if name_job in positions_dict:
+                    position_other = first_position + list(encoding_procedure_col.names_jobs_dict).index(name_job)
+                    features_dict[positions_dict[name_job].get(item.get('id'), position_other)] = 1
+        elif encoding_type == 'with_hashing':
+            if encoding_procedure_col.hashing_by_job:
+                tokens = [f'{encoding_procedure_col.names_jobs_dict[item.get("job")]}_{item.get("id")}'
+                          for item in items if item.get('job') in encoding_procedure_col.names_jobs_dict]
+            else:
+                tokens = self.__get_names(items, encoding_procedure_col.need_to_simplify)
+            if tokens:
+                buckets, signs = sparse_encoding.hash_tokens(tokens, encoding_procedure_col.nb_buckets,
+                                                             encoding_procedure_col.signed_hashing)
+                for bucket, sign in zip(buckets.tolist(), signs.tolist()):
+                    features_dict[first_position + bucket] = features_dict.get(first_position + bucket, 0) + sign
+        elif encoding_type == 'with_target_statistics':
+            self.__encode_target_statistics([item.get(encoding_procedure_col.id_name_col) for item in items],
+                                            encoding_procedure_col, positions_dict, first_position, features_dict)
+
+    @staticmethod
+    def __encode_target_statistics(keys: list, encoding_procedure_col: OneHotEncodingColumn, positions_dict: dict,
+                                   first_position: int, features_dict: {int: float}) -> None:
+        # same computation as OneHotEncodingColumn.transform_series_with_target_statistics
+        if not keys:
+            return
+        positions = [positions_dict.get(key) for key in keys]
+        values = [encoding_procedure_col.prior if position is None else encoding_procedure_col.target_means[position]
+                  for position in positions]
+        frequency_ranks = [len(positions_dict) + 1 if position is None else
+                           encoding_procedure_col.frequency_ranks[position] for position in positions]
+        statistics = [sum(values) / len(values), max(values), min(values), len(keys), min(frequency_ranks)]
+        for position, statistic in enumerate(statistics):
+            if statistic != 0:
+                features_dict[first_position + position] = float(statistic)
+
+    def __get_names(self, items: [dict], need_to_simplify: bool) -> list:
+        names = [item.get('name') for item in items]
+        if not need_to_simplify:
+            return names
+        return [self.simplify_name(name) for name in names]
+
+
+def _to_float(value, col: str) -> float:
+    # missing values are 0, as in PipelineTransforming, the other values must be numbers (or numeric strings)
+    if value is None:
+        return 0
+    if isinstance(value, bool) or not isinstance(value, (numbers.Real, str)):
+        raise ValueError(f'{col} must be a number')
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f'{col} must be a number, not {value!r}')
+    return 0 if math.isnan(value) else value
+
+
+def _get_items(value, col: str) -> [dict]:
+    # the cells are stringified lists of dicts (as inside the csv files), lists of dicts (as in json) or missing
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return list()
+    items = parse_cell(value) if isinstance(value, str) else value
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError(f'{col} must be a list of objects (or its string representation)')
+    return items
@@ -0,0 +1,127 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.utils import constants
+
+
+class FeatureBlock:
+    # features produced by one encoder: a sparse matrix (csc) & the names of its columns
+    def __init__(self, matrix: sparse.csc_matrix, columns: [str]):
+        self.matrix = matrix
+        self.columns = columns
+
+    @property
+    def shape(self) -> (int, int):
+        return self.matrix.shape
+
+    def to_df(self, index: pd.Index) -> pd.DataFrame:
+        return to_sparse_df(self.matrix, self.columns, index)
+
+
+def encode_positions(row_positions: np.ndarray, column_positions: np.ndarray, nb_rows: int, nb_columns: int,
+                     count_occurrences: bool = False, values: np.ndarray = None) -> sparse.csc_matrix:
+    # negative column positions correspond to values without column
+    mask_known_values = column_positions >= 0
+    row_positions = row_positions[mask_known_values]
+    column_positions = column_positions[mask_known_values]
+
+    # duplicates (row, column) are summed during the conversion to csc
+    data = np.ones(row_positions.size, dtype=np.int32) if values is None else values[mask_known_values]
+    matrix = sparse.coo_matrix((data, (row_positions, column_positions)), shape=(nb_rows, nb_columns)).tocsc()
+    if not count_occurrences:
+        # presence only
+        matrix.data[:] = 1
+    return matrix
+
+
+def hash_tokens(tokens: [str], nb_buckets: int, signed_hashing: bool = True) -> (np.ndarray, np.ndarray):
+    # bucket & sign of each token, as sklearn.feature_extraction.FeatureHasher (stable across processes)
+    # (imported here: importing sklearn is the main cost of the start of the prediction server)
+    from sklearn.utils import murmurhash3_32
+    unique_tokens, inverse_positions = np.unique(np.asarray(tokens, dtype=object).astype(str), return_inverse=True)
+    hashes = np.array([murmurhash3_32(token, seed=0) for token in unique_tokens.tolist()], dtype=np.int64)
+    buckets = np.abs(hashes) % nb_buckets
+    signs = np.where(hashes >= 0, 1, -1) if signed_hashing else np.ones(hashes.size, dtype=np.int64)
+    return buckets[inverse_positions], signs[inverse_positions].astype(np.int32)
+
+
+def to_sparse_df(matrix: sparse.spmatrix, columns: [str], index: pd.Index) -> pd.DataFrame:
+    sparse_df = pd.DataFrame.sparse.from_spmatrix(matrix, index=index, columns=columns)
+    if matrix.dtype.kind == 'f':
+        # otherwise, the values which are not stored inside a float matrix would be NaN
+        sparse_df = sparse_df.astype(pd.SparseDtype(matrix.dtype, 0))
+    return sparse_df
+
+
+def assemble_blocks(dense_df: pd.DataFrame, blocks: [FeatureBlock]) -> pd.DataFrame:
+    # the sparse blocks are stacked column-wise (csc) & the final df is materialized only once
+    matrix = sparse.hstack([block.matrix for block in blocks], format='csc') if blocks else sparse.csc_matrix(
+        (dense_df.shape[0], 0), dtype=np.int32)
+    columns = [col for block in blocks for col in block.columns]
+    return pd.concat([dense_df, to_sparse_df(matrix, columns, dense_df.index)], axis=1)
+
+
+def get_features_matrix(df: pd.DataFrame) -> sparse.csr_matrix:
+    # build the matrix given to the model, sparse columns of the df are never densified
+    is_sparse_columns = [isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes]
+    blocks = list()
+    for is_sparse_block, positions in itertools.groupby(range(df.shape[1]), key=lambda i: is_sparse_columns[i]):
+        block_df = df.iloc[:, list(positions)]
+        if is_sparse_block:
+            blocks.append(_get_sparse_df_as_csc(block_df))
+        else:
+            blocks.append(sparse.csc_matrix(block_df.to_numpy(dtype=np.float64)))
+
+    if not blocks:
+        return sparse.csr_matrix((df.shape[0], 0), dtype=np.float64)
+    # csc blocks are stacked without conversion, then the stored values are converted only once
+    return sparse.hstack(blocks, format='csc', dtype=np.float64).tocsr()
+
+
+class FeaturesMatrix:
+    # features of a dataset as given to the model (csr matrix, float64), with the names & the dtypes of its columns
+    # & the labels (training dataset only): built from a transformed df, or memory-mapped from the feature store
+    def __init__(self, matrix: sparse.csr_matrix, columns: [str], dtypes: [str], labels: np.ndarray = None):
+        self.matrix = matrix
+        self.columns = columns
+        self.dtypes = dtypes
+        self.labels = labels
+
+    @classmethod
+    def from_df(cls, main_df: pd.DataFrame) -> 'FeaturesMatrix':
+        # (the label column, if any, is not a feature)
+        has_labels = constants.label_column in main_df.columns
+        features_df = main_df.drop([constants.label_column], axis=1) if has_labels else main_df
+        return cls(get_features_matrix(features_df), [str(col) for col in features_df.columns],
+                   [str(dtype.subtype if isinstance(dtype, pd.SparseDtype) else dtype) for dtype in features_df.dtypes],
+                   main_df[constants.label_column].to_numpy() if has_labels else None)
+
+    @property
+    def shape(self) -> (int, int):
+        return self.matrix.shape
+
+    def get_column(self, col: str) -> np.ndarray:
+        # values of a feature with its original dtype (e.g. the ids are integers)
+        position = self.columns.index(col)
+        return self.matrix[:, position].toarray().ravel().astype(self.dtypes[position])
+
+
+def get_features(data: pd.DataFrame or FeaturesMatrix) -> FeaturesMatrix:
+    return data if isinstance(data, FeaturesMatrix) else FeaturesMatrix.from_df(data)
+
+
+def _get_sparse_df_as_csc(sparse_df: pd.DataFrame) -> sparse.csc_matrix:
+    arrays = [series.array for _, series in sparse_df.items()]
+    if any(array.fill_value != 0 for array in arrays):
+        return sparse_df.sparse.to_coo().tocsc()
+
+    # the stored values of each column are directly the values of a column of a csc matrix
+    indices_list = [array.sp_index.to_int_index().indices for array in arrays]
+    indptr = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([indices.size for indices in indices_list], out=indptr[1:])
+    data = np.concatenate([array.sp_values for array in arrays]) if arrays else np.empty(0)
+    indices = np.concatenate(indices_list) if arrays else np.empty(0, dtype=np.int64)
+    return sparse.csc_matrix((data, indices, indptr), shape=sparse_df.shape)
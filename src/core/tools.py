@@ -1,6 +1,12 @@
-import ast
+import functools
+import re
+from collections import Counter
+
 import pandas as pd
 
+from src.core.inverted_index import get_jobs_inverted_index
+from src.core.parsed_column import get_parsed_column
+
 
 # path methods #
 
@@ -16,68 +22,65 @@ def export_df_to_csv(df: pd.DataFrame, path_file: str):
 
 
 def get_unique_values_from_series(series: pd.Series, id_name_col: str) -> dict:
-    translation_dict = dict()
-    for collection in series:
-        if isinstance(collection, str):
-            # if float, collection = Nan
-            for item in ast.literal_eval(collection):
-                id_item = item[id_name_col]
-                name_item = item['name']
-                translation_dict[id_item] = name_item
+    parsed_column = get_parsed_column(series, id_name_col)
+    return dict(zip(parsed_column.ids.tolist(), parsed_column.names.tolist()))
 
-    return translation_dict
 
+# maximum number of simplified names kept in memory (by list of info to delete)
+max_nb_cached_simplified_names = 2 ** 17
 
-def simplify_names(complicated_names_list: [str], info_to_delete_list: [str]) -> dict:
-    translation_complicated_to_simplified_names = dict()
-    for complicated_name in complicated_names_list:
-        simplified_name = complicated_name
 
-        # simplify the name
-        for replacement in [(info + 's', '') for info in info_to_delete_list]:
-            simplified_name = simplified_name.replace(*replacement)
-        for replacement in [(info, '') for info in info_to_delete_list]:
-            simplified_name = simplified_name.replace(*replacement)
-        simplified_name = simplified_name.strip()
-
-        # add the translation complicated_name -> simplified_name
-        translation_complicated_to_simplified_names[complicated_name] = simplified_name
-    return translation_complicated_to_simplified_names
+def simplify_names(complicated_names_list: [str], info_to_delete_list: [str]) -> dict:
+    # the simplified names are cached: a name is simplified only once by process (training, testing, scoring...)
+    simplify_name = get_name_simplifier(tuple(info_to_delete_list))
+    return {complicated_name: simplify_name(complicated_name) for complicated_name in complicated_names_list}
+
+
+@functools.lru_cache(maxsize=8)
+def get_name_simplifier(info_to_delete: tuple):
+    # all the info (and their plural) are deleted by a single regex, only when they are whole words
+    # (e.g. 'Inc' is deleted from 'Pixar Inc' but not from 'Incognito')
+    # the info are grouped by the characters at their ends (same boundaries), the info ending with a punctuation
+    # (e.g. 'Inc.') are tried before the others (e.g. 'Inc') & inside a group, the longest info are tried first
+    groups_dict = dict()
+    for info in sorted(info_to_delete, key=len, reverse=True):
+        groups_dict.setdefault((info[-1:].isalnum(), info[:1].isalnum()), list()).append(re.escape(info))
+    alternatives = list()
+    for (is_word_at_end, is_word_at_start), group in sorted(groups_dict.items()):
+        alternatives.append((r'(?<!\w)' if is_word_at_start else '') + f'(?:{"|".join(group)})' +
+                            (r's?(?!\w)' if is_word_at_end else ''))
+    regex = re.compile('|'.join(alternatives))
+
+    @functools.lru_cache(maxsize=max_nb_cached_simplified_names)
+    def simplify_name(complicated_name: str) -> str:
+        # the spaces left by the deleted info are merged
+        return ' '.join(regex.sub('', complicated_name).split())
+
+    return simplify_name
 
 
 def get_unique_famous_names(multiple_series: [pd.Series], translation_simplified_dict: dict,
-                            threshold_popularity: int) -> list:
-    names_frequency_dict = dict()
+                            threshold_popularity: int, id_name_col: str = 'id') -> list:
+    names_frequency_dict = Counter()
 
     for series in multiple_series:
-        for collection, frequency_collection in series.value_counts().iteritems():
-            for item in ast.literal_eval(collection):
-                original_name = item['name']
-                simplified_name = translation_simplified_dict[
-                    original_name] if translation_simplified_dict else original_name
-                previous_frequency = names_frequency_dict.get(simplified_name, 0)
-                names_frequency_dict[simplified_name] = previous_frequency + frequency_collection
+        names = get_parsed_column(series, id_name_col).names.tolist()
+        if translation_simplified_dict:
+            names = [translation_simplified_dict[original_name] for original_name in names]
+        names_frequency_dict.update(names)
 
     return [name for name, frequency in names_frequency_dict.items() if frequency > threshold_popularity]
 
 
 def get_unique_specific_jobs(multiple_series: [pd.Series], name_jobs: [str], threshold_experience: int) -> dict:
-    candidates_dict = dict()
+    candidates_dict = {name_job: Counter() for name_job in name_jobs}
 
-    # get the list of all candidates for this job
+    # get the list of all candidates for this job (with their number of occurrences, from the inverted indexes)
     for series in multiple_series:
-        for index, movie_crew in series.iteritems():
-            try:
-                list_characters = ast.literal_eval(movie_crew)
-                for character in list_characters:
-                    for name_job in name_jobs:
-                        if character['job'] == name_job:
-                            previous_candidates_for_job = candidates_dict.get(name_job, dict())
-                            previous_frequency = previous_candidates_for_job.get(character['id'], 0)
-                            previous_candidates_for_job[character['id']] = previous_frequency + 1
-                            candidates_dict[name_job] = previous_candidates_for_job
-            except ValueError:
-                pass
+        jobs_inverted_index = get_jobs_inverted_index(series)
+        for name_job in name_jobs:
+            index = jobs_inverted_index.get_index(name_job)
+            candidates_dict[name_job].update(dict(zip(index.entities, index.counts.tolist())))
 
     # only keep candidates with a minimum of experience
     result = dict()
@@ -0,0 +1,56 @@
+import gzip
+import pickle
+
+import pandas as pd
+
+from src.core.inverted_index import CharactersAggregates
+from src.core.one_hot_encoding import OneHotEncodingColumn
+
+# to increment each time the content of the artifact changes
+VOCABULARY_FORMAT_VERSION = 9
+
+
+class FittedVocabulary:
+    # everything learnt by the fit of PipelineTransforming: the fitted encoder of each column & the column layout
+    def __init__(self, encoders_dict: {str: OneHotEncodingColumn}, passthrough_columns: [str],
+                 date_columns: [str], date_encoders_dict: {str: OneHotEncodingColumn},
+                 aggregates_dict: {str: CharactersAggregates} = None, reference_date: pd.Timestamp = None):
+        self.encoders_dict = encoders_dict
+        self.passthrough_columns = passthrough_columns
+        # dense date information & one hot encoded date information
+        self.date_columns = date_columns
+        self.date_encoders_dict = date_encoders_dict
+        # aggregate features of the characters of the crew, by job
+        self.aggregates_dict = aggregates_dict if aggregates_dict is not None else dict()
+        # date at which the age of the movies is computed
+        self.reference_date = reference_date
+
+    @property
+    def feature_columns(self) -> [str]:
+        # dense columns first, then the sparse blocks
+        columns = self.passthrough_columns + self.date_columns
+        for encoder in (list(self.encoders_dict.values()) + list(self.date_encoders_dict.values()) +
+                        list(self.aggregates_dict.values())):
+            columns += encoder.get_columns_names()
+        return columns
+
+    def save(self, path_file: str) -> None:
+        content = {'version': VOCABULARY_FORMAT_VERSION,
+                   'encoders_dict': self.encoders_dict,
+                   'passthrough_columns': self.passthrough_columns,
+                   'date_columns': self.date_columns,
+                   'date_encoders_dict': self.date_encoders_dict,
+                   'aggregates_dict': self.aggregates_dict,
+                   'reference_date': self.reference_date}
+        with gzip.open(path_file, 'wb') as file:
+            pickle.dump(content, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path_file: str) -> 'FittedVocabulary':
+        with gzip.open(path_file, 'rb') as file:
+            content = pickle.load(file)
+        if content.get('version') != VOCABULARY_FORMAT_VERSION:
+            raise ValueError(f'{path_file} has been produced with the version {content.get("version")} of the '
+                             f'vocabulary, the version {VOCABULARY_FORMAT_VERSION} is expected')
+        return cls(content['encoders_dict'], content['passthrough_columns'], content['date_columns'],
+                   content['date_encoders_dict'], content['aggregates_dict'], content['reference_date'])
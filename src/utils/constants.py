@@ -1,5 +1,16 @@
-path_training_file = r'data\train.csv'
-path_testing_file = r'data\test.csv'
+import os
+
+path_training_file = os.path.join('data', 'train.csv')
+path_testing_file = os.path.join('data', 'test.csv')
+path_result_file = os.path.join('data', 'result.csv')
+path_feature_store_directory = os.path.join('data', 'feature_store')
+path_incremental_feature_store_directory = os.path.join('data', 'incremental_feature_store')
+path_benchmark_report_file = os.path.join('logs', 'benchmark_report.json')
+path_trace_file = os.path.join('logs', 'trace.json')
+path_log_file = os.path.join('logs', 'file.log')
+path_vocabulary_file = os.path.join('data', 'vocabulary.pkl.gz')
+path_model_registry_directory = os.path.join('data', 'model_registry')
+path_tuning_checkpoint_directory = os.path.join('data', 'tuning_checkpoint')
 
 # columns
 columns_to_process = ['id', 'belongs_to_collection', 'budget', 'genres', 'original_language', 'popularity',
@@ -11,3 +22,6 @@ label_column = 'revenue'
 # info from columns
 useless_info_inside_title = ['Picture', 'Image', 'Animation', 'Classic', 'Vantage', 'Film', 'Production',
                              'Entertainment', 'Studio', 'Inc.', 'Inc', ', The', 'L.P.', 'Company']
+
+# dates (e.g. 2/20/15): the years have only 2 digits, the dates after the current date belong to the previous century
+release_date_format = '%m/%d/%y'
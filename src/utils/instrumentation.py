@@ -0,0 +1,95 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from src.utils.logger import logger
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak RSS is then not measured
+    resource = None
+
+# records of the stages, exported as a JSON trace when the trace is enabled
+_trace_dict = {'path_file': None, 'records': list()}
+# name of the stages currently running inside each thread (to know the parent of a stage)
+_running_stages = threading.local()
+
+
+def enable_trace(path_file: str) -> None:
+    _trace_dict['path_file'] = path_file
+    _trace_dict['records'] = list()
+
+
+def add_records(records: [dict]) -> None:
+    # records produced by other processes (e.g. workers of a pool)
+    if _trace_dict['path_file'] is not None:
+        _trace_dict['records'].extend(records)
+
+
+def export_trace() -> None:
+    if _trace_dict['path_file'] is None:
+        return
+    with open(_trace_dict['path_file'], 'w') as file:
+        json.dump({'pid': os.getpid(), 'records': _trace_dict['records']}, file, indent=2)
+    logger.info(f'Trace of {len(_trace_dict["records"])} stages exported to {_trace_dict["path_file"]}')
+
+
+def get_shapes(*objects) -> list:
+    # shape of each df, series, matrix or array (the content of tuples & lists is inspected)
+    shapes = list()
+    for obj in objects:
+        if isinstance(obj, (tuple, list)):
+            shapes += get_shapes(*obj)
+        elif hasattr(obj, 'shape'):
+            shapes.append(list(obj.shape))
+    return shapes
+
+
+def _get_peak_rss_mb() -> float:
+    if resource is None:
+        return float('nan')
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak_rss / 2 ** 20 if sys.platform == 'darwin' else peak_rss / 2 ** 10
+
+
+@contextmanager
+def stage(name: str, *inputs):
+    # the record can be completed inside the block, e.g. record['output_shapes'] = get_shapes(result)
+    stack = getattr(_running_stages, 'stack', None)
+    if stack is None:
+        stack = _running_stages.stack = list()
+    record = {'stage': name, 'parent': stack[-1] if stack else None, 'pid': os.getpid(),
+              'thread': threading.current_thread().name, 'input_shapes': get_shapes(*inputs), 'output_shapes': []}
+    stack.append(name)
+    start_wall_time, start_cpu_time, start_peak_rss = time.perf_counter(), time.process_time(), _get_peak_rss_mb()
+    try:
+        yield record
+    finally:
+        stack.pop()
+        record.update({'wall_time': time.perf_counter() - start_wall_time,
+                       'cpu_time': time.process_time() - start_cpu_time,
+                       'peak_rss_delta_mb': _get_peak_rss_mb() - start_peak_rss})
+        logger.info(f'stage={name} wall_time={record["wall_time"]:.3f}s cpu_time={record["cpu_time"]:.3f}s '
+                    f'peak_rss_delta={record["peak_rss_delta_mb"]:.1f}MB input_shapes={record["input_shapes"]} '
+                    f'output_shapes={record["output_shapes"]}', extra={'stage_record': record})
+        if _trace_dict['path_file'] is not None:
+            _trace_dict['records'].append(record)
+
+
+def instrumented(name: str = None):
+    # decorator: the function is one stage, the shapes of its arguments & its result are recorded
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name or function.__qualname__, *args, *kwargs.values()) as record:
+                result = function(*args, **kwargs)
+                record['output_shapes'] = get_shapes(result)
+            return result
+        return wrapper
+    return decorator
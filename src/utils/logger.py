@@ -1,4 +1,19 @@
 import logging
+import os
+
+from src.utils import constants
+
+
+class LazyFileHandler(logging.FileHandler):
+    # the file (and its directory) is only created when the first record is written,
+    # importing the logger has no side effect on the file system
+    def __init__(self, path_file: str):
+        super().__init__(path_file, delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
 
 # create logger
 log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -6,7 +21,7 @@ logging.basicConfig(level=logging.DEBUG, format=log_format)
 logger = logging.getLogger('tmdb_box_office_revenue_logger')
 
 # create file handler
-file_handler = logging.FileHandler('logs/file.log')
+file_handler = LazyFileHandler(constants.path_log_file)
 file_handler.setLevel(logging.WARNING)
 
 # create formatter and add it to file handler
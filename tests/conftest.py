@@ -0,0 +1,14 @@
+import pandas as pd
+import pytest
+
+from src.benchmarks.synthetic_data import SyntheticTmdbGenerator
+
+
+@pytest.fixture
+def synthetic_dfs() -> (pd.DataFrame, pd.DataFrame):
+    # small training & testing dfs with the columns of the csv files (and the label for the training df)
+    generator = SyntheticTmdbGenerator({'belongs_to_collection': 40, 'genres': 20, 'production_companies': 120,
+                                        'production_countries': 15, 'spoken_languages': 15, 'Keywords': 300,
+                                        'crew': 400, 'original_language': 10})
+    return generator.generate_df(300), generator.generate_df(150, with_label=False)
+
@@ -0,0 +1,42 @@
+import numpy as np
+
+from src.core.feature_store import FeatureStore
+from src.core.pipeline_transforming import PipelineTransforming
+from src.core.sparse_encoding import FeaturesMatrix
+
+
+def test_load_returns_the_saved_dfs(synthetic_dfs, tmp_path):
+    pipeline_transforming = PipelineTransforming(*synthetic_dfs)
+    training_df, testing_df = pipeline_transforming.clean_dfs()
+    feature_store = FeatureStore(str(tmp_path))
+    feature_store.save('key', training_df, testing_df, pipeline_transforming.fitted_vocabulary)
+    assert feature_store.contains('key')
+
+    loaded_training_df, loaded_testing_df, fitted_vocabulary = feature_store.load('key')
+    for main_df, loaded_df in [(training_df, loaded_training_df), (testing_df, loaded_testing_df)]:
+        # same columns, values & dtypes (e.g. the one hot encoded columns stay sparse int32)
+        assert list(loaded_df.columns) == list(main_df.columns)
+        assert list(loaded_df.dtypes) == list(main_df.dtypes)
+        assert loaded_df.equals(main_df)
+    assert fitted_vocabulary.feature_columns == pipeline_transforming.fitted_vocabulary.feature_columns
+
+
+def test_load_matrix_maps_the_features_of_the_model(synthetic_dfs, tmp_path):
+    pipeline_transforming = PipelineTransforming(*synthetic_dfs)
+    training_df, testing_df = pipeline_transforming.clean_dfs()
+    feature_store = FeatureStore(str(tmp_path))
+    feature_store.save('key', training_df, testing_df, pipeline_transforming.fitted_vocabulary)
+
+    for name, main_df in [('training', training_df), ('testing', testing_df)]:
+        features = feature_store.load_matrix('key', name)
+        expected_features = FeaturesMatrix.from_df(main_df)
+        assert features.columns == expected_features.columns
+        assert (features.matrix != expected_features.matrix).nnz == 0
+        np.testing.assert_array_equal(features.get_column('id'), main_df['id'].to_numpy())
+        # the matrix is not copied: its arrays are views of the memory-mapped files
+        for array in [features.matrix.data, features.matrix.indices, features.matrix.indptr]:
+            while not isinstance(array, np.memmap) and array.base is not None:
+                array = array.base
+            assert isinstance(array, np.memmap)
+    np.testing.assert_array_equal(feature_store.load_matrix('key', 'training').labels, training_df['revenue'])
+    assert feature_store.load_matrix('key', 'testing').labels is None
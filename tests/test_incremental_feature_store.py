@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from src.core import incremental_feature_store, tools
+from src.core.incremental_feature_store import IncrementalFeatureStore
+from src.core.pipeline_transforming import parse_release_dates, PipelineTransforming
+
+
+# the patches are either kept beside the segments, or merged into them as soon as they exist
+@pytest.mark.parametrize('ratio_compaction', [float('inf'), 0.01])
+def test_appends_equal_the_transformation_of_the_union(synthetic_dfs, tmp_path, monkeypatch, ratio_compaction):
+    monkeypatch.setattr(incremental_feature_store, 'ratio_compaction', ratio_compaction)
+    training_df, testing_df = synthetic_dfs
+    # the age is computed at the latest release date of the original rows: the same date as the union's, once the
+    # latest movie is one of them
+    latest_position = parse_release_dates(training_df['release_date']).reset_index(drop=True).idxmax()
+    training_df = training_df.iloc[[latest_position] + [position for position in range(training_df.shape[0])
+                                                        if position != latest_position]].reset_index(drop=True)
+    IncrementalFeatureStore(str(tmp_path)).initialize(training_df.iloc[:100], testing_df.iloc[:50])
+    # small batches, so that values are promoted & the previous rows patched
+    for start in range(100, 300, 40):
+        IncrementalFeatureStore(str(tmp_path)).append(training_df.iloc[start:start + 40],
+                                                      testing_df.iloc[start // 2:start // 2 + 20])
+    assert bool(list(tmp_path.glob('*_compacted_*'))) == (ratio_compaction < 1)
+    loaded_training_df, loaded_testing_df, _ = IncrementalFeatureStore(str(tmp_path)).load()
+
+    expected_dfs = PipelineTransforming(training_df, testing_df).clean_dfs()
+    for loaded_df, expected_df in zip([loaded_training_df, loaded_testing_df], expected_dfs):
+        # the new columns are added at the end of the store, so only the set of columns is the same
+        assert sorted(map(str, loaded_df.columns)) == sorted(map(str, expected_df.columns))
+        expected_df = expected_df.rename(columns=str)
+        for col in loaded_df.columns:
+            assert np.array_equal(loaded_df[col].to_numpy(dtype=np.float64),
+                                  expected_df[col].to_numpy(dtype=np.float64), equal_nan=True), col
+
+
+def test_original_files_are_not_appended_again(synthetic_dfs, tmp_path):
+    training_df, testing_df = synthetic_dfs
+    paths_files = [str(tmp_path / 'train.csv'), str(tmp_path / 'test.csv')]
+    training_df.iloc[:100].to_csv(paths_files[0], index=False)
+    testing_df.iloc[:50].to_csv(paths_files[1], index=False)
+    path_store_directory = str(tmp_path / 'store')
+    IncrementalFeatureStore(path_store_directory).initialize(tools.get_df_from_csv(paths_files[0]),
+                                                             tools.get_df_from_csv(paths_files[1]), paths_files)
+
+    IncrementalFeatureStore(path_store_directory).append_files(*paths_files)
+    loaded_training_df, loaded_testing_df, _ = IncrementalFeatureStore(path_store_directory).load()
+    assert (loaded_training_df.shape[0], loaded_testing_df.shape[0]) == (100, 50)
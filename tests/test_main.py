@@ -0,0 +1,11 @@
+import pytest
+
+from src.core import main
+
+
+@pytest.mark.parametrize('arguments', [['--bogus'], ['predict', '--bogus']])
+def test_unknown_arguments_are_rejected(arguments, capsys):
+    with pytest.raises(SystemExit) as error:
+        main.main(arguments)
+    assert error.value.code == 2
+    assert 'unrecognized arguments: --bogus' in capsys.readouterr().err
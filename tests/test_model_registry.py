@@ -0,0 +1,26 @@
+import numpy as np
+from scipy import sparse
+from sklearn.ensemble import RandomForestRegressor
+
+from src.core.model_registry import ModelRegistry
+
+
+def test_memory_mapped_forest_predicts_like_the_estimator(tmp_path):
+    random_state = np.random.RandomState(0)
+    features_matrix = random_state.rand(400, 5)
+    labels = features_matrix[:, 0] * 10 + random_state.rand(400)
+    # missing values during the training, routed to the left or to the right child depending on the node
+    features_matrix[random_state.rand(400) < 0.2, 0] = np.nan
+    rf = RandomForestRegressor(n_estimators=10, random_state=0).fit(features_matrix, labels)
+    model_registry = ModelRegistry(str(tmp_path))
+    model_registry.save('key', rf, [f'feature_{position}' for position in range(5)])
+    model = model_registry.load('key')
+
+    testing_matrix = random_state.rand(200, 5)
+    # missing values of a feature with missing values during the training, and of features without any
+    testing_matrix[random_state.rand(200) < 0.3, 0] = np.nan
+    testing_matrix[random_state.rand(200) < 0.1, 3] = np.nan
+    np.testing.assert_allclose(model.predict(testing_matrix, nb_rows_by_batch=64), rf.predict(testing_matrix))
+    # the sparse matrices of the pipeline have no missing values
+    testing_matrix = sparse.random(200, 5, density=0.5, format='csr', random_state=0)
+    np.testing.assert_allclose(model.predict(testing_matrix), rf.predict(testing_matrix))
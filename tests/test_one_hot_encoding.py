@@ -0,0 +1,64 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from src.core.one_hot_encoding import OneHotEncodingColumn
+from src.core.pipeline_transforming import PipelineTransforming
+from src.utils import constants
+
+
+def fit_target_statistics(training_df, testing_df, col: str, id_name_col: str or None,
+                          labels: np.ndarray = None) -> OneHotEncodingColumn:
+    encoding_procedure_col = OneHotEncodingColumn(training_df[col], testing_df[col], id_name_col, col)
+    encoding_procedure_col.fit_series_with_target_statistics(
+        training_df[constants.label_column].to_numpy() if labels is None else labels)
+    return encoding_procedure_col
+
+
+@pytest.mark.parametrize('col, id_name_col', [('genres', 'id'), ('Keywords', 'id'), ('original_language', None)])
+def test_target_statistics_are_out_of_fold(synthetic_dfs, col, id_name_col):
+    training_df, testing_df = synthetic_dfs
+    labels = training_df[constants.label_column].to_numpy().astype(float)
+    training_block = fit_target_statistics(training_df, testing_df, col, id_name_col, labels).transform_training_series(
+        training_df[col])
+    # the label of a row is never part of its own features
+    labels[7] = labels[7] * 1000 + 1e9
+    other_training_block = fit_target_statistics(training_df, testing_df, col, id_name_col,
+                                                 labels).transform_training_series(training_df[col])
+    differences = abs(training_block.matrix - other_training_block.matrix).toarray()
+    assert differences[7].max() < 1e-9
+    assert differences.max() > 0
+
+
+def test_training_series_must_be_the_fitted_one(synthetic_dfs):
+    training_df, testing_df = synthetic_dfs
+    encoding_procedure_col = fit_target_statistics(training_df, testing_df, 'genres', 'id')
+    assert encoding_procedure_col.transform_training_series(training_df['genres']).matrix.shape == (
+        training_df.shape[0], 5)
+    # same length, other values
+    with pytest.raises(ValueError):
+        encoding_procedure_col.transform_training_series(training_df['Keywords'].rename('genres'))
+    with pytest.raises(ValueError):
+        encoding_procedure_col.transform_training_series(training_df['genres'].copy())
+
+
+def test_out_of_fold_block_is_not_pickled(synthetic_dfs):
+    training_df, testing_df = synthetic_dfs
+    encoding_procedure_col = pickle.loads(pickle.dumps(fit_target_statistics(training_df, testing_df, 'genres', 'id')))
+    assert encoding_procedure_col.out_of_fold_block is None
+    with pytest.raises(ValueError):
+        encoding_procedure_col.transform_training_series(training_df['genres'])
+    # the statistics are kept to transform new series
+    assert encoding_procedure_col.transform_series(testing_df['genres']).matrix.shape == (testing_df.shape[0], 5)
+
+
+def test_out_of_fold_encoding_after_a_fit_by_processes(synthetic_dfs, monkeypatch):
+    monkeypatch.setattr(PipelineTransforming, 'columns_encoded_with_target_statistics',
+                        {'genres': 10, 'Keywords': 10, 'crew': 10, 'original_language': 10})
+    training_df, testing_df = synthetic_dfs
+    expected_df = PipelineTransforming(training_df, testing_df).clean_dfs()[0]
+    pipeline_transforming = PipelineTransforming(training_df, testing_df, nb_workers=2)
+    pipeline_transforming.fit()
+    transformed_df = pipeline_transforming.transform(training_df, is_fitted_training_df=True)
+    assert transformed_df.equals(expected_df)
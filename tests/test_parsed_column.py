@@ -0,0 +1,43 @@
+import pytest
+
+from src.core.parsed_column import cache_scope, get_parsed_column
+
+
+def test_cache_hit_on_object_column(synthetic_dfs):
+    training_df = synthetic_dfs[0].astype({'genres': object})
+    with cache_scope():
+        assert get_parsed_column(training_df['genres']) is get_parsed_column(training_df['genres'])
+
+
+def test_cache_hit_on_pyarrow_strings(synthetic_dfs):
+    pytest.importorskip('pyarrow')
+    training_df = synthetic_dfs[0].astype({'genres': 'string[pyarrow]'})
+    with cache_scope():
+        parsed_column = get_parsed_column(training_df['genres'])
+        assert get_parsed_column(training_df['genres']) is parsed_column
+        # same content as the numpy column
+        expected_parsed_column = get_parsed_column(training_df['genres'].astype(object))
+    assert parsed_column.offsets.tolist() == expected_parsed_column.offsets.tolist()
+    assert parsed_column.ids.tolist() == expected_parsed_column.ids.tolist()
+
+
+def test_different_columns_are_not_mixed(synthetic_dfs):
+    training_df = synthetic_dfs[0]
+    with cache_scope():
+        assert get_parsed_column(training_df['genres']) is not get_parsed_column(training_df['Keywords'])
+        assert get_parsed_column(training_df['genres'], 'id') is not get_parsed_column(training_df['genres'], 'name')
+
+
+@pytest.mark.parametrize('dtype', [object, 'string[pyarrow]'])
+def test_modified_column_is_parsed_again_by_the_next_scope(synthetic_dfs, dtype):
+    if dtype != object:
+        pytest.importorskip('pyarrow')
+    training_df = synthetic_dfs[0].astype({'genres': dtype})
+    with cache_scope():
+        get_parsed_column(training_df['genres'])
+    training_df.loc[0, 'genres'] = "[{'id': 99, 'name': 'Documentary'}]"
+    with cache_scope():
+        parsed_column = get_parsed_column(training_df['genres'])
+    assert parsed_column.ids[parsed_column.offsets[0]:parsed_column.offsets[1]].tolist() == [99]
+    # nothing is cached outside a scope
+    assert get_parsed_column(training_df['genres']) is not get_parsed_column(training_df['genres'])
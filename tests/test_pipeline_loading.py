@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+from src.core import pipeline_loading
+from src.core.pipeline_transforming import PipelineTransforming
+
+
+def test_successive_halving_resumes_only_the_same_training_data(synthetic_dfs, tmp_path, caplog):
+    training_df, _ = PipelineTransforming(*synthetic_dfs).clean_dfs()
+    rf = RandomForestRegressor(random_state=42)
+    parameters = {'nb_candidates': 3, 'min_nb_trees': 2, 'max_nb_trees': 6, 'nb_folds': 2,
+                  'path_checkpoint_directory': str(tmp_path)}
+    best_params = pipeline_loading.tune_hyperparameters_by_successive_halving(training_df, rf, **parameters)
+    assert os.path.exists(os.path.join(str(tmp_path), 'state.joblib'))
+
+    # same data: the finished search is resumed
+    assert pipeline_loading.tune_hyperparameters_by_successive_halving(training_df, rf, **parameters) == best_params
+    assert 'discarded' not in caplog.text
+
+    # same number of rows but other labels: the checkpoint is discarded
+    other_training_df = training_df.assign(revenue=np.roll(training_df['revenue'].to_numpy(), 1))
+    pipeline_loading.tune_hyperparameters_by_successive_halving(other_training_df, rf, **parameters)
+    assert 'discarded' in caplog.text
@@ -0,0 +1,68 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from src.core.model_registry import check_feature_columns
+from src.core.pipeline_transforming import get_date_information, PipelineTransforming
+from src.utils import constants
+
+
+def test_layout_does_not_depend_on_the_order_of_the_columns(synthetic_dfs):
+    training_df, testing_df = synthetic_dfs
+    pipeline_transforming = PipelineTransforming(training_df, testing_df)
+    fitted_vocabulary = pipeline_transforming.fit()
+    transformed_df = pipeline_transforming.transform(testing_df)
+    reversed_transformed_df = pipeline_transforming.transform(testing_df[testing_df.columns[::-1]])
+    assert list(transformed_df.columns) == [str(col) for col in fitted_vocabulary.feature_columns]
+    assert list(reversed_transformed_df.columns) == list(transformed_df.columns)
+    assert reversed_transformed_df.equals(transformed_df)
+    # the label is only kept when present
+    transformed_training_df = pipeline_transforming.transform(training_df)
+    assert list(transformed_training_df.drop([constants.label_column], axis=1).columns) == list(
+        transformed_df.columns)
+
+
+def test_missing_passthrough_column(synthetic_dfs):
+    training_df, testing_df = synthetic_dfs
+    pipeline_transforming = PipelineTransforming(training_df, testing_df)
+    pipeline_transforming.fit()
+    with pytest.raises(KeyError):
+        pipeline_transforming.transform(testing_df.drop(['runtime'], axis=1))
+
+
+def test_check_feature_columns():
+    check_feature_columns(['budget', 'genre_1'], ['budget', 'genre_1'])
+    with pytest.raises(ValueError):
+        check_feature_columns(['genre_1', 'budget'], ['budget', 'genre_1'])
+    with pytest.raises(ValueError):
+        check_feature_columns(['budget'], ['budget', 'genre_1'])
+
+
+def test_dates_of_two_digit_years_belong_to_the_latest_century():
+    dense_date_information_dict, _ = get_date_information(pd.Series(['3/15/21', '4/28/27', '2/20/15']),
+                                                          pd.Timestamp('2021-03-15'))
+    # unless they are after the current date
+    current_year = pd.Timestamp.now().year
+    assert dense_date_information_dict['year'].tolist() == [2021, 1927 if current_year < 2027 else 2027, 2015]
+    assert dense_date_information_dict['age'][0] == 0
+
+
+def test_dates_of_other_formats(caplog):
+    with caplog.at_level(logging.WARNING, logger='tmdb_box_office_revenue_logger'):
+        dense_date_information_dict, date_information_dict = get_date_information(
+            pd.Series(['2015-02-20', '2/20/15', 'not a date', None]))
+    assert dense_date_information_dict['year'][:2].tolist() == [2015, 2015]
+    assert date_information_dict['dayofweek'][0] == date_information_dict['dayofweek'][1]
+    assert dense_date_information_dict['year'][2:].isna().all()
+    # only the invalid date is reported, not the missing one
+    assert '1 invalid release dates' in caplog.text
+
+
+def test_age_is_computed_at_the_latest_training_date(synthetic_dfs):
+    training_df, testing_df = synthetic_dfs
+    fitted_vocabulary = PipelineTransforming(training_df, testing_df).fit()
+    latest_release_date = get_date_information(training_df['release_date'])[0]['year'].max()
+    assert fitted_vocabulary.reference_date.year == latest_release_date
+    transformed_df = PipelineTransforming(None, None, fitted_vocabulary).transform(training_df)
+    assert transformed_df['age'].min() == 0
@@ -0,0 +1,89 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from src.core import prediction_server, sparse_encoding
+from src.core.pipeline_transforming import PipelineTransforming
+from src.core.row_encoder import RowEncoder
+
+
+class FailingModel:
+    # model whose predictions always fail
+    def __init__(self, nb_features: int):
+        self.n_features_in_ = nb_features
+
+    def predict(self, features_matrix):
+        raise RuntimeError('broken model')
+
+
+@pytest.fixture
+def row_encoder_and_records(synthetic_dfs):
+    training_df, testing_df = synthetic_dfs
+    fitted_vocabulary = PipelineTransforming(training_df, testing_df).fit()
+    return RowEncoder(fitted_vocabulary), json.loads(testing_df.head(3).to_json(orient='records'))
+
+
+@pytest.mark.parametrize('invalid_fields', [{'budget': 'abc'}, {'budget': [1]}, {'budget': True},
+                                            {'genres': 5}, {'genres': [1, 2]}, {'genres': '5'},
+                                            {'original_language': ['en']}, {'release_date': 'tomorrow'},
+                                            {'release_date': 20150220}])
+def test_invalid_records_are_rejected(row_encoder_and_records, invalid_fields):
+    row_encoder, records = row_encoder_and_records
+    with pytest.raises(ValueError):
+        row_encoder.encode_records([dict(records[0], **invalid_fields)])
+
+
+def test_missing_and_numeric_string_values_are_accepted(row_encoder_and_records):
+    row_encoder, records = row_encoder_and_records
+    record = dict(records[0], budget=str(records[0]['budget']), genres=None, runtime=None)
+    assert row_encoder.encode_records([record]).shape == (1, row_encoder.nb_features)
+
+
+def test_iso_dates_are_accepted(row_encoder_and_records):
+    row_encoder, records = row_encoder_and_records
+    features_matrix = row_encoder.encode_records([dict(records[0], release_date='2/20/15')])
+    iso_features_matrix = row_encoder.encode_records([dict(records[0], release_date='2015-02-20')])
+    assert (features_matrix != iso_features_matrix).nnz == 0
+
+
+# default encoding (dicts, most popular names & characters description of the crew), hashing trick, target statistics
+# & aggregates of the crew
+@pytest.mark.parametrize('configuration', [
+    dict(),
+    {'columns_encoded_with_hashing': {'Keywords': [64, True], 'production_companies': [32, True], 'crew': [64, False]}},
+    {'columns_encoded_with_target_statistics': {'genres': 10, 'Keywords': 10, 'production_companies': 10, 'crew': 10,
+                                                'belongs_to_collection': 10, 'original_language': 10}},
+    {'crew_aggregates_jobs': {'Director': 'director', 'Producer': 'producer'}}])
+def test_records_are_encoded_as_the_transformed_df(synthetic_dfs, monkeypatch, configuration):
+    for name, value in configuration.items():
+        monkeypatch.setattr(PipelineTransforming, name, value)
+    training_df, testing_df = synthetic_dfs
+    pipeline_transforming = PipelineTransforming(training_df, testing_df)
+    fitted_vocabulary = pipeline_transforming.fit()
+    expected_features_matrix = sparse_encoding.get_features_matrix(pipeline_transforming.transform(testing_df))
+
+    # records as received by the server (json), e.g. the missing values are null
+    features_matrix = RowEncoder(fitted_vocabulary).encode_records(json.loads(testing_df.to_json(orient='records')))
+    assert features_matrix.shape == expected_features_matrix.shape
+    np.testing.assert_allclose(features_matrix.toarray(), expected_features_matrix.toarray(), rtol=1e-9)
+
+
+def test_server_responses(row_encoder_and_records):
+    row_encoder, records = row_encoder_and_records
+    server = prediction_server.create_server('127.0.0.1', 0, row_encoder.fitted_vocabulary,
+                                             FailingModel(row_encoder.nb_features))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/predict'
+    try:
+        for body, expected_status in [({'id': 1, 'budget': 'abc'}, 400), ({'genres': 5}, 400), (records, 500)]:
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(urllib.request.Request(url, json.dumps(body).encode()), timeout=10)
+            assert error.value.code == expected_status
+            assert 'error' in json.loads(error.value.read())
+    finally:
+        server.shutdown()
+        server.server_close()